@@ -2,7 +2,12 @@
 
 import requests
 import logging
-import json
+import threading
+from requests.adapters import HTTPAdapter
+
+from api_client.batch import AddClientsMixin
+from api_client.client_index import ClientIndex, build_traffic_map
+from api_client.panel_session import looks_like_html, is_session_expired
 
 # Отключение предупреждений, связанных с SSL
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
@@ -10,15 +15,25 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
-class AlirezaAPIClient:
+# Размер пула keep-alive соединений к одной панели
+PANEL_HTTP_POOL_SIZE = 10
+
+class AlirezaAPIClient(AddClientsMixin):
     def __init__(self, panel_url='https://pay.alamornetwork.ir:2053/C2v8tOan9RYt5E9', username='sirius', password='22331144'):
         self.base_url = panel_url.rstrip('/')
         self.username = username
         self.password = password
         self.session = requests.Session()
         self.session.headers.update({'Accept': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PANEL_HTTP_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.is_logged_in = False
+        self._login_lock = threading.Lock()
+        # Увеличивается при каждом успешном входе: поток, заметивший истёкшую сессию, не входит повторно, если это уже сделал другой
+        self._login_generation = 0
         self.api_base_path = "/xui/API/inbounds"  # Стандартный путь для Alireza
+        self.client_index = ClientIndex(self.list_inbounds)
         logger.info(f"AlirezaAPIClient initialized for {self.base_url}")
 
     def _request(self, method, path, **kwargs):
@@ -27,25 +42,44 @@ class AlirezaAPIClient:
             path = '/' + path
         
         if not self.is_logged_in and path != '/login':
-            if not self.login():
+            if not self.check_login():
                 return None
 
         url = self.base_url + path
+        generation = self._login_generation
         try:
-            response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
-            if response.status_code in [401, 403]:
-                logger.warning("Authentication error. Re-logging in...")
-                if not self.login(): return None
-                response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
+            response, data = self._send(method, url, **kwargs)
+            # Сессия истекла (401/403 или страница входа): повторный вход и один повтор запроса.
+            # Ответ панели (в том числе success: false) возвращается как есть и не отправляется повторно
+            if path != '/login' and is_session_expired(response.status_code, response.text):
+                logger.warning(f"Panel session for {self.base_url} looks expired ({path}). Re-logging in...")
+                if not self._relogin(generation):
+                    return None
+                response, data = self._send(method, url, **kwargs)
 
             response.raise_for_status()
-            if not response.text:
-                return None
-            return response.json()
+            if data is None and looks_like_html(response.text):
+                logger.error(f"Panel returned an HTML page instead of JSON for {path}.")
+            return data
         except Exception as e:
             logger.error(f"Request failed for {path}: {e}")
             return None
 
+    def _send(self, method, url, **kwargs):
+        """Один запрос; возвращает (response, data), data — None для пустого тела, HTML-страницы или 401/403."""
+        response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
+        if response.status_code in (401, 403) or not response.text or looks_like_html(response.text):
+            return response, None
+        response.raise_for_status()
+        return response, response.json()
+
+    def _relogin(self, generation):
+        """Повторный вход под _login_lock, если другой поток ещё не выполнил его после generation."""
+        with self._login_lock:
+            if self.is_logged_in and self._login_generation != generation:
+                return True
+            return self.login()
+
     def login(self):
         """ --- FINAL VERSION: Smart cookie detection --- """
         self.is_logged_in = False
@@ -57,6 +91,7 @@ class AlirezaAPIClient:
             # We use the same robust check here.
             if self.session.cookies:
                 self.is_logged_in = True
+                self._login_generation += 1
                 cookie_names = '; '.join([f'{c.name}' for c in self.session.cookies])
                 logger.info(f"Successfully logged in. Found session cookie(s): {cookie_names}")
                 return True
@@ -71,13 +106,23 @@ class AlirezaAPIClient:
         """Проверка действительности входа."""
         if self.is_logged_in:
             return True
-        return self.login()
+        # Клиент общий для потоков: только один из них выполняет вход
+        with self._login_lock:
+            if self.is_logged_in:
+                return True
+            return self.login()
+
+    def close(self):
+        """Закрывает keep-alive соединения сессии."""
+        self.is_logged_in = False
+        self.session.close()
 
     def add_client(self, data):
         """Adds a new client."""
         full_path = self.api_base_path + "/addClient/"
         response_data = self._request('post', full_path, json=data)
         if response_data and response_data.get('success'):
+            self.client_index.invalidate()
             return True
         
         # --- Новый раздел для логирования ошибок панели ---
@@ -121,27 +166,32 @@ class AlirezaAPIClient:
             logger.warning(f"Failed to get traffic for client ID {client_id}")
             return None
 
+    def get_all_client_traffics(self):
+        """
+        Gets traffic of every client on the server in one list_inbounds call (from clientStats).
+        Returns a {uuid or email: stats} mapping; the same snapshot also refreshes the client index.
+        """
+        inbounds = self.list_inbounds()
+        if not inbounds:
+            return {}
+        self.client_index.rebuild_from(inbounds)
+        return build_traffic_map(inbounds)
+
     def get_client_info(self, client_id):
-        """Gets detailed information for a specific client by ID."""
+        """Gets detailed information for a specific client by ID (uuid, email or subId)."""
         if not self.check_login():
             logger.error("Not logged in to Alireza panel. Cannot get client info.")
             return None
         
-        # Сначала получаем все inbounds
-        inbounds = self.list_inbounds()
-        if not inbounds:
+        # Ищем клиента в индексе вместо перебора всех inbounds
+        entry = self.client_index.lookup(client_id)
+        if not entry:
+            logger.warning(f"Client with ID {client_id} not found")
             return None
-        
-        # Ищем клиента во всех inbounds
-        for inbound in inbounds:
-            if 'settings' in inbound and 'clients' in inbound['settings']:
-                for client in inbound['settings']['clients']:
-                    if client.get('id') == client_id or client.get('email') == client_id:
-                        # Добавляем информацию о трафике
-                        traffic_info = self.get_client_traffic_by_id(client_id)
-                        if traffic_info:
-                            client.update(traffic_info)
-                        return client
-        
-        logger.warning(f"Client with ID {client_id} not found")
-        return None
\ No newline at end of file
+        _, client = entry
+
+        # Добавляем информацию о трафике
+        traffic_info = self.get_client_traffic_by_id(client.get('id') or client_id)
+        if traffic_info and isinstance(traffic_info, dict):
+            client.update(traffic_info)
+        return client
@@ -0,0 +1,324 @@
+# api_client/async_xui_api_client.py
+
+import asyncio
+import json
+import logging
+import threading
+
+import aiohttp
+
+from api_client.batch import AsyncAddClientsMixin
+from api_client.client_index import build_traffic_map
+from api_client.panel_session import looks_like_html, is_session_expired
+
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных соединений к одной панели
+PANEL_CONNECTIONS_PER_HOST = 4
+REQUEST_TIMEOUT = 20
+
+
+class AsyncXuiAPIClient(AsyncAddClientsMixin):
+    """
+    Асинхронный клиент панели X-UI (Sanaei) на aiohttp с тем же набором методов, что и XuiAPIClient.
+    Все корутины одного клиента разделяют одну сессию (cookies входа) и пул соединений,
+    ограниченный PANEL_CONNECTIONS_PER_HOST соединениями на хост.
+    """
+
+    def __init__(self, panel_url, username, password, limit_per_host=PANEL_CONNECTIONS_PER_HOST, timeout=REQUEST_TIMEOUT):
+        self.base_url = panel_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.api_base_path = "/panel/api/inbounds"
+        self.is_logged_in = False
+        self._session = None
+        self._login_lock = None
+        self._login_generation = 0
+        # Начатые и ещё не завершённые запросы; выведенный из реестра клиент закрывается, когда их не останется
+        self._in_flight = 0
+        self._retired = False
+        logger.info(f"AsyncXuiAPIClient initialized for {self.base_url}")
+
+    def _get_session(self):
+        # Сессия создаётся внутри работающего цикла событий
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, ssl=False)
+            # unsafe=True: панели часто доступны по IP, а обычный CookieJar не хранит cookies для IP-адресов
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                headers={'Accept': 'application/json'},
+                timeout=self.timeout,
+            )
+            self._login_lock = asyncio.Lock()
+            self.is_logged_in = False
+        return self._session
+
+    async def _send(self, method, url, **kwargs):
+        async with self._get_session().request(method, url, **kwargs) as response:
+            text = await response.text()
+            return response.status, text
+
+    async def _request(self, method, path, **kwargs):
+        """Central method for sending all requests, with auto-login and one re-login when the session is dead."""
+        self._in_flight += 1
+        try:
+            return await self._do_request(method, path, **kwargs)
+        finally:
+            self._in_flight -= 1
+            if self._retired and self._in_flight == 0:
+                await self.close()
+
+    async def _do_request(self, method, path, **kwargs):
+        if not path.startswith('/'):
+            path = '/' + path
+
+        if not self.is_logged_in and path != '/login':
+            if not await self.check_login():
+                return None
+
+        url = self.base_url + path
+        generation = self._login_generation
+        try:
+            status, text = await self._send(method, url, **kwargs)
+            data = self._decode(status, text)
+            # Only 401/403 or the login page mean the request was not processed; success: false is returned as is
+            if path != '/login' and is_session_expired(status, text):
+                logger.warning(f"Panel session for {self.base_url} looks expired ({path}). Re-logging in...")
+                if not await self._relogin(generation):
+                    return None
+                status, text = await self._send(method, url, **kwargs)
+                data = self._decode(status, text)
+
+            if status >= 400:
+                logger.error(f"Request failed for {path}: HTTP {status}")
+                return None
+            if data is None and looks_like_html(text):
+                logger.error(f"Panel returned an HTML page instead of JSON for {path}.")
+            return data
+        except json.JSONDecodeError:
+            logger.error(f"Failed to decode JSON from {path}. Response: {text[:200]}")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Request failed for {path}: {e!r}")
+            return None
+
+    @staticmethod
+    def _decode(status, text):
+        if status >= 400 or not text or looks_like_html(text):
+            return None
+        return json.loads(text)
+
+    async def _relogin(self, generation):
+        """Logs in again, unless another coroutine already did it after `generation`."""
+        self._get_session()
+        async with self._login_lock:
+            if self.is_logged_in and self._login_generation != generation:
+                return True
+            return await self.login()
+
+    async def login(self):
+        self.is_logged_in = False
+        payload = {'username': self.username, 'password': self.password}
+        response_data = await self._request('post', '/login', data=payload)
+
+        if response_data and response_data.get('success'):
+            if len(self._get_session().cookie_jar) > 0:
+                self.is_logged_in = True
+                self._login_generation += 1
+                logger.info(f"Successfully logged in to {self.base_url} (async).")
+                return True
+            logger.error("Login API call was successful, but the panel did not return any session cookie.")
+            return False
+        logger.error(f"Login failed for {self.base_url}.")
+        return False
+
+    async def check_login(self):
+        """Checks the session; concurrent callers share a single login request."""
+        if self.is_logged_in:
+            return True
+        self._get_session()
+        async with self._login_lock:
+            if self.is_logged_in:
+                return True
+            return await self.login()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self.is_logged_in = False
+
+    async def retire(self):
+        """
+        Закрывает клиент, когда завершатся уже начатые запросы: клиент мог быть выдан
+        другим корутинам до удаления из реестра, и закрытие сессии оборвало бы их запросы.
+        """
+        self._retired = True
+        if self._in_flight == 0:
+            await self.close()
+
+    async def _post_action(self, endpoint, success_log, failure_log):
+        response = await self._request("POST", endpoint)
+        if response and response.get('success'):
+            logger.info(success_log)
+            return True
+        logger.warning(f"{failure_log}: {response}")
+        return False
+
+    async def list_inbounds(self):
+        response = await self._request("GET", f"{self.api_base_path}/list")
+        if response and response.get('success'):
+            return response.get('obj', [])
+        logger.error(f"Failed to get inbound list. Response: {response}")
+        return []
+
+    async def get_inbound(self, inbound_id):
+        response = await self._request("GET", f"{self.api_base_path}/get/{inbound_id}")
+        if response and response.get('success'):
+            return response.get('obj')
+        logger.error(f"Failed to get inbound details for ID {inbound_id}. Response: {response}")
+        return None
+
+    async def get_inbounds(self, inbound_ids):
+        """Fetches full details of several inbounds concurrently; failed ones are skipped."""
+        results = await asyncio.gather(*(self.get_inbound(inbound_id) for inbound_id in inbound_ids))
+        return [inbound for inbound in results if inbound]
+
+    async def add_client(self, data):
+        response = await self._request("POST", f"{self.api_base_path}/addClient", json=data)
+        if response and response.get('success'):
+            logger.info(f"Client added successfully to inbound {data.get('id', 'N/A')}.")
+            return True
+        error_msg = response.get('msg', 'Unknown') if response else "No response"
+        logger.warning(f"Failed to add client to inbound {data.get('id', 'N/A')}: {error_msg}")
+        return False
+
+    async def update_client(self, client_id, data):
+        response = await self._request("POST", f"{self.api_base_path}/updateClient/{client_id}", data=data)
+        if response and response.get('success'):
+            logger.info(f"Client {client_id} updated successfully.")
+            return True
+        logger.warning(f"Failed to update client {client_id}: {response}")
+        return False
+
+    async def delete_client(self, inbound_id, client_id):
+        return await self._post_action(
+            f"{self.api_base_path}/{inbound_id}/delClient/{client_id}",
+            f"Client {client_id} deleted from inbound ID {inbound_id}.",
+            f"Failed to delete client {client_id} from inbound ID {inbound_id}",
+        )
+
+    async def get_client_traffic_by_id(self, client_id):
+        response = await self._request("GET", f"{self.api_base_path}/getClientTrafficsById/{client_id}")
+        if response and response.get('success'):
+            traffic_data = response.get('obj', {})
+            if isinstance(traffic_data, list) and traffic_data:
+                return traffic_data[0]
+            if isinstance(traffic_data, dict):
+                return traffic_data
+            return {}
+        logger.warning(f"Failed to get traffic for client ID {client_id}")
+        return None
+
+    async def get_all_client_traffics(self):
+        """Traffic of every client on the server from one list_inbounds call: {uuid or email: stats}."""
+        return build_traffic_map(await self.list_inbounds())
+
+    async def get_online_users(self):
+        response = await self._request("POST", f"{self.api_base_path}/onlines")
+        if response and response.get('success'):
+            return response.get('obj')
+        logger.warning(f"Failed to get online users: {response}")
+        return None
+
+    async def reset_client_traffic(self, id, email):
+        return await self._post_action(
+            f"{self.api_base_path}/{id}/resetClientTraffic/{email}",
+            f"Client traffic reset for {email} in inbound {id}.",
+            f"Failed to reset client traffic for {email} in inbound {id}",
+        )
+
+    async def reset_all_traffics(self):
+        return await self._post_action(
+            f"{self.api_base_path}/resetAllTraffics",
+            "All traffics reset successfully.",
+            "Failed to reset all traffics",
+        )
+
+    async def reset_all_client_traffics(self, id):
+        return await self._post_action(
+            f"{self.api_base_path}/resetAllClientTraffics/{id}",
+            f"All client traffics reset for inbound {id}.",
+            f"Failed to reset all client traffics for inbound {id}",
+        )
+
+
+# =============================================================================
+# Синхронный фасад: общий фоновый цикл событий для вызова из обработчиков бота
+# =============================================================================
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="panel-api-loop", daemon=True).start()
+        return _loop
+
+
+# Сколько секунд синхронный вызов ждёт корутину по умолчанию (запросы к панели ограничены своими таймаутами)
+RUN_SYNC_TIMEOUT = 120
+
+
+def _on_loop_thread(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def run_sync(coro, timeout=RUN_SYNC_TIMEOUT):
+    """Выполняет корутину в общем фоновом цикле событий и ждёт результата (не дольше timeout секунд)."""
+    loop = _get_loop()
+    if _on_loop_thread(loop):
+        # Ожидание результата внутри самого цикла заблокировало бы его навсегда
+        coro.close()
+        raise RuntimeError("run_sync() must not be called from the panel-api event loop")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+def retire_async_client(client):
+    """
+    Выводит асинхронный клиент из употребления из любого потока, в том числе из корутины общего цикла:
+    сессия закрывается после завершения начатых запросов, вызывающий код этого не ждёт.
+    """
+    loop = _get_loop()
+    if _on_loop_thread(loop):
+        loop.create_task(client.retire())
+    else:
+        asyncio.run_coroutine_threadsafe(client.retire(), loop)
+
+
+class SyncXuiAPIClient:
+    """
+    Синхронная обёртка над AsyncXuiAPIClient: те же методы, что у XuiAPIClient,
+    но выполняются в общем фоновом цикле событий. Позволяет существующим обработчикам
+    вызывать асинхронный клиент без изменений.
+    """
+
+    def __init__(self, async_client: AsyncXuiAPIClient):
+        self.async_client = async_client
+
+    def __getattr__(self, name):
+        attr = getattr(self.async_client, name)
+        if asyncio.iscoroutinefunction(attr):
+            def call(*args, **kwargs):
+                return run_sync(attr(*args, **kwargs))
+            call.__name__ = name
+            return call
+        return attr
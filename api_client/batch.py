@@ -0,0 +1,51 @@
+# api_client/batch.py
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько клиентов отправляется в одном запросе addClient при пакетном добавлении
+ADD_CLIENTS_BATCH_SIZE = 100
+
+
+def _client_batches(inbound_id, clients, batch_size):
+    """Порции клиентов и тела запросов addClient для них: (batch, payload)."""
+    for start in range(0, len(clients), batch_size):
+        batch = clients[start:start + batch_size]
+        yield batch, {"id": inbound_id, "settings": json.dumps({"clients": batch})}
+
+
+def _log_stopped(inbound_id, added, clients):
+    logger.warning(f"Batch add stopped on inbound {inbound_id}: {len(added)} of {len(clients)} clients added.")
+
+
+class AddClientsMixin:
+    """Пакетное добавление клиентов для клиентов панелей с методом add_client(payload) -> bool."""
+
+    def add_clients(self, inbound_id, clients, batch_size=ADD_CLIENTS_BATCH_SIZE):
+        """
+        Adds many clients to one inbound, batch_size clients per addClient request.
+        Returns the list of clients that were actually added (a failed batch stops the process).
+        """
+        added = []
+        for batch, payload in _client_batches(inbound_id, clients, batch_size):
+            if not self.add_client(payload):
+                _log_stopped(inbound_id, added, clients)
+                break
+            added.extend(batch)
+        return added
+
+
+class AsyncAddClientsMixin:
+    """То же для асинхронных клиентов (add_client — корутина)."""
+
+    async def add_clients(self, inbound_id, clients, batch_size=ADD_CLIENTS_BATCH_SIZE):
+        """Adds many clients to one inbound in batches; returns the clients actually added."""
+        added = []
+        for batch, payload in _client_batches(inbound_id, clients, batch_size):
+            if not await self.add_client(payload):
+                _log_stopped(inbound_id, added, clients)
+                break
+            added.extend(batch)
+        return added
@@ -0,0 +1,140 @@
+# api_client/client_index.py
+
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Время жизни индекса клиентов панели (в секундах)
+CLIENT_INDEX_TTL = 60
+# При промахе индекс перестраивается, если он старше этого значения
+# (клиент мог быть создан другим процессом, например webhook-сервером)
+CLIENT_INDEX_MISS_REFRESH = 5
+
+
+def parse_inbound_clients(inbound):
+    """Возвращает список клиентов inbound; settings может быть строкой JSON или словарём."""
+    settings = inbound.get('settings') or {}
+    if isinstance(settings, str):
+        try:
+            settings = json.loads(settings)
+        except (json.JSONDecodeError, TypeError) as e:
+            logger.warning(f"Error parsing settings for inbound {inbound.get('id', 'Unknown')}: {e}")
+            return []
+    if not isinstance(settings, dict):
+        return []
+    return settings.get('clients') or []
+
+
+def _client_keys(client):
+    # uuid (vless/vmess), пароль (trojan), email и subId
+    return (client.get('id'), client.get('password'), client.get('email'), client.get('subId'))
+
+
+def build_traffic_map(inbounds):
+    """
+    Собирает трафик всех клиентов из clientStats снимка list_inbounds.
+    Возвращает {uuid или email: {'email', 'up', 'down', 'total', 'expiryTime', 'enable', 'inbound_id'}}.
+    """
+    traffic_map = {}
+    for inbound in inbounds or []:
+        inbound_id = inbound.get('id')
+        stats_by_email = {}
+        for stat in inbound.get('clientStats') or []:
+            email = stat.get('email')
+            if not email:
+                continue
+            stats_by_email[email] = {
+                'email': email,
+                'up': stat.get('up', 0) or 0,
+                'down': stat.get('down', 0) or 0,
+                'total': stat.get('total', 0) or 0,
+                'expiryTime': stat.get('expiryTime', 0) or 0,
+                'enable': stat.get('enable', True),
+                'inbound_id': stat.get('inboundId', inbound_id),
+            }
+        traffic_map.update(stats_by_email)
+        for client in parse_inbound_clients(inbound):
+            stats = stats_by_email.get(client.get('email'))
+            if stats is None:
+                continue
+            for key in _client_keys(client)[:2]:
+                if key:
+                    traffic_map.setdefault(key, stats)
+    return traffic_map
+
+
+class ClientIndex:
+    """
+    Индекс клиентов одной панели: uuid / email / subId -> (inbound_id, client).
+    Строится из одного снимка list_inbounds, перестраивается по истечении ttl
+    и сбрасывается после изменений клиентов (add/update/delete).
+    """
+
+    def __init__(self, list_inbounds, ttl=CLIENT_INDEX_TTL):
+        self._list_inbounds = list_inbounds
+        self.ttl = ttl
+        self._entries = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index_inbounds(inbounds):
+        entries = {}
+        for inbound in inbounds:
+            inbound_id = inbound.get('id')
+            for client in parse_inbound_clients(inbound):
+                entry = (inbound_id, client)
+                for key in _client_keys(client):
+                    if key:
+                        entries.setdefault(key, entry)
+        logger.info(f"Client index built: {len(inbounds)} inbounds, {len(entries)} keys.")
+        return entries
+
+    def _build(self):
+        inbounds = self._list_inbounds()
+        if not inbounds:
+            # Пустой ответ не кэшируем: панель могла быть недоступна
+            return None
+        return self._index_inbounds(inbounds)
+
+    def rebuild_from(self, inbounds):
+        """Перестраивает индекс из уже полученного снимка list_inbounds (без запроса к панели)."""
+        if not inbounds:
+            return
+        entries = self._index_inbounds(inbounds)
+        with self._lock:
+            self._entries = entries
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._entries is not None and time.monotonic() - self._built_at < self.ttl:
+            return
+        with self._lock:
+            if self._entries is not None and time.monotonic() - self._built_at < self.ttl:
+                return
+            entries = self._build()
+            if entries is not None:
+                self._entries = entries
+                self._built_at = time.monotonic()
+
+    def lookup(self, key):
+        """Возвращает (inbound_id, копия client) или None, если клиент не найден."""
+        if not key:
+            return None
+        self._ensure_fresh()
+        entry = (self._entries or {}).get(key)
+        if entry is None and self._entries is not None and time.monotonic() - self._built_at >= CLIENT_INDEX_MISS_REFRESH:
+            self.invalidate()
+            self._ensure_fresh()
+            entry = (self._entries or {}).get(key)
+        if entry is None:
+            return None
+        inbound_id, client = entry
+        return inbound_id, dict(client)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
@@ -2,27 +2,42 @@
 
 from api_client.xui_api_client import XuiAPIClient
 from api_client.alireza_api_client import AlirezaAPIClient
+from api_client.async_xui_api_client import AsyncXuiAPIClient, run_sync, retire_async_client
 # Когда мы добавим другие панели, их также импортируем сюда
 # from api_client.hiddify_api_client import HiddifyAPIClient
 
+import asyncio
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
-def get_api_client(server_info: dict):
-    """
-    Этот метод принимает информацию о сервере и,
-    в зависимости от типа панели, возвращает соответствующий API-клиент.
-    """
+# Реестр клиентов на уровне процесса: {server_id: (credentials_fingerprint, client)}
+# Клиент хранит авторизованную сессию и keep-alive соединения с панелью,
+# поэтому повторные вызовы не выполняют login заново.
+# Вытесненные из реестра синхронные клиенты не закрываются: другие потоки могут ещё выполнять
+# через них запросы, а соединения освобождаются вместе с последней ссылкой на клиента.
+_clients = {}
+_clients_lock = threading.Lock()
+# Отдельный реестр асинхронных клиентов (только для панелей x-ui): {server_id: (fingerprint, client)}
+_async_clients = {}
+
+
+def _credentials_fingerprint(server_info: dict):
+    return (
+        server_info.get('panel_type', 'x-ui').lower(),
+        server_info.get('panel_url'),
+        server_info.get('username'),
+        server_info.get('password'),
+    )
+
+
+def _create_api_client(server_info: dict):
     panel_type = server_info.get('panel_type', 'x-ui').lower()
     panel_url = server_info.get('panel_url')
     username = server_info.get('username')
     password = server_info.get('password')
 
-    if not all([panel_url, username, password]):
-        logger.error("Информация о сервере неполная. Невозможно создать API-клиент.")
-        return None
-
     if panel_type == 'alireza':
         logger.info(f"Создание AlirezaAPIClient для сервера: {server_info.get('name')}")
         return AlirezaAPIClient(panel_url=panel_url, username=username, password=password)
@@ -38,4 +53,93 @@ def get_api_client(server_info: dict):
     else:
         logger.error(f"Неизвестный тип панели: '{panel_type}'. Используется XuiAPIClient по умолчанию.")
         # Fallback to the default client if the type is unknown
-        return XuiAPIClient(panel_url=panel_url, username=username, password=password)
\ No newline at end of file
+        return XuiAPIClient(panel_url=panel_url, username=username, password=password)
+
+
+def get_api_client(server_info: dict):
+    """
+    Этот метод принимает информацию о сервере и,
+    в зависимости от типа панели, возвращает соответствующий API-клиент.
+    Клиенты переиспользуются по ID сервера и пересоздаются только при изменении его учётных данных.
+    """
+    panel_url = server_info.get('panel_url')
+    username = server_info.get('username')
+    password = server_info.get('password')
+
+    if not all([panel_url, username, password]):
+        logger.error("Информация о сервере неполная. Невозможно создать API-клиент.")
+        return None
+
+    server_id = server_info.get('id')
+    if server_id is None:
+        # Без ID сервер нельзя надёжно идентифицировать (например, при добавлении нового) — клиент не кэшируется
+        return _create_api_client(server_info)
+
+    fingerprint = _credentials_fingerprint(server_info)
+    with _clients_lock:
+        cached = _clients.get(server_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        if cached:
+            logger.info(f"Учётные данные сервера {server_id} изменились. API-клиент будет пересоздан.")
+        client = _create_api_client(server_info)
+        _clients[server_id] = (fingerprint, client)
+        return client
+
+
+def invalidate_api_client(server_id=None):
+    """Удаляет клиента сервера из реестра (или всех клиентов, если server_id не указан)."""
+    async_clients = []
+    with _clients_lock:
+        server_ids = list(set(_clients) | set(_async_clients)) if server_id is None else [server_id]
+        for s_id in server_ids:
+            _clients.pop(s_id, None)
+            cached_async = _async_clients.pop(s_id, None)
+            if cached_async:
+                async_clients.append(cached_async[1])
+    for client in async_clients:
+        retire_async_client(client)
+
+
+def get_async_api_client(server_info: dict):
+    """
+    Возвращает AsyncXuiAPIClient для сервера с панелью x-ui (или None для других панелей).
+    Клиент предназначен для общего фонового цикла событий (run_sync) и переиспользуется по ID сервера.
+    """
+    if server_info.get('panel_type', 'x-ui').lower() != 'x-ui':
+        return None
+    if not all([server_info.get('panel_url'), server_info.get('username'), server_info.get('password')]):
+        return None
+
+    server_id = server_info.get('id')
+    fingerprint = _credentials_fingerprint(server_info)
+    with _clients_lock:
+        cached = _async_clients.get(server_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        client = AsyncXuiAPIClient(server_info['panel_url'], server_info['username'], server_info['password'])
+        if server_id is not None:
+            _async_clients[server_id] = (fingerprint, client)
+    if cached:
+        # Может вызываться из корутины общего цикла (_check_server_online): закрытие не ждёт цикл синхронно
+        retire_async_client(cached[1])
+    return client
+
+
+async def _check_server_online(server_info: dict):
+    async_client = get_async_api_client(server_info)
+    if async_client:
+        return await async_client.check_login()
+    # Для панелей без асинхронного клиента выполняем синхронную проверку в пуле потоков
+    api_client = get_api_client(server_info)
+    if not api_client:
+        return False
+    return await asyncio.get_running_loop().run_in_executor(None, api_client.check_login)
+
+
+def check_servers_online(servers, timeout=60):
+    """Параллельно проверяет вход на все серверы. Возвращает {server_id: bool}."""
+    async def _check_all():
+        results = await asyncio.gather(*(_check_server_online(s) for s in servers), return_exceptions=True)
+        return {s['id']: result is True for s, result in zip(servers, results)}
+    return run_sync(_check_all(), timeout)
@@ -0,0 +1,19 @@
+# api_client/panel_session.py
+
+# Общие для клиентов X-UI и Alireza признаки того, что сессия панели больше не действительна.
+# Панель не всегда отвечает 401/403: истёкшая сессия часто даёт перенаправление на страницу
+# входа (HTML с кодом 200). Ответ JSON с success: false — обычный отказ панели (например,
+# повторяющийся email в addClient), он возвращается вызывающему коду без повторного входа.
+
+
+def looks_like_html(text):
+    """Тело ответа — HTML-страница (обычно страница входа), а не JSON API."""
+    return bool(text) and text.lstrip()[:1] == '<'
+
+
+def is_session_expired(status, text):
+    """
+    Ответ указывает на истёкшую сессию: 401/403 или страница входа вместо JSON.
+    Такой запрос панель не выполняла, поэтому после повторного входа он повторяется один раз.
+    """
+    return status in (401, 403) or looks_like_html(text)
@@ -3,6 +3,12 @@
 import requests
 import logging
 import json
+import threading
+from requests.adapters import HTTPAdapter
+
+from api_client.batch import AddClientsMixin
+from api_client.client_index import ClientIndex, build_traffic_map
+from api_client.panel_session import looks_like_html, is_session_expired
 
 # Disable SSL warnings
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
@@ -10,15 +16,25 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
-class XuiAPIClient:
+# Размер пула keep-alive соединений к одной панели
+PANEL_HTTP_POOL_SIZE = 10
+
+class XuiAPIClient(AddClientsMixin):
     def __init__(self, panel_url, username, password):
         self.base_url = panel_url.rstrip('/')
         self.username = username
         self.password = password
         self.session = requests.Session()
         self.session.headers.update({'Accept': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PANEL_HTTP_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.is_logged_in = False
+        self._login_lock = threading.Lock()
+        # Увеличивается при каждом успешном входе: поток, заметивший истёкшую сессию, не входит повторно, если это уже сделал другой
+        self._login_generation = 0
         self.api_base_path = "/panel/api/inbounds" # مسیر استاندارد سنایی
+        self.client_index = ClientIndex(self.list_inbounds)
         logger.info(f"XuiAPIClient initialized for {self.base_url}")
 
     def _request(self, method, path, **kwargs):
@@ -28,32 +44,49 @@ class XuiAPIClient:
         
         # Auto-login if not already logged in
         if not self.is_logged_in and path != '/login':
-            if not self.login():
+            if not self.check_login():
                 return None # Stop if login fails
 
         url = self.base_url + path
+        generation = self._login_generation
         try:
-            response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
+            response, data = self._send(method, url, **kwargs)
 
-            # Re-login attempt on authentication failure
-            if response.status_code in [401, 403]:
-                logger.warning("Authentication error. Re-logging in...")
-                if not self.login(): return None
-                response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
+            # Re-login attempt when the session is dead (401/403 or login page); a panel answer such as
+            # success: false is returned as is, so a request the panel already processed is never resent
+            if path != '/login' and is_session_expired(response.status_code, response.text):
+                logger.warning(f"Panel session for {self.base_url} looks expired ({path}). Re-logging in...")
+                if not self._relogin(generation):
+                    return None
+                response, data = self._send(method, url, **kwargs)
 
             response.raise_for_status() # Check for other HTTP errors (like 500)
-            if not response.text:
-                return None
-            
-            return response.json()
+            if data is None and looks_like_html(response.text):
+                logger.error(f"Panel returned an HTML page instead of JSON for {path}.")
+            return data
 
-        except json.JSONDecodeError:
-            logger.error(f"Failed to decode JSON from {path}. Response: {response.text[:200]}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to decode JSON from {path}. Response: {e.doc[:200]}")
             return None
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed for {path}: {e}")
             return None
 
+    def _send(self, method, url, **kwargs):
+        """Sends one request; returns (response, data), data is None for an empty body, an HTML page or 401/403."""
+        response = self.session.request(method, url, verify=False, timeout=20, **kwargs)
+        if response.status_code in (401, 403) or not response.text or looks_like_html(response.text):
+            return response, None
+        response.raise_for_status()
+        return response, response.json()
+
+    def _relogin(self, generation):
+        """Logs in again under _login_lock, unless another thread already did it after `generation`."""
+        with self._login_lock:
+            if self.is_logged_in and self._login_generation != generation:
+                return True
+            return self.login()
+
     def login(self):
         """ --- FINAL VERSION: Smart cookie detection --- """
         self.is_logged_in = False
@@ -65,6 +98,7 @@ class XuiAPIClient:
             # We no longer care about the cookie's name. If any cookie is set, it's a success.
             if self.session.cookies:
                 self.is_logged_in = True
+                self._login_generation += 1
                 cookie_names = '; '.join([f'{c.name}' for c in self.session.cookies])
                 logger.info(f"Successfully logged in. Found session cookie(s): {cookie_names}")
                 return True
@@ -79,18 +113,29 @@ class XuiAPIClient:
         """Checks if the session is still valid."""
         if self.is_logged_in:
             return True
-        return self.login()
+        # Клиент общий для потоков: только один из них выполняет вход
+        with self._login_lock:
+            if self.is_logged_in:
+                return True
+            return self.login()
+
+    def close(self):
+        """Closes the keep-alive connections of the session."""
+        self.is_logged_in = False
+        self.session.close()
 
     def add_client(self, data):
         """Adds a new client to an inbound."""
         response_data = self._request('post', '/panel/api/inbounds/addClient', json=data)
         if response_data and response_data.get('success'):
             logger.info(f"Client added successfully to inbound {data.get('id', 'N/A')}.")
+            self.client_index.invalidate()
             return True
         else:
             error_msg = response_data.get('msg', 'Unknown') if response_data else "No response"
             logger.warning(f"Failed to add client to inbound {data.get('id', 'N/A')}: {error_msg}")
             return False
+
     def list_inbounds(self):
         if not self.check_login(): 
             logger.error("Not logged in to X-UI. Cannot list inbounds.")
@@ -146,6 +191,7 @@ class XuiAPIClient:
         
         if response and response.get('success'):
             logger.info(f"Inbound {inbound_id} deleted successfully.")
+            self.client_index.invalidate()
             return True
         else:
             logger.warning(f"Failed to delete inbound {inbound_id}: {response}")
@@ -161,6 +207,7 @@ class XuiAPIClient:
         
         if response and response.get('success'):
             logger.info(f"Inbound {inbound_id} updated successfully.")
+            self.client_index.invalidate()
             return True
         else:
             logger.warning(f"Failed to update inbound {inbound_id}: {response}")
@@ -178,6 +225,7 @@ class XuiAPIClient:
         
         if response and response.get('success'):
             logger.info(f"Client {client_id} deleted from inbound ID {inbound_id}.")
+            self.client_index.invalidate()
             return True
         else:
             logger.warning(f"Failed to delete client {client_id} from inbound ID {inbound_id}: {response}")
@@ -193,6 +241,7 @@ class XuiAPIClient:
         
         if response and response.get('success'):
             logger.info(f"Client {client_id} updated successfully.")
+            self.client_index.invalidate()
             return True
         else:
             logger.warning(f"Failed to update client {client_id}: {response}")
@@ -355,48 +404,41 @@ class XuiAPIClient:
             logger.warning(f"Failed to get traffic for client ID {client_id}")
             return None
 
+    def get_all_client_traffics(self):
+        """
+        Gets traffic of every client on the server in one list_inbounds call (from clientStats).
+        Returns a {uuid or email: stats} mapping; the same snapshot also refreshes the client index.
+        """
+        inbounds = self.list_inbounds()
+        if not inbounds:
+            return {}
+        self.client_index.rebuild_from(inbounds)
+        return build_traffic_map(inbounds)
+
     def get_client_info(self, client_id):
-        """Gets detailed information for a specific client by ID."""
+        """Gets detailed information for a specific client by ID (uuid, email or subId)."""
         if not self.check_login():
             logger.error("Not logged in to X-UI. Cannot get client info.")
             return None
         
-        # ابتدا تمام inbounds را دریافت می‌کنیم
-        inbounds = self.list_inbounds()
-        if not inbounds:
+        # جستجو در ایندکس کلاینت‌ها به جای پیمایش تمام inbounds
+        entry = self.client_index.lookup(client_id)
+        if not entry:
+            logger.warning(f"Client with ID {client_id} not found")
             return None
+        _, client = entry
+
+        # اطلاعات ترافیک را هم اضافه می‌کنیم
+        try:
+            traffic_info = self.get_client_traffic_by_id(client.get('id') or client_id)
+            if traffic_info and isinstance(traffic_info, dict):
+                client.update(traffic_info)
+            elif traffic_info:
+                logger.warning(f"Traffic info is not a dict for client {client_id}: {type(traffic_info)}")
+        except Exception as e:
+            logger.warning(f"Error updating traffic info for client {client_id}: {e}")
         
-        # در تمام inbounds دنبال کلاینت می‌گردیم
-        for inbound in inbounds:
-            try:
-                # تبدیل settings از string به dictionary
-                if isinstance(inbound.get('settings'), str):
-                    settings = json.loads(inbound['settings'])
-                else:
-                    settings = inbound.get('settings', {})
-                
-                clients = settings.get('clients', [])
-                
-                for client in clients:
-                    if client.get('id') == client_id or client.get('email') == client_id:
-                        # اطلاعات ترافیک را هم اضافه می‌کنیم
-                        try:
-                            traffic_info = self.get_client_traffic_by_id(client_id)
-                            if traffic_info and isinstance(traffic_info, dict):
-                                client.update(traffic_info)
-                            elif traffic_info:
-                                logger.warning(f"Traffic info is not a dict for client {client_id}: {type(traffic_info)}")
-                        except Exception as e:
-                            logger.warning(f"Error updating traffic info for client {client_id}: {e}")
-                        
-                        return client
-                        
-            except (json.JSONDecodeError, TypeError) as e:
-                logger.warning(f"Error parsing settings for inbound {inbound.get('id', 'Unknown')}: {e}")
-                continue
-        
-        logger.warning(f"Client with ID {client_id} not found")
-        return None
+        return client
 
     def get_raw_inbound_data(self, inbound_id):
         """Gets raw inbound data for debugging purposes."""
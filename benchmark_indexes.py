@@ -0,0 +1,113 @@
+"""
+Бенчмарк поиска по горячим столбцам purchases/payments с индексами MANAGED_INDEXES и без них.
+
+Создаёт временную базу SQLite в памяти со 100 000 покупок (столбцы, используемые горячими запросами),
+измеряет среднее время поиска до и после создания управляемых индексов.
+Запуск: python benchmark_indexes.py [--purchases 100000] [--lookups 200]
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import random
+import sqlite3
+import time
+import uuid
+
+from database.db_manager import MANAGED_INDEXES
+
+SCHEMA = [
+    """
+    CREATE TABLE purchases (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        server_id INTEGER NOT NULL,
+        purchase_date TEXT,
+        client_uuid TEXT,
+        sub_id TEXT,
+        is_active BOOLEAN DEFAULT TRUE,
+        single_configs_json TEXT
+    )
+    """,
+    """
+    CREATE TABLE payments (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        amount REAL,
+        authority TEXT
+    )
+    """,
+]
+
+# (название, SQL, функция выбора параметра по сгенерированным данным)
+QUERIES = [
+    ("purchase by sub_id", "SELECT * FROM purchases WHERE sub_id = ?", lambda d: random.choice(d['sub_ids'])),
+    ("purchase by client_uuid", "SELECT * FROM purchases WHERE client_uuid = ?", lambda d: random.choice(d['client_uuids'])),
+    ("active uuids of user", "SELECT client_uuid FROM purchases WHERE user_id = ? AND is_active = TRUE", lambda d: random.randrange(d['users'])),
+    ("payment by authority", "SELECT * FROM payments WHERE authority = ?", lambda d: random.choice(d['authorities'])),
+]
+
+
+def populate(conn, purchases_count):
+    users = max(1, purchases_count // 4)
+    sub_ids, client_uuids, authorities = [], [], []
+    purchase_rows, payment_rows = [], []
+    for purchase_id in range(1, purchases_count + 1):
+        sub_id, client_uuid, authority = uuid.uuid4().hex[:16], str(uuid.uuid4()), uuid.uuid4().hex
+        sub_ids.append(sub_id)
+        client_uuids.append(client_uuid)
+        authorities.append(authority)
+        purchase_rows.append((
+            purchase_id, random.randrange(users), random.randrange(1, 20), f"2024-01-01 00:00:{purchase_id % 60:02d}",
+            client_uuid, sub_id, random.random() < 0.7, '["vless://..."]'
+        ))
+        payment_rows.append((purchase_id, random.randrange(users), 100000, authority))
+    conn.executemany("INSERT INTO purchases VALUES (?, ?, ?, ?, ?, ?, ?, ?)", purchase_rows)
+    conn.executemany("INSERT INTO payments VALUES (?, ?, ?, ?)", payment_rows)
+    conn.commit()
+    return {'users': users, 'sub_ids': sub_ids, 'client_uuids': client_uuids, 'authorities': authorities}
+
+
+def measure(conn, data, lookups):
+    results = {}
+    for name, sql, pick in QUERIES:
+        params = [pick(data) for _ in range(lookups)]
+        started = time.perf_counter()
+        for value in params:
+            conn.execute(sql, (value,)).fetchall()
+        results[name] = (time.perf_counter() - started) / lookups * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--purchases", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(":memory:")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    print(f"Populating {args.purchases} purchases and payments...")
+    data = populate(conn, args.purchases)
+
+    before = measure(conn, data, args.lookups)
+    started = time.perf_counter()
+    for name, table, definition in MANAGED_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+    print(f"Created {len(MANAGED_INDEXES)} managed indexes in {time.perf_counter() - started:.2f}s")
+    after = measure(conn, data, args.lookups)
+
+    print(f"\n{'query':<26}{'no index, ms':>14}{'indexed, ms':>14}{'speedup':>10}")
+    for name, _, _ in QUERIES:
+        print(f"{name:<26}{before[name]:>14.3f}{after[name]:>14.4f}{before[name] / max(after[name], 1e-9):>9.0f}x")
+
+    for name, sql, pick in QUERIES:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (pick(data),)).fetchall()
+        print(f"  {name}: {plan[-1][-1]}")
+
+
+if __name__ == "__main__":
+    main()
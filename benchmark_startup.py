@@ -0,0 +1,73 @@
+"""
+Бенчмарк холодного импорта main и webhook_server (время запуска процесса бота и воркера gunicorn).
+
+Каждый замер — отдельный процесс Python с пустыми кэшами модулей; импорт не должен создавать бота,
+соединения с базой данных и не требует .env. Дополнительно выводит самые медленные модули (-X importtime).
+Запуск: python benchmark_startup.py [--runs 5] [--top 10] [--modules main webhook_server]
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import statistics
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Измеряется только импорт модуля; интерпретатор запускается и без него (базовая линия)
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def cold_import(module):
+    """Время импорта модуля (в секундах) в новом процессе."""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=PROJECT_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module, top):
+    """Самые медленные прямые импорты по данным -X importtime: [(накопленное время в мс, имя модуля)]."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if not cumulative_us.strip().isdigit():
+            continue  # заголовок
+        # Вложенность отмечается отступом в два пробела; показываем модули не глубже первого уровня
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            entries.append((int(cumulative_us) / 1000, name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--modules", nargs="+", default=["main", "webhook_server"])
+    args = parser.parse_args()
+
+    print(f"{'module':<18}{'median, ms':>12}{'min, ms':>10}{'max, ms':>10}")
+    for module in args.modules:
+        timings = [cold_import(module) * 1000 for _ in range(args.runs)]
+        print(f"{module:<18}{statistics.median(timings):>12.1f}{min(timings):>10.1f}{max(timings):>10.1f}")
+
+    for module in args.modules:
+        print(f"\nSlowest imports for {module} (cumulative, ms):")
+        for cumulative_ms, name in slowest_imports(module, args.top):
+            print(f"  {cumulative_ms:>9.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bot_webhook.py
+# Приём обновлений Telegram через webhook (BOT_UPDATE_MODE=webhook).
+#   - python main.py: регистрирует webhook в Telegram и сам принимает обновления на TELEGRAM_WEBHOOK_LISTEN;
+#   - горизонтальное масштабирование: дополнительные процессы-приёмники за nginx
+#       .venv/bin/gunicorn --config gunicorn.conf.py --bind 127.0.0.1:8081 'bot_webhook:create_worker_app()'
+#     (только обработка обновлений; миграции и фоновые задачи остаются в main.py).
+#   Обновления одного пользователя упорядочиваются только внутри процесса (OrderedUpdateDispatcher):
+#   nginx распределяет запросы Telegram между процессами без учёта пользователя, поэтому при нескольких
+#   процессах-приёмниках быстрые последовательные действия пользователя могут обработаться одновременно
+#   (из конфликтующих изменений состояния диалога сохраняется первое). Если нужен строгий порядок,
+#   принимайте обновления одним процессом и масштабируйте его потоками (BOT_WORKER_THREADS).
+
+import hmac
+import json
+import logging
+
+import telebot
+from flask import Flask, request, Response
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def create_app(bot):
+    """Flask-приложение, принимающее обновления Telegram и передающее их в пул обработчиков бота."""
+    app = Flask(__name__)
+
+    @app.route(config.TELEGRAM_WEBHOOK_PATH, methods=['POST'])
+    def telegram_webhook():
+        # Telegram присылает секрет, указанный при setWebhook, в каждом запросе
+        received_secret = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not config.TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(received_secret, config.TELEGRAM_WEBHOOK_SECRET):
+            logger.warning(f"Rejected Telegram webhook request from {request.remote_addr}: invalid secret token")
+            return Response("Forbidden", status=403)
+
+        try:
+            update = telebot.types.Update.de_json(request.get_data(as_text=True))
+        except Exception as e:
+            logger.error(f"Could not parse Telegram update: {e}")
+            return Response("Bad request", status=400)
+
+        # Обновление ставится в очередь диспетчера бота (OrderedTeleBot), ответ Telegram уходит сразу
+        bot.process_new_updates([update])
+        return Response("OK", status=200)
+
+    @app.route('/telegram/health', methods=['GET'])
+    def telegram_webhook_health():
+        return Response("OK", status=200)
+
+    @app.route('/telegram/metrics', methods=['GET'])
+    def telegram_webhook_metrics():
+        # Метрики очереди обработки этого процесса; доступ по тому же секрету
+        received_secret = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not config.TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(received_secret, config.TELEGRAM_WEBHOOK_SECRET):
+            return Response("Forbidden", status=403)
+        dispatcher = getattr(bot, 'dispatcher', None)
+        stats = dispatcher.stats() if dispatcher else {}
+        return Response(json.dumps(stats), status=200, mimetype='application/json')
+
+    return app
+
+
+def set_telegram_webhook(bot):
+    """Регистрирует webhook в Telegram. Возвращает False, если режим webhook не настроен или Telegram отказал."""
+    if not config.WEBHOOK_DOMAIN:
+        logger.error("WEBHOOK_DOMAIN is not set; webhook mode requires a configured HTTPS domain.")
+        return False
+    if not config.TELEGRAM_WEBHOOK_SECRET:
+        logger.error("TELEGRAM_WEBHOOK_SECRET is not set; refusing to accept unauthenticated webhook updates.")
+        return False
+    url = f"https://{config.WEBHOOK_DOMAIN}{config.TELEGRAM_WEBHOOK_PATH}"
+    try:
+        bot.remove_webhook()
+        if not bot.set_webhook(url=url, secret_token=config.TELEGRAM_WEBHOOK_SECRET, max_connections=config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS):
+            logger.error(f"Telegram rejected webhook {url}")
+            return False
+    except Exception as e:
+        logger.error(f"Could not set Telegram webhook {url}: {e}")
+        return False
+    logger.info(f"Telegram webhook set to {url}")
+    return True
+
+
+def serve(app):
+    """Принимает обновления в текущем процессе (многопоточный WSGI-сервер на TELEGRAM_WEBHOOK_LISTEN)."""
+    from werkzeug.serving import make_server
+
+    host, port = config.TELEGRAM_WEBHOOK_LISTEN.rsplit(':', 1)
+    server = make_server(host, int(port), app, threaded=True)
+    logger.info(f"Bot is now receiving updates via webhook on {config.TELEGRAM_WEBHOOK_LISTEN}...")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        logger.info("Bot webhook server stopped.")
+
+
+def create_worker_app():
+    """Точка входа gunicorn для дополнительных процессов-приёмников обновлений."""
+    import main
+    main.setup_logging()
+    main.register_handlers()
+    return create_app(main.get_bot())
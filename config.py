@@ -1,110 +1,186 @@
 # config.py (Финальная версия с продвинутой отладкой)
+# Настройки читаются из .env при первом обращении (get_settings), а не при импорте модуля:
+# `from config import X` и config.X работают как раньше через __getattr__ модуля.
+# Проверку .env и обязательных переменных выполняет validate_settings() при запуске процесса.
 
 import os
 import re
 import sys
+import logging
+import functools
 from pathlib import Path
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+ENV_PATH = Path(__file__).parent.resolve() / '.env'
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> dict:
+    """Загружает .env (один раз за процесс) и возвращает все настройки в виде словаря."""
+    if ENV_PATH.is_file():
+        load_dotenv(dotenv_path=ENV_PATH, override=True)
+    return _read_settings()
+
+
+def _read_settings():
+    # Настройки Telegram-бота
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+    # Умный и надёжный код для чтения ID администраторов
+    admin_ids_str = os.getenv("ADMIN_IDS", "")
+    try:
+        ADMIN_IDS = [int(s) for s in re.findall(r'\d+', admin_ids_str)]
+    except Exception as e:
+        logger.warning(f"Could not parse admin IDs from '{admin_ids_str}': {e}")
+        ADMIN_IDS = []
+
+    # Настройки базы данных
+    DB_TYPE = os.getenv("DB_TYPE", "sqlite")
+
+    if DB_TYPE == "postgres":
+        # Чтение новых переменных для PostgreSQL
+        DB_NAME = os.getenv("DB_NAME")
+        DB_USER = os.getenv("DB_USER")
+        DB_PASSWORD = os.getenv("DB_PASSWORD")
+        DB_HOST = os.getenv("DB_HOST", "localhost")
+        DB_PORT = os.getenv("DB_PORT", "5432")
+        DATABASE_NAME = None  # Не используется для PostgreSQL
+    else:
+        # Старая логика для SQLite (для совместимости в будущем)
+        DATABASE_NAME = os.getenv("DATABASE_NAME", "database/freenet_vpn.db")
+        DB_NAME = None
+        DB_USER = None
+        DB_PASSWORD = None
+        DB_HOST = None
+        DB_PORT = None
+
+    # Настройки пула соединений с базой данных (общий для бота и webhook-сервера в рамках процесса)
+    DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    # Как часто (в секундах) кэш настроек сверяет версию с базой данных
+    SETTINGS_CACHE_CHECK_INTERVAL = float(os.getenv("SETTINGS_CACHE_CHECK_INTERVAL", "5"))
+    # Размер порции при потоковом чтении больших таблиц (серверные курсоры PostgreSQL / fetchmany в SQLite)
+    DB_STREAM_FETCH_SIZE = int(os.getenv("DB_STREAM_FETCH_SIZE", "1000"))
+    # Интервал (в секундах) фонового сбора трафика со всех серверов; 0 отключает сборщик
+    TRAFFIC_COLLECT_INTERVAL = int(os.getenv("TRAFFIC_COLLECT_INTERVAL", "300"))
+    # Кнопка «Обновить трафик» опрашивает сервер покупки не чаще одного раза за столько секунд
+    TRAFFIC_REFRESH_MIN_INTERVAL = int(os.getenv("TRAFFIC_REFRESH_MIN_INTERVAL", "60"))
+    # Кэш готовых подписок (/sub/<sub_id>) в памяти webhook-сервера: максимум записей и время жизни (в секундах)
+    SUBSCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv("SUBSCRIPTION_CACHE_MAX_ENTRIES", "10000"))
+    SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))
+    # Как часто (в секундах) запись кэша подписки сверяется с покупкой в базе (configs_hash, is_active)
+    SUBSCRIPTION_CACHE_REVALIDATE_INTERVAL = float(os.getenv("SUBSCRIPTION_CACHE_REVALIDATE_INTERVAL", "10"))
+    # Интервал автообновления подписки для клиентов v2ray (заголовок Profile-Update-Interval, в часах)
+    SUBSCRIPTION_UPDATE_INTERVAL_HOURS = int(os.getenv("SUBSCRIPTION_UPDATE_INTERVAL_HOURS", "12"))
+    # Сколько секунд запрос подписки ждёт получения конфигураций из панели, если их ещё нет в базе
+    SUBSCRIPTION_REFRESH_WAIT = float(os.getenv("SUBSCRIPTION_REFRESH_WAIT", "10"))
+    # Очередь фоновых задач (таблица background_jobs): число рабочих потоков в боте и интервал опроса (в секундах)
+    JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "2"))
+    JOB_QUEUE_POLL_INTERVAL = float(os.getenv("JOB_QUEUE_POLL_INTERVAL", "1"))
+    # Массовая рассылка: число потоков отправки и общий лимит сообщений в секунду (Telegram допускает около 30)
+    BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+    # Хранилище состояний диалогов: "database" (общее для всех процессов, переживает перезапуск) или "memory"
+    STATE_STORE_BACKEND = os.getenv("STATE_STORE_BACKEND", "database").lower()
+    # Через сколько секунд без изменений незавершённый диалог считается брошенным и его состояние удаляется
+    CONVERSATION_STATE_TTL = int(os.getenv("CONVERSATION_STATE_TTL", "21600"))
+
+    # Настройки шифрования
+    ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
+
+    # --- Дополнительные настройки ---
+    SUPPORT_CHANNEL_LINK = os.getenv("SUPPORT_CHANNEL_LINK", "https://t.me/YourSupportChannel")
+    REQUIRED_CHANNEL_ID_STR = os.getenv("REQUIRED_CHANNEL_ID")
+    REQUIRED_CHANNEL_ID = int(REQUIRED_CHANNEL_ID_STR) if REQUIRED_CHANNEL_ID_STR and REQUIRED_CHANNEL_ID_STR.lstrip('-').isdigit() else None
+    REQUIRED_CHANNEL_LINK = os.getenv("REQUIRED_CHANNEL_LINK", "https://t.me/YourChannelLink")
+    MAX_API_RETRIES = 3
+    # Настройки платёжного шлюза
+    WEBHOOK_DOMAIN = os.getenv("WEBHOOK_DOMAIN")
+    ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID")
+    ZARINPAL_SANDBOX = os.getenv("ZARINPAL_SANDBOX", "False").lower() in ['true', '1', 't']
+    BOT_USERNAME = os.getenv("BOT_USERNAME", "YourBotUsername")
+    # Ключ административных endpoint'ов webhook-сервера (Authorization: Bearer ...); пустой — endpoint'ы отключены
+    ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+    # Получение обновлений ботом: "polling" (по умолчанию) или "webhook" (через nginx и домен WEBHOOK_DOMAIN)
+    BOT_UPDATE_MODE = os.getenv("BOT_UPDATE_MODE", "polling").lower()
+    # Число потоков, выполняющих обработчики бота (обновления одного пользователя упорядочены только внутри процесса)
+    BOT_WORKER_THREADS = int(os.getenv("BOT_WORKER_THREADS", "8"))
+    # Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+    TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+    # Адрес, на котором бот принимает обновления от nginx
+    TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "127.0.0.1:8081")
+    TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+
+    return {name: value for name, value in locals().items() if name.isupper()}
+
+
+def __getattr__(name):
+    # Служебные имена (__path__, __file__ ...) запрашиваются механизмом импорта — .env при этом не читается
+    if name.startswith('__'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    settings = get_settings()
+    if name in settings:
+        return settings[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(get_settings()))
+
+
 # =============================================================================
 # SECTION: Продвинутая отладка файла .env
 # =============================================================================
-print("\n--- Начало отладки файла .env ---")
-env_path = Path(__file__).parent.resolve() / '.env'
-print(f"1. Ожидаемый абсолютный путь для файла .env:\n   {env_path}")
-
-# --- Проверка шага 1: Существует ли файл? ---
-if not env_path.exists():
-    print("\n2. ❌ Результат: Неудача!")
-    print("   Причина: Файл .env не существует по указанному пути.")
-    print("   Решение: Убедитесь, что файл с точным именем '.env' (с точкой в начале) находится в корневой папке проекта.")
-    sys.exit(1) # Выход из программы
-print("2. ✅ Результат: Файл .env найден.")
-
-# --- Проверка шага 2: Является ли это файлом (а не папкой)? ---
-if not env_path.is_file():
-    print("\n3. ❌ Результат: Неудача!")
-    print("   Причина: Найденный путь не является файлом, а является папкой.")
-    sys.exit(1) # Выход из программы
-print("3. ✅ Результат: Найденный путь является файлом.")
-
-# --- Проверка шага 3: Является ли файл читаемым и содержит ли данные? ---
-try:
-    content = env_path.read_text(encoding='utf-8')
-    if not content.strip():
-        print("\n4. ❌ Результат: Неудача!")
-        print("   Причина: Файл .env пуст.")
+def validate_settings():
+    """
+    Проверяет файл .env и обязательные переменные при запуске бота или webhook-сервера.
+    При ошибке печатает причину и завершает процесс.
+    """
+    print("\n--- Начало отладки файла .env ---")
+    print(f"1. Ожидаемый абсолютный путь для файла .env:\n   {ENV_PATH}")
+
+    # --- Проверка шага 1: Существует ли файл? ---
+    if not ENV_PATH.exists():
+        print("\n2. ❌ Результат: Неудача!")
+        print("   Причина: Файл .env не существует по указанному пути.")
+        print("   Решение: Убедитесь, что файл с точным именем '.env' (с точкой в начале) находится в корневой папке проекта.")
         sys.exit(1) # Выход из программы
-    print("4. ✅ Результат: Файл .env читаем и содержит данные.")
-    print("\n--- Содержимое, прочитанное из файла .env ---")
-    print(content)
-    print("--------------------------------------\n")
-except Exception as e:
-    print(f"\n4. ❌ Результат: Неудача!")
-    print(f"   Причина: Произошла ошибка при чтении файла: {e}")
-    print("   Решение: Проверьте права доступа к файлу (Permissions). Также убедитесь, что файл сохранён в кодировке UTF-8.")
-    sys.exit(1) # Выход из программы
+    print("2. ✅ Результат: Файл .env найден.")
 
-# =============================================================================
-# SECTION: Загрузка и обработка переменных
-# =============================================================================
-# Теперь, когда мы уверены в наличии файла, загружаем его
-load_dotenv(dotenv_path=env_path, override=True)
-
-print("✅ Переменные из файла .env загружены. Обработка...")
-
-# Настройки Telegram-бота
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-# Умный и надёжный код для чтения ID администраторов
-admin_ids_str = os.getenv("ADMIN_IDS", "")
-try:
-    ADMIN_IDS = [int(s) for s in re.findall(r'\d+', admin_ids_str)]
-except Exception as e:
-    print(f"Warning: Could not parse admin IDs from '{admin_ids_str}': {e}")
-    ADMIN_IDS = []
-
-# Настройки базы данных
-DB_TYPE = os.getenv("DB_TYPE", "sqlite")
-
-if DB_TYPE == "postgres":
-    # Чтение новых переменных для PostgreSQL
-    DB_NAME = os.getenv("DB_NAME")
-    DB_USER = os.getenv("DB_USER")
-    DB_PASSWORD = os.getenv("DB_PASSWORD")
-    DB_HOST = os.getenv("DB_HOST", "localhost")
-    DB_PORT = os.getenv("DB_PORT", "5432")
-    DATABASE_NAME = None  # Не используется для PostgreSQL
-else:
-    # Старая логика для SQLite (для совместимости в будущем)
-    DATABASE_NAME = os.getenv("DATABASE_NAME", "database/freenet_vpn.db")
-    DB_NAME = None
-    DB_USER = None
-    DB_PASSWORD = None
-    DB_HOST = None
-    DB_PORT = None
-
-# Настройки шифрования
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
-
-# Проверка наличия критических переменных
-if not BOT_TOKEN or not ADMIN_IDS or not ENCRYPTION_KEY:
-    print("="*60)
-    print("❌ Критическая ошибка: Одна или несколько основных переменных (BOT_TOKEN, ADMIN_IDS, ENCRYPTION_KEY) не найдены в файле .env или имеют пустое значение.")
-    print("Пожалуйста, проверьте содержимое файла .env, которое было напечатано выше.")
-    print("="*60)
-    sys.exit(1)
-
-print(f"✅ Обнаруженные администраторы: {ADMIN_IDS}")
-
-# --- Дополнительные настройки ---
-SUPPORT_CHANNEL_LINK = os.getenv("SUPPORT_CHANNEL_LINK", "https://t.me/YourSupportChannel")
-REQUIRED_CHANNEL_ID_STR = os.getenv("REQUIRED_CHANNEL_ID")
-REQUIRED_CHANNEL_ID = int(REQUIRED_CHANNEL_ID_STR) if REQUIRED_CHANNEL_ID_STR and REQUIRED_CHANNEL_ID_STR.lstrip('-').isdigit() else None
-REQUIRED_CHANNEL_LINK = os.getenv("REQUIRED_CHANNEL_LINK", "https://t.me/YourChannelLink")
-MAX_API_RETRIES = 3
-# Настройки платёжного шлюза
-WEBHOOK_DOMAIN = os.getenv("WEBHOOK_DOMAIN")
-ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID")
-ZARINPAL_SANDBOX = os.getenv("ZARINPAL_SANDBOX", "False").lower() in ['true', '1', 't']
-BOT_USERNAME = os.getenv("BOT_USERNAME", "YourBotUsername")
\ No newline at end of file
+    # --- Проверка шага 2: Является ли это файлом (а не папкой)? ---
+    if not ENV_PATH.is_file():
+        print("\n3. ❌ Результат: Неудача!")
+        print("   Причина: Найденный путь не является файлом, а является папкой.")
+        sys.exit(1) # Выход из программы
+    print("3. ✅ Результат: Найденный путь является файлом.")
+
+    # --- Проверка шага 3: Является ли файл читаемым и содержит ли данные? ---
+    # Содержимое не печатается: в .env хранятся токен бота, ключ шифрования и пароль базы данных
+    try:
+        content = ENV_PATH.read_text(encoding='utf-8')
+        if not content.strip():
+            print("\n4. ❌ Результат: Неудача!")
+            print("   Причина: Файл .env пуст.")
+            sys.exit(1) # Выход из программы
+        print("4. ✅ Результат: Файл .env читаем и содержит данные.")
+    except Exception as e:
+        print(f"\n4. ❌ Результат: Неудача!")
+        print(f"   Причина: Произошла ошибка при чтении файла: {e}")
+        print("   Решение: Проверьте права доступа к файлу (Permissions). Также убедитесь, что файл сохранён в кодировке UTF-8.")
+        sys.exit(1) # Выход из программы
+
+    settings = get_settings()
+    # Проверка наличия критических переменных
+    if not settings['BOT_TOKEN'] or not settings['ADMIN_IDS'] or not settings['ENCRYPTION_KEY']:
+        print("="*60)
+        print("❌ Критическая ошибка: Одна или несколько основных переменных (BOT_TOKEN, ADMIN_IDS, ENCRYPTION_KEY) не найдены в файле .env или имеют пустое значение.")
+        print("Пожалуйста, проверьте содержимое файла .env.")
+        print("="*60)
+        sys.exit(1)
+
+    print(f"✅ Обнаруженные администраторы: {settings['ADMIN_IDS']}")
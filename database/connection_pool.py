@@ -0,0 +1,162 @@
+# database/connection_pool.py
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Свободное соединение не появилось в пуле за отведённое время."""
+
+
+class PooledConnection:
+    """
+    Обёртка над соединением из пула.
+    Все атрибуты делегируются настоящему соединению, а close() и выход из блока with
+    возвращают соединение в пул вместо его закрытия.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Та же семантика, что у psycopg2/sqlite3: commit при успехе, rollback при ошибке
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        """Возвращает соединение в пул. Повторный вызов ничего не делает."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.putconn(self._conn)
+
+
+class ConnectionPool:
+    """
+    Ограниченный потокобезопасный пул соединений.
+    Соединения создаются лениво до max_size; при исчерпании пула getconn() ждёт
+    освобождения соединения не дольше timeout секунд.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30, health_check=None, health_check_interval=30):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self._connect = connect
+        self._health_check = health_check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+
+        self._idle = []  # [(conn, released_at)]
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+        logger.info(f"Connection pool created (min={min_size}, max={max_size})")
+
+    @property
+    def size(self):
+        with self._cond:
+            return len(self._idle) + self._in_use
+
+    def _is_healthy(self, conn, idle_since):
+        if getattr(conn, 'closed', 0):
+            return False
+        if self._health_check is None or time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            self._health_check(conn)
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled connection failed health check, discarding: {e}")
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """Выдаёт проверенное соединение из пула, при необходимости создавая новое."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn, idle_since = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"No free database connection within {self.timeout}s (max={self.max_size})")
+                self._cond.wait(remaining)
+
+        # Подключение и проверка выполняются вне блокировки, чтобы не задерживать другие потоки
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию."""
+        keep = not self._closed and not getattr(conn, 'closed', 0)
+        if keep:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Could not reset pooled connection, discarding: {e}")
+                keep = False
+        if not keep:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Закрывает все свободные соединения; занятые будут закрыты при возврате."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+        logger.info("Connection pool closed.")
@@ -6,28 +6,68 @@ import logging
 from cryptography.fernet import Fernet
 import os
 import json
+import hashlib
 import sqlite3
-from config import ENCRYPTION_KEY, DB_TYPE, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DATABASE_NAME
+import atexit
+import functools
+import threading
+import uuid
+import config
+from database.connection_pool import ConnectionPool
+from database.settings_cache import SettingsCache, SETTINGS_VERSION_KEY, MESSAGES_VERSION_KEY
+from database.subscription_cache import SubscriptionCache
+from database.server_registry import ServerRegistry, ENCRYPTED_SERVER_FIELDS
 
 logger = logging.getLogger(__name__)
 
+# Управляемый набор индексов горячих запросов: (имя, таблица, определение).
+# Создаётся ensure_indexes() при миграциях; частичные индексы покрывают только активные покупки.
+MANAGED_INDEXES = [
+    # /sub/<sub_id> — каждый опрос подписки
+    ("idx_purchases_sub_id", "purchases", "(sub_id) WHERE sub_id IS NOT NULL"),
+    # get_purchase_by_client_uuid
+    ("idx_purchases_client_uuid", "purchases", "(client_uuid)"),
+    # get_all_client_uuids_for_user, услуги пользователя: user_id AND is_active
+    ("idx_purchases_user_active", "purchases", "(user_id) WHERE is_active = TRUE"),
+    # Сборщик трафика и массовое обновление: активные покупки сервера / по дате
+    ("idx_purchases_server_active", "purchases", "(server_id) WHERE is_active = TRUE"),
+    ("idx_purchases_active_by_date", "purchases", "(purchase_date DESC) WHERE is_active = TRUE"),
+    # payment_verify: поиск платежа по authority
+    ("idx_payments_authority", "payments", "(authority)"),
+]
+
+
 class DatabaseManager:
+    # Пулы соединений общие для всех экземпляров DatabaseManager в процессе.
+    # Ключ включает PID, поэтому дочерние процессы (воркеры) создают собственные пулы.
+    _pools = {}
+    _pools_lock = threading.Lock()
+    _settings_caches = {}
+    _subscription_caches = {}
+    _server_registries = {}
+
     def __init__(self):
-        self.db_type = DB_TYPE
+        self.db_type = config.DB_TYPE
         if self.db_type == "postgres":
-            self.db_name = DB_NAME
-            self.db_user = DB_USER
-            self.db_password = DB_PASSWORD
-            self.db_host = DB_HOST
-            self.db_port = DB_PORT
+            self.db_name = config.DB_NAME
+            self.db_user = config.DB_USER
+            self.db_password = config.DB_PASSWORD
+            self.db_host = config.DB_HOST
+            self.db_port = config.DB_PORT
             logger.info(f"DatabaseManager initialized for PostgreSQL DB: {self.db_name}")
         else:
-            self.db_path = DATABASE_NAME
+            self.db_path = config.DATABASE_NAME
             logger.info(f"DatabaseManager initialized for SQLite DB: {self.db_path}")
-        
-        self.fernet = Fernet(ENCRYPTION_KEY.encode('utf-8'))
+        self._fernet = None
 
-    def _get_connection(self):
+    @property
+    def fernet(self):
+        # Создаётся при первом шифровании/расшифровке: импорт модулей и создание менеджера не требуют ключа
+        if self._fernet is None:
+            self._fernet = Fernet(config.ENCRYPTION_KEY.encode('utf-8'))
+        return self._fernet
+
+    def _create_raw_connection(self):
         """Establishes a new connection to the database."""
         if self.db_type == "postgres":
             return psycopg2.connect(
@@ -35,7 +75,72 @@ class DatabaseManager:
                 host=self.db_host, port=self.db_port
             )
         else:
-            return sqlite3.connect(self.db_path)
+            # Соединение из пула может использоваться разными потоками (по очереди)
+            return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def _pool_key(self):
+        target = (self.db_host, self.db_port, self.db_name, self.db_user) if self.db_type == "postgres" else self.db_path
+        return (self.db_type, target, os.getpid())
+
+    def _get_pool(self):
+        key = self._pool_key()
+        pool = DatabaseManager._pools.get(key)
+        if pool is not None:
+            return pool
+        with DatabaseManager._pools_lock:
+            pool = DatabaseManager._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    self._create_raw_connection,
+                    min_size=config.DB_POOL_MIN_SIZE,
+                    max_size=config.DB_POOL_MAX_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    health_check=lambda conn: conn.cursor().execute("SELECT 1"),
+                )
+                DatabaseManager._pools[key] = pool
+        return pool
+
+    def _get_connection(self):
+        """Выдаёт соединение из общего пула. close() или выход из with возвращает его в пул."""
+        return self._get_pool().getconn()
+
+    def _stream_rows(self, sql, params=(), fetch_size=None):
+        """
+        Генератор строк (dict) запроса без загрузки всего результата в память.
+        PostgreSQL: именованный (серверный) курсор, строки приходят порциями по fetch_size.
+        SQLite: порции через fetchmany. Соединение занято до конца итерации (или закрытия генератора).
+        """
+        fetch_size = fetch_size or config.DB_STREAM_FETCH_SIZE
+        with self._get_connection() as conn:
+            if self.db_type == "postgres":
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.itersize = fetch_size
+                    cursor.execute(sql, params)
+                    for row in cursor:
+                        yield dict(row)
+            else:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                try:
+                    cursor.execute(sql.replace('%s', '?'), params)
+                    while True:
+                        rows = cursor.fetchmany(fetch_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield dict(row)
+                finally:
+                    cursor.close()
+
+    @classmethod
+    def close_all_pools(cls):
+        """Корректно закрывает все пулы соединений текущего процесса."""
+        with cls._pools_lock:
+            pools = [key_pool for key_pool in cls._pools.items() if key_pool[0][2] == os.getpid()]
+            for key, _ in pools:
+                del cls._pools[key]
+        for _, pool in pools:
+            pool.closeall()
 
     def _encrypt(self, data: str) -> str:
         if data is None: return None
@@ -61,7 +166,9 @@ class DatabaseManager:
                 username TEXT,
                 is_admin BOOLEAN DEFAULT FALSE, 
                 join_date TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                last_activity TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                is_blocked BOOLEAN DEFAULT FALSE,
+                blocked_at TIMESTAMPTZ
             );
             """,
             """
@@ -161,6 +268,8 @@ class DatabaseManager:
                 is_active BOOLEAN DEFAULT TRUE,
                 UNIQUE (server_id, inbound_id)
             )
+            """,
+            """
             CREATE TABLE IF NOT EXISTS profile_inbounds (
                 id SERIAL PRIMARY KEY,
                 profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
@@ -183,7 +292,9 @@ class DatabaseManager:
                 client_email TEXT,
                 sub_id TEXT,
                 is_active BOOLEAN DEFAULT TRUE,
-                single_configs_json TEXT
+                single_configs_json TEXT,
+                configs_hash TEXT,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
             )
             """,
             """
@@ -207,6 +318,52 @@ class DatabaseManager:
                 authority TEXT,
                 ref_id TEXT
             )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS traffic_snapshots (
+                purchase_id INTEGER PRIMARY KEY REFERENCES purchases(id) ON DELETE CASCADE,
+                server_id INTEGER NOT NULL,
+                client_uuid TEXT,
+                up BIGINT DEFAULT 0,
+                down BIGINT DEFAULT 0,
+                total BIGINT DEFAULT 0,
+                expiry_time BIGINT DEFAULT 0,
+                enable BOOLEAN DEFAULT TRUE,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS traffic_sync_status (
+                server_id INTEGER PRIMARY KEY,
+                synced_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT,
+                result TEXT,
+                total INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                succeeded INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1,
+                expires_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (namespace, key)
+            )
             """
         ]
         
@@ -238,16 +395,35 @@ class DatabaseManager:
         if not server_row:
             return None
         server_dict = dict(server_row)
-        try:
-            server_dict['panel_url'] = self._decrypt(server_dict['panel_url'])
-            server_dict['username'] = self._decrypt(server_dict['username'])
-            server_dict['password'] = self._decrypt(server_dict['password'])
-            server_dict['subscription_base_url'] = self._decrypt(server_dict['subscription_base_url'])
-            server_dict['subscription_path_prefix'] = self._decrypt(server_dict['subscription_path_prefix'])
-            return server_dict
-        except Exception as e:
-            logger.error(f"Could not decrypt credentials for server ID {server_dict.get('id')}: {e}")
-            return None
+        # Расшифровка (пять операций Fernet) выполняется один раз на версию учётных данных сервера
+        registry = self.get_server_registry()
+        fingerprint = registry.fingerprint(server_dict)
+        decrypted = registry.get(server_dict.get('id'), fingerprint)
+        if decrypted is None:
+            try:
+                decrypted = {field: self._decrypt(server_dict[field]) for field in ENCRYPTED_SERVER_FIELDS}
+            except Exception as e:
+                logger.error(f"Could not decrypt credentials for server ID {server_dict.get('id')}: {e}")
+                return None
+            registry.put(server_dict.get('id'), fingerprint, decrypted)
+        server_dict.update(decrypted)
+        return server_dict
+
+    def get_server_registry(self):
+        """Реестр расшифрованных учётных данных серверов, общий для всех экземпляров DatabaseManager в процессе."""
+        key = self._pool_key()
+        registry = DatabaseManager._server_registries.get(key)
+        if registry is None:
+            with DatabaseManager._pools_lock:
+                registry = DatabaseManager._server_registries.setdefault(key, ServerRegistry())
+        return registry
+
+    def invalidate_server(self, server_id=None):
+        """
+        Удаляет расшифрованные данные сервера из реестра процесса (после удаления сервера).
+        Изменённые учётные данные определяются автоматически по шифротексту.
+        """
+        self.get_server_registry().invalidate(server_id)
 
     # --- User Functions ---
     def add_or_update_user(self, telegram_id, first_name, last_name=None, username=None):
@@ -258,7 +434,9 @@ class DatabaseManager:
                 first_name = EXCLUDED.first_name,
                 last_name = EXCLUDED.last_name,
                 username = EXCLUDED.username,
-                last_activity = CURRENT_TIMESTAMP
+                last_activity = CURRENT_TIMESTAMP,
+                is_blocked = FALSE,
+                blocked_at = NULL
             RETURNING id;
         """
         try:
@@ -273,6 +451,13 @@ class DatabaseManager:
             logger.error(f"Error adding/updating user {telegram_id}: {e}")
             return None
 
+    def iter_users(self, fetch_size=None):
+        """Потоковый вариант get_all_users."""
+        return self._stream_rows(
+            "SELECT id, telegram_id, first_name, username, join_date, is_admin, balance FROM users ORDER BY id DESC",
+            fetch_size=fetch_size
+        )
+
     def get_all_users(self):
         try:
             with self._get_connection() as conn:
@@ -284,6 +469,89 @@ class DatabaseManager:
             logger.error(f"Error getting all users: {e}")
             return []
 
+    def count_users(self):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM users")
+                    return cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.error(f"Error counting users: {e}")
+            return 0
+
+    def get_users_page(self, limit=20, after_id=None, before_id=None):
+        """
+        Страница пользователей в порядке get_all_users (новые первыми) с keyset-пагинацией по users.id:
+        after_id — следующая страница после пользователя с этим id, before_id — предыдущая страница.
+        Возвращает (users, has_more): has_more говорит, есть ли ещё пользователи в направлении листания.
+        """
+        columns = "id, telegram_id, first_name, username, join_date, is_admin, balance, role"
+        if before_id is not None:
+            sql = f"SELECT {columns} FROM users WHERE id > %s ORDER BY id ASC LIMIT %s"
+            params = (before_id, limit + 1)
+        elif after_id is not None:
+            sql = f"SELECT {columns} FROM users WHERE id < %s ORDER BY id DESC LIMIT %s"
+            params = (after_id, limit + 1)
+        else:
+            sql = f"SELECT {columns} FROM users ORDER BY id DESC LIMIT %s"
+            params = (limit + 1,)
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute(sql, params)
+                    users = [dict(user) for user in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error(f"Error getting users page: {e}")
+            return [], False
+        has_more = len(users) > limit
+        users = users[:limit]
+        if before_id is not None:
+            users.reverse()
+        return users, has_more
+
+    def get_broadcast_recipients(self, after_telegram_id=0, limit=500):
+        """Следующая порция получателей рассылки (по возрастанию telegram_id), без заблокировавших бота."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT telegram_id FROM users
+                        WHERE telegram_id > %s AND is_blocked IS NOT TRUE
+                        ORDER BY telegram_id
+                        LIMIT %s
+                    """, (after_telegram_id, limit))
+                    return [row[0] for row in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error(f"Error getting broadcast recipients: {e}")
+            return []
+
+    def count_broadcast_recipients(self):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM users WHERE is_blocked IS NOT TRUE")
+                    return cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.error(f"Error counting broadcast recipients: {e}")
+            return 0
+
+    def mark_users_blocked(self, telegram_ids):
+        """Помечает пользователей, заблокировавших бота (или удалённых); при следующем /start отметка снимается."""
+        if not telegram_ids:
+            return 0
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE users SET is_blocked = TRUE, blocked_at = CURRENT_TIMESTAMP WHERE telegram_id = ANY(%s)",
+                        (list(telegram_ids),)
+                    )
+                    conn.commit()
+                    return cursor.rowcount
+        except psycopg2.Error as e:
+            logger.error(f"Error marking users as blocked: {e}")
+            return 0
+
     def get_user_by_telegram_id(self, telegram_id):
         try:
             with self._get_connection() as conn:
@@ -392,6 +660,12 @@ class DatabaseManager:
                 cur.execute(sql)
                 return [dict(row) for row in cur.fetchall()]
 
+    def iter_bot_messages(self, fetch_size=None):
+        """Потоковый вариант get_all_bot_messages."""
+        return self._stream_rows(
+            "SELECT message_key, message_text FROM bot_messages ORDER BY message_key;", fetch_size=fetch_size
+        )
+
     def get_message_by_key(self, key: str):
         """Читает текст сообщения по его ключу из базы данных."""
         sql = "SELECT message_text FROM bot_messages WHERE message_key = %s;"
@@ -402,13 +676,27 @@ class DatabaseManager:
                 return result[0] if result else None
 
     def update_bot_message(self, message_key: str, new_text: str):
-        """Обновляет текст конкретного сообщения в базе данных."""
+        """
+        Обновляет текст конкретного сообщения в базе данных.
+        Вместе с текстом меняется версия сообщений, чтобы хранилища шаблонов во всех процессах перезагрузились.
+        """
         sql = "UPDATE bot_messages SET message_text = %s WHERE message_key = %s;"
-        with self._get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, (new_text, message_key))
-                conn.commit()
-                return cur.rowcount > 0
+        version_sql = """
+            INSERT INTO settings (key, value) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, (new_text, message_key))
+                    updated = cur.rowcount > 0
+                    if updated:
+                        cur.execute(version_sql, (MESSAGES_VERSION_KEY, uuid.uuid4().hex))
+                        cur.execute(version_sql, (SETTINGS_VERSION_KEY, uuid.uuid4().hex))
+                    conn.commit()
+                    return updated
+        finally:
+            self.invalidate_settings_cache()
             
             
     def set_user_role(self, telegram_id, role):
@@ -428,6 +716,106 @@ class DatabaseManager:
             if conn: conn.close()
             
             
+    def count_active_purchases(self):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM purchases WHERE is_active = TRUE")
+                    return cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.error(f"Error counting active purchases: {e}")
+            return 0
+
+    def iter_active_purchases(self, fetch_size=None):
+        """Потоковый вариант get_all_active_purchases для массовых задач: память не растёт с числом покупок."""
+        return self._stream_rows(
+            "SELECT * FROM purchases WHERE is_active = TRUE ORDER BY purchase_date DESC", fetch_size=fetch_size
+        )
+
+    def get_active_purchases_by_server(self, server_id):
+        """Активные покупки одного сервера (внеочередной сбор трафика сервера)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute("SELECT * FROM purchases WHERE is_active = TRUE AND server_id = %s", (server_id,))
+                    return [dict(row) for row in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error(f"Error getting active purchases for server {server_id}: {e}")
+            return []
+
+    def get_purchase_ids_by_server(self, server_id):
+        """ID всех покупок сервера (например, чтобы убрать их подписки из кэша перед удалением сервера)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT id FROM purchases WHERE server_id = %s", (server_id,))
+                    return [row[0] for row in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error(f"Error getting purchase IDs for server {server_id}: {e}")
+            return []
+
+    # Поля покупки для пересборки конфигураций (utils/config_refresh.py): имя клиента в ссылках
+    # строится из telegram_id владельца, inbound — из synced_configs сервера или профиля покупки.
+    _REFRESH_PURCHASE_SQL = """
+        SELECT p.id, p.server_id, p.profile_id, p.client_uuid, u.telegram_id
+        FROM purchases p
+        JOIN users u ON u.id = p.user_id
+    """
+
+    def iter_active_purchases_for_refresh(self, fetch_size=None):
+        """Потоковое чтение активных покупок с полями, которые копирует ConfigRefresher.refresh_purchases."""
+        return self._stream_rows(
+            self._REFRESH_PURCHASE_SQL + " WHERE p.is_active = TRUE ORDER BY p.purchase_date DESC", fetch_size=fetch_size
+        )
+
+    def get_purchase_for_refresh(self, purchase_id):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute(self._REFRESH_PURCHASE_SQL + " WHERE p.id = %s", (purchase_id,))
+                    row = cursor.fetchone()
+                    return dict(row) if row else None
+        except psycopg2.Error as e:
+            logger.error(f"Error getting purchase {purchase_id} for config refresh: {e}")
+            return None
+
+    def get_synced_configs_for_refresh(self, server_id=None, profile_id=None):
+        """
+        Синхронизированные inbound для построения ссылок: активные inbound сервера (server_id)
+        или inbound профиля (profile_id), вместе с расшифрованным subscription_base_url сервера.
+        """
+        if profile_id is not None:
+            sql = """
+                SELECT sc.*, s.subscription_base_url
+                FROM profile_inbounds pi
+                JOIN synced_configs sc ON sc.server_id = pi.server_id AND sc.inbound_id = pi.inbound_id
+                JOIN servers s ON s.id = sc.server_id
+                WHERE pi.profile_id = %s
+                ORDER BY pi.id
+            """
+            params = (profile_id,)
+        else:
+            sql = """
+                SELECT sc.*, s.subscription_base_url
+                FROM server_inbounds si
+                JOIN synced_configs sc ON sc.server_id = si.server_id AND sc.inbound_id = si.inbound_id
+                JOIN servers s ON s.id = sc.server_id
+                WHERE si.server_id = %s AND si.is_active = TRUE
+                ORDER BY si.id
+            """
+            params = (server_id,)
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute(sql, params)
+                    rows = [dict(row) for row in cursor.fetchall()]
+            for row in rows:
+                row['subscription_base_url'] = self._decrypt(row['subscription_base_url'])
+            return rows
+        except Exception as e:
+            logger.error(f"Error getting synced configs for refresh (server {server_id}, profile {profile_id}): {e}")
+            return []
+
     def get_all_active_purchases(self):
         """Получение всех активных покупок"""
         try:
@@ -455,7 +843,11 @@ class DatabaseManager:
                         WHERE id = %s
                     """, (new_sub_id, purchase_id))
                     conn.commit()
-                    return cursor.rowcount > 0
+                    updated = cursor.rowcount > 0
+            if updated:
+                # Старая ссылка подписки больше не должна обслуживаться ни одним процессом
+                self.invalidate_subscription(purchase_id)
+            return updated
         except Exception as e:
             logger.error(f"Error updating purchase sub_id: {e}")
             return False
@@ -499,6 +891,198 @@ class DatabaseManager:
             logger.error(f"Error getting client traffic info for {client_uuid}: {e}")
             return None
 
+    # --- Schema Upgrades ---
+    def apply_schema_upgrades(self):
+        """
+        Идемпотентные изменения схемы, добавленные после первоначальной установки.
+        Вызывается при запуске бота после run_migrations.
+        """
+        commands = [
+            "ALTER TABLE purchases ADD COLUMN IF NOT EXISTS configs_hash TEXT;",
+            "ALTER TABLE purchases ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP;",
+            """
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT,
+                result TEXT,
+                total INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                succeeded INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS payload TEXT;",
+            "ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS result TEXT;",
+            "CREATE INDEX IF NOT EXISTS idx_background_jobs_queued ON background_jobs (created_at) WHERE status = 'queued';",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE;",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ;",
+            """
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1,
+                expires_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (namespace, key)
+            )
+            """,
+        ]
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                for command in commands:
+                    cursor.execute(command)
+                conn.commit()
+        self.ensure_traffic_snapshots_table()
+        self.ensure_indexes()
+        logger.info(f"Applied {len(commands)} schema upgrade statements.")
+
+    def ensure_indexes(self):
+        """Создаёт недостающие индексы из MANAGED_INDEXES (идемпотентно). Возвращает число обработанных индексов."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for name, table, definition in MANAGED_INDEXES:
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+            finally:
+                cursor.close()
+            conn.commit()
+        logger.info(f"Ensured {len(MANAGED_INDEXES)} managed indexes.")
+        return len(MANAGED_INDEXES)
+
+    @staticmethod
+    def compute_configs_hash(configs_json):
+        """Хеш тела подписки ('\n'.join(configs)); используется как ETag в /sub/<sub_id>."""
+        if not configs_json:
+            return None
+        body = '\n'.join(json.loads(configs_json))
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+
+    # --- Traffic Snapshot Functions ---
+    def ensure_traffic_snapshots_table(self):
+        """Создаёт таблицы снимков трафика, если их ещё нет (вызывается при запуске)."""
+        commands = [
+            """
+            CREATE TABLE IF NOT EXISTS traffic_snapshots (
+                purchase_id INTEGER PRIMARY KEY REFERENCES purchases(id) ON DELETE CASCADE,
+                server_id INTEGER NOT NULL,
+                client_uuid TEXT,
+                up BIGINT DEFAULT 0,
+                down BIGINT DEFAULT 0,
+                total BIGINT DEFAULT 0,
+                expiry_time BIGINT DEFAULT 0,
+                enable BOOLEAN DEFAULT TRUE,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS traffic_sync_status (
+                server_id INTEGER PRIMARY KEY,
+                synced_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        ]
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    for command in commands:
+                        cursor.execute(command)
+                    conn.commit()
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Error creating traffic snapshot tables: {e}")
+            return False
+
+    def upsert_traffic_snapshots(self, rows):
+        """
+        Записывает снимки трафика пачкой. Строки, значения которых не изменились,
+        не перезаписываются. rows: список кортежей
+        (purchase_id, server_id, client_uuid, up, down, total, expiry_time, enable).
+        Возвращает количество фактически записанных строк или None при ошибке.
+        """
+        if not rows:
+            return 0
+        sql = """
+            INSERT INTO traffic_snapshots (purchase_id, server_id, client_uuid, up, down, total, expiry_time, enable)
+            VALUES %s
+            ON CONFLICT (purchase_id) DO UPDATE SET
+                server_id = EXCLUDED.server_id,
+                client_uuid = EXCLUDED.client_uuid,
+                up = EXCLUDED.up,
+                down = EXCLUDED.down,
+                total = EXCLUDED.total,
+                expiry_time = EXCLUDED.expiry_time,
+                enable = EXCLUDED.enable,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE (traffic_snapshots.up, traffic_snapshots.down, traffic_snapshots.total,
+                   traffic_snapshots.expiry_time, traffic_snapshots.enable, traffic_snapshots.server_id)
+                IS DISTINCT FROM (EXCLUDED.up, EXCLUDED.down, EXCLUDED.total,
+                                  EXCLUDED.expiry_time, EXCLUDED.enable, EXCLUDED.server_id)
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    psycopg2.extras.execute_values(cursor, sql, rows, page_size=500)
+                    written = cursor.rowcount
+                    conn.commit()
+                    return written
+        except psycopg2.Error as e:
+            logger.error(f"Error upserting traffic snapshots: {e}")
+            return None
+
+    def mark_traffic_synced(self, server_id):
+        """Отмечает время последнего успешного сбора трафика с сервера."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO traffic_sync_status (server_id, synced_at)
+                        VALUES (%s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (server_id) DO UPDATE SET synced_at = CURRENT_TIMESTAMP
+                    """, (server_id,))
+                    conn.commit()
+                    return True
+        except psycopg2.Error as e:
+            logger.error(f"Error marking traffic sync for server {server_id}: {e}")
+            return False
+
+    def get_traffic_synced_at(self, server_id):
+        """Время последнего успешного сбора трафика с сервера (None, если сбора ещё не было)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT synced_at FROM traffic_sync_status WHERE server_id = %s", (server_id,))
+                    row = cursor.fetchone()
+                    return row[0] if row else None
+        except psycopg2.Error as e:
+            logger.error(f"Error getting traffic sync time for server {server_id}: {e}")
+            return None
+
+    def get_traffic_snapshot(self, purchase_id):
+        """
+        Возвращает последний снимок трафика покупки вместе с synced_at —
+        временем последнего успешного сбора данных с её сервера.
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT ts.*, tss.synced_at
+                        FROM traffic_snapshots ts
+                        LEFT JOIN traffic_sync_status tss ON tss.server_id = ts.server_id
+                        WHERE ts.purchase_id = %s
+                    """, (purchase_id,))
+                    row = cursor.fetchone()
+                    return dict(row) if row else None
+        except psycopg2.Error as e:
+            logger.error(f"Error getting traffic snapshot for purchase {purchase_id}: {e}")
+            return None
+
     def get_purchase_by_client_uuid(self, client_uuid):
         """Получение покупки по UUID клиента"""
         try:
@@ -520,6 +1104,18 @@ class DatabaseManager:
             logger.error(f"Error getting purchase by client UUID {client_uuid}: {e}")
             return None
 
+    def get_purchase_by_sub_id(self, sub_id):
+        """Активная покупка по sub_id (каждый промах кэша /sub/<sub_id>; поиск по idx_purchases_sub_id)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute("SELECT * FROM purchases WHERE sub_id = %s AND is_active = TRUE", (sub_id,))
+                    purchase = cursor.fetchone()
+                    return dict(purchase) if purchase else None
+        except psycopg2.Error as e:
+            logger.error(f"Error getting purchase by sub_id {sub_id}: {e}")
+            return None
+
     def get_all_client_uuids_for_user(self, user_id):
         """Получение всех UUID клиентов для пользователя"""
         try:
@@ -551,11 +1147,397 @@ class DatabaseManager:
                     cursor.execute("""
                         UPDATE purchases 
                         SET single_configs_json = %s, 
+                            configs_hash = %s,
                             updated_at = CURRENT_TIMESTAMP
                         WHERE id = %s
-                    """, (configs_json, purchase_id))
+                    """, (configs_json, self.compute_configs_hash(configs_json), purchase_id))
                     conn.commit()
-                    return cursor.rowcount > 0
+                    updated = cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error updating purchase configs for {purchase_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+        if updated:
+            # Другие процессы увидят новый configs_hash при сверке записи кэша
+            self.invalidate_subscription(purchase_id)
+        return updated
+
+    def update_purchase_configs_bulk(self, updates, page_size=500):
+        """
+        Пакетное обновление сохранённых конфигураций: updates — список (purchase_id, configs_json).
+        Возвращает количество обновлённых покупок.
+        """
+        if not updates:
+            return 0
+        rows = [(purchase_id, configs_json, self.compute_configs_hash(configs_json)) for purchase_id, configs_json in updates]
+        sql = """
+            UPDATE purchases AS p
+            SET single_configs_json = v.configs_json,
+                configs_hash = v.configs_hash,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, configs_json, configs_hash)
+            WHERE p.id = v.id
+        """
+        updated = 0
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    for start in range(0, len(rows), page_size):
+                        psycopg2.extras.execute_values(cursor, sql, rows[start:start + page_size], page_size=page_size)
+                        updated += cursor.rowcount
+                    conn.commit()
+        except psycopg2.Error as e:
+            logger.error(f"Error bulk updating purchase configs: {e}")
+            return 0
+        self.invalidate_subscription(*(purchase_id for purchase_id, _, _ in rows))
+        return updated
+
+    # --- Background Job Functions ---
+    # Таблица background_jobs — общая очередь задач: бот и webhook-сервер ставят задачи,
+    # рабочие потоки JobQueue забирают их через SELECT ... FOR UPDATE SKIP LOCKED.
+    def create_job(self, kind, payload=None, total=0):
+        """Ставит задачу в очередь и возвращает её ID."""
+        job_id = uuid.uuid4().hex
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO background_jobs (id, kind, status, payload, total) VALUES (%s, %s, 'queued', %s, %s)",
+                        (job_id, kind, json.dumps(payload) if payload is not None else None, total)
+                    )
+                    conn.commit()
+            return job_id
+        except psycopg2.Error as e:
+            logger.error(f"Error creating background job '{kind}': {e}")
+            return None
+
+    def claim_next_job(self, kinds):
+        """
+        Забирает самую старую задачу из очереди (переводит её в статус running) и возвращает её,
+        или None, если задач нет. Задачи, уже взятые другим процессом, пропускаются.
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute("""
+                        UPDATE background_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP
+                        WHERE id = (
+                            SELECT id FROM background_jobs
+                            WHERE status = 'queued' AND kind = ANY(%s)
+                            ORDER BY created_at
+                            LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING *
+                    """, (list(kinds),))
+                    row = cursor.fetchone()
+                    conn.commit()
+                    if not row:
+                        return None
+                    job = dict(row)
+                    job['payload'] = json.loads(job['payload']) if job.get('payload') else {}
+                    job['result'] = json.loads(job['result']) if job.get('result') else None
+                    return job
+        except psycopg2.Error as e:
+            logger.error(f"Error claiming background job: {e}")
+            return None
+
+    def update_job(self, job_id, **fields):
+        """Обновляет поля задачи (status, result, total, processed, succeeded, failed, error)."""
+        allowed = {'status', 'result', 'total', 'processed', 'succeeded', 'failed', 'error'}
+        fields = {k: v for k, v in fields.items() if k in allowed}
+        if not job_id or not fields:
+            return False
+        if 'result' in fields and fields['result'] is not None:
+            fields['result'] = json.dumps(fields['result'], default=str)
+        assignments = ", ".join(f"{column} = %s" for column in fields)
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE background_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                        (*fields.values(), job_id)
+                    )
+                    conn.commit()
+                    return cursor.rowcount > 0
+        except psycopg2.Error as e:
+            logger.error(f"Error updating background job {job_id}: {e}")
+            return False
+
+    def get_job(self, job_id):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute("SELECT * FROM background_jobs WHERE id = %s", (job_id,))
+                    row = cursor.fetchone()
+                    if not row:
+                        return None
+                    job = dict(row)
+                    for field in ('payload', 'result'):
+                        job[field] = json.loads(job[field]) if job.get(field) else None
+                    return job
+        except psycopg2.Error as e:
+            logger.error(f"Error getting background job {job_id}: {e}")
+            return None
+
+    def requeue_stale_jobs(self, older_than_seconds=3600):
+        """Возвращает в очередь задачи, «зависшие» в статусе running (например, после перезапуска процесса)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        UPDATE background_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                        WHERE status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    """, (older_than_seconds,))
+                    conn.commit()
+                    return cursor.rowcount
+        except psycopg2.Error as e:
+            logger.error(f"Error requeueing stale background jobs: {e}")
+            return 0
+
+    # --- Conversation State Functions ---
+    # Таблица conversation_states хранит состояния диалогов (utils/state_store.DatabaseStateStore),
+    # общие для всех процессов бота. version растёт при каждой записи и используется для compare-and-set.
+    def get_conversation_state(self, namespace, key):
+        """Возвращает (value, version) действующего состояния или None."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT value, version FROM conversation_states
+                        WHERE namespace = %s AND key = %s
+                          AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                    """, (namespace, key))
+                    row = cursor.fetchone()
+                    return (row[0], row[1]) if row else None
+        except psycopg2.Error as e:
+            logger.error(f"Error getting conversation state {namespace}:{key}: {e}")
+            return None
+
+    def get_conversation_state_keys(self, namespace):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT key FROM conversation_states
+                        WHERE namespace = %s AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                    """, (namespace,))
+                    return [row[0] for row in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error(f"Error listing conversation states {namespace}: {e}")
+            return []
+
+    def set_conversation_state(self, namespace, key, value, ttl=None):
+        """Безусловно записывает состояние; ttl — время жизни в секундах (None — бессрочно)."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO conversation_states (namespace, key, value, version, expires_at, updated_at)
+                        VALUES (%s, %s, %s, 1, CURRENT_TIMESTAMP + make_interval(secs => %s), CURRENT_TIMESTAMP)
+                        ON CONFLICT (namespace, key) DO UPDATE SET
+                            value = EXCLUDED.value,
+                            version = conversation_states.version + 1,
+                            expires_at = EXCLUDED.expires_at,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (namespace, key, value, ttl))
+                    conn.commit()
+                    return True
+        except psycopg2.Error as e:
+            logger.error(f"Error setting conversation state {namespace}:{key}: {e}")
+            return False
+
+    def compare_and_set_conversation_state(self, namespace, key, value, expected_version, ttl=None):
+        """
+        Записывает состояние, только если его версия равна expected_version
+        (None — состояния нет или оно истекло). Возвращает True при успехе.
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    if expected_version is None:
+                        # Истёкшая запись считается отсутствующей и перезаписывается
+                        cursor.execute("""
+                            INSERT INTO conversation_states (namespace, key, value, version, expires_at, updated_at)
+                            VALUES (%s, %s, %s, 1, CURRENT_TIMESTAMP + make_interval(secs => %s), CURRENT_TIMESTAMP)
+                            ON CONFLICT (namespace, key) DO UPDATE SET
+                                value = EXCLUDED.value,
+                                version = conversation_states.version + 1,
+                                expires_at = EXCLUDED.expires_at,
+                                updated_at = CURRENT_TIMESTAMP
+                            WHERE conversation_states.expires_at IS NOT NULL
+                              AND conversation_states.expires_at <= CURRENT_TIMESTAMP
+                        """, (namespace, key, value, ttl))
+                    else:
+                        cursor.execute("""
+                            UPDATE conversation_states SET
+                                value = %s,
+                                version = version + 1,
+                                expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                                updated_at = CURRENT_TIMESTAMP
+                            WHERE namespace = %s AND key = %s AND version = %s
+                              AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                        """, (value, ttl, namespace, key, expected_version))
+                    conn.commit()
+                    return cursor.rowcount > 0
+        except psycopg2.Error as e:
+            logger.error(f"Error updating conversation state {namespace}:{key}: {e}")
+            return False
+
+    def delete_conversation_state(self, namespace, key):
+        """Удаляет состояние. Возвращает True, если действующее состояние существовало."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        DELETE FROM conversation_states WHERE namespace = %s AND key = %s
+                        RETURNING (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                    """, (namespace, key))
+                    row = cursor.fetchone()
+                    conn.commit()
+                    return bool(row and row[0])
+        except psycopg2.Error as e:
+            logger.error(f"Error deleting conversation state {namespace}:{key}: {e}")
+            return False
+
+    def purge_expired_conversation_states(self):
+        """Удаляет истёкшие состояния (брошенные диалоги). Возвращает число удалённых строк."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM conversation_states WHERE expires_at <= CURRENT_TIMESTAMP")
+                    conn.commit()
+                    return cursor.rowcount
+        except psycopg2.Error as e:
+            logger.error(f"Error purging expired conversation states: {e}")
+            return 0
+
+    # --- Settings Functions (с кэшем в памяти процесса) ---
+    def _get_settings_cache(self):
+        key = self._pool_key()
+        cache = DatabaseManager._settings_caches.get(key)
+        if cache is None:
+            with DatabaseManager._pools_lock:
+                cache = DatabaseManager._settings_caches.setdefault(key, SettingsCache(
+                    self._load_all_settings,
+                    self._load_settings_version,
+                    check_interval=config.SETTINGS_CACHE_CHECK_INTERVAL,
+                ))
+        return cache
+
+    def _load_all_settings(self):
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT key, value FROM settings")
+                return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def _load_settings_version(self):
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT value FROM settings WHERE key = %s", (SETTINGS_VERSION_KEY,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+
+    def get_setting(self, key, default=None):
+        """Возвращает значение настройки из кэша (таблица settings загружается целиком)."""
+        try:
+            return self._get_settings_cache().get(key, default)
+        except Exception as e:
+            logger.error(f"Error getting setting '{key}': {e}")
+            return default
+
+    def get_setting_int(self, key, default=None):
+        try:
+            return self._get_settings_cache().get_int(key, default)
+        except Exception as e:
+            logger.error(f"Error getting setting '{key}': {e}")
+            return default
+
+    def get_setting_bool(self, key, default=False):
+        try:
+            return self._get_settings_cache().get_bool(key, default)
+        except Exception as e:
+            logger.error(f"Error getting setting '{key}': {e}")
+            return default
+
+    def get_all_settings(self):
+        try:
+            return self._get_settings_cache().all()
+        except Exception as e:
+            logger.error(f"Error getting all settings: {e}")
+            return {}
+
+    def update_setting(self, key, value):
+        """
+        Сохраняет настройку и меняет версию настроек в той же транзакции,
+        чтобы кэши в других процессах перечитали таблицу.
+        """
+        sql = """
+            INSERT INTO settings (key, value) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+        """
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, (key, value))
+                    cursor.execute(sql, (SETTINGS_VERSION_KEY, uuid.uuid4().hex))
+                    conn.commit()
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Error updating setting '{key}': {e}")
+            return False
+        finally:
+            self.invalidate_settings_cache()
+
+    def invalidate_settings_cache(self):
+        self._get_settings_cache().invalidate()
+
+
+    # --- Subscription Cache Functions ---
+    def get_subscription_cache(self):
+        """Кэш готовых тел подписок, общий для всех экземпляров DatabaseManager в процессе."""
+        key = self._pool_key()
+        cache = DatabaseManager._subscription_caches.get(key)
+        if cache is None:
+            with DatabaseManager._pools_lock:
+                cache = DatabaseManager._subscription_caches.setdefault(key, SubscriptionCache(
+                    max_entries=config.SUBSCRIPTION_CACHE_MAX_ENTRIES,
+                    ttl=config.SUBSCRIPTION_CACHE_TTL,
+                    validator=self.get_subscription_fingerprint,
+                    revalidate_interval=config.SUBSCRIPTION_CACHE_REVALIDATE_INTERVAL,
+                ))
+        return cache
+
+    @staticmethod
+    def subscription_fingerprint(purchase):
+        """Отпечаток покупки для сверки записи кэша подписок: (ID, configs_hash, is_active)."""
+        return purchase['id'], purchase.get('configs_hash'), purchase.get('is_active')
+
+    def get_subscription_fingerprint(self, sub_id):
+        """Отпечаток покупки по sub_id (None, если покупки нет); один запрос по индексу без чтения конфигураций."""
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute("SELECT id, configs_hash, is_active FROM purchases WHERE sub_id = %s", (sub_id,))
+                row = cursor.fetchone()
+        return self.subscription_fingerprint(row) if row else None
+
+    def invalidate_subscription(self, *purchase_ids):
+        """
+        Удаляет подписки покупок из кэша текущего процесса; вызывается при каждом изменении,
+        удалении или отключении покупки. Кэши других процессов (воркеры webhook-сервера)
+        обнаруживают изменение при сверке записи (get_subscription_fingerprint): отпечаток включает
+        is_active, а для удалённой покупки его нет, поэтому отключение покупки любым путём,
+        в том числе прямым SQL, перестаёт обслуживаться не позже чем через SUBSCRIPTION_CACHE_REVALIDATE_INTERVAL.
+        """
+        subscription_cache = self.get_subscription_cache()
+        for purchase_id in purchase_ids:
+            subscription_cache.invalidate_purchase(purchase_id)
+
+
+
+@functools.lru_cache(maxsize=None)
+def get_db_manager() -> DatabaseManager:
+    """Общий DatabaseManager процесса, создаётся при первом обращении (не при импорте модулей)."""
+    return DatabaseManager()
+
+
+atexit.register(DatabaseManager.close_all_pools)
@@ -0,0 +1,61 @@
+# database/server_registry.py
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Зашифрованные столбцы таблицы servers
+ENCRYPTED_SERVER_FIELDS = ('panel_url', 'username', 'password', 'subscription_base_url', 'subscription_path_prefix')
+
+
+class ServerRegistry:
+    """
+    Расшифрованные учётные данные серверов в памяти процесса, по ID сервера.
+    Запись действительна, пока зашифрованные значения в строке сервера не изменились:
+    Fernet даёт новый шифротекст при каждом шифровании, поэтому редактирование сервера
+    (в том числе в другом процессе) само делает запись устаревшей.
+    Удалённые серверы убираются через invalidate.
+    """
+
+    def __init__(self):
+        # {server_id: (зашифрованные значения, расшифрованные значения)}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(server_row: dict) -> tuple:
+        return tuple(server_row.get(field) for field in ENCRYPTED_SERVER_FIELDS)
+
+    def get(self, server_id, fingerprint):
+        """Возвращает dict расшифрованных полей или None, если записи нет или она устарела."""
+        with self._lock:
+            entry = self._entries.get(server_id)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, server_id, fingerprint, decrypted: dict):
+        if server_id is None:
+            return
+        with self._lock:
+            self._entries[server_id] = (fingerprint, dict(decrypted))
+
+    def invalidate(self, server_id=None):
+        """Удаляет запись сервера (или все записи, если server_id не указан)."""
+        with self._lock:
+            if server_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(server_id, None)
+
+    def stats(self) -> dict:
+        return {
+            'servers': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,88 @@
+# database/settings_cache.py
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Служебный ключ в таблице settings: меняется при каждой записи настроек,
+# чтобы другие процессы (бот, webhook-сервер) узнали об изменениях
+SETTINGS_VERSION_KEY = '_settings_version'
+# Аналогичный ключ для таблицы bot_messages (кэш шаблонов сообщений)
+MESSAGES_VERSION_KEY = '_messages_version'
+# Меняется при удалении покупок и смене sub_id: кэши подписок во всех процессах очищаются
+SUBSCRIPTIONS_VERSION_KEY = '_subscriptions_version'
+
+
+class SettingsCache:
+    """
+    Кэш всей таблицы settings в памяти процесса.
+    Таблица загружается целиком один раз; затем не чаще, чем раз в check_interval секунд,
+    сверяется счётчик версии, и при его изменении таблица перечитывается.
+    """
+
+    def __init__(self, load_all, load_version, check_interval=5):
+        self._load_all = load_all
+        self._load_version = load_version
+        self.check_interval = check_interval
+        self._values = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, now):
+        return self._values is not None and now - self._checked_at < self.check_interval
+
+    def _ensure_loaded(self):
+        if self._is_fresh(time.monotonic()):
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._is_fresh(now):
+                return
+            if self._values is not None:
+                try:
+                    version = self._load_version()
+                except Exception as e:
+                    # База недоступна: продолжаем отдавать последние известные значения
+                    logger.warning(f"Could not check settings version, serving cached values: {e}")
+                    self._checked_at = now
+                    return
+                if version == self._version:
+                    self._checked_at = now
+                    return
+            values = self._load_all()
+            self._values = values
+            self._version = values.get(SETTINGS_VERSION_KEY)
+            self._checked_at = now
+            logger.info(f"Settings cache loaded ({len(values)} keys, version {self._version}).")
+
+    def invalidate(self):
+        """Сбрасывает кэш; следующее чтение заново загрузит таблицу."""
+        with self._lock:
+            self._values = None
+            self._version = None
+
+    def get(self, key, default=None):
+        self._ensure_loaded()
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def get_int(self, key, default=None):
+        value = self.get(key)
+        try:
+            return int(value) if value not in (None, '') else default
+        except (TypeError, ValueError):
+            logger.warning(f"Setting '{key}' is not an integer: {value!r}")
+            return default
+
+    def get_bool(self, key, default=False):
+        value = self.get(key)
+        if value in (None, ''):
+            return default
+        return str(value).strip().lower() in ('1', 'true', 't', 'yes', 'on')
+
+    def all(self):
+        self._ensure_loaded()
+        return {k: v for k, v in self._values.items() if k not in (SETTINGS_VERSION_KEY, MESSAGES_VERSION_KEY, SUBSCRIPTIONS_VERSION_KEY)}
@@ -0,0 +1,123 @@
+# database/subscription_cache.py
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionCache:
+    """
+    LRU-кэш готовых ответов подписок (/sub/<sub_id>: тело и заголовки) в памяти процесса
+    с ограничением по размеру и TTL.
+    Попадание в кэш не требует ни запроса к базе данных, ни разбора JSON.
+    Если задан validator, запись старше revalidate_interval секунд сверяется с базой:
+    validator(sub_id) возвращает отпечаток покупки (ID, configs_hash, is_active), и при его
+    изменении запись удаляется (так процессы узнают об изменениях, сделанных в других процессах).
+    Последний успешно собранный ответ каждой подписки хранится отдельно (тоже не более max_entries):
+    инвалидация его не удаляет, и get_stale отдаёт его, пока конфигурации покупки пересобираются.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, validator=None, revalidate_interval=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.revalidate_interval = revalidate_interval
+        self._validator = validator
+        # {sub_id: [value, purchase_id, expires_at, fingerprint, checked_at]}
+        self._entries = OrderedDict()
+        self._sub_ids_by_purchase = {}
+        # {sub_id: (value, purchase_id)} — последний удачный ответ, переживает инвалидацию
+        self._last_good = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def _is_current(self, sub_id, fingerprint):
+        try:
+            return self._validator(sub_id) == fingerprint
+        except Exception as e:
+            # База недоступна: продолжаем отдавать запись до истечения TTL
+            logger.warning(f"Could not revalidate cached subscription {sub_id}: {e}")
+            return True
+
+    def get(self, sub_id):
+        """Возвращает (value, purchase_id) или None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sub_id)
+            if entry is None or entry[2] <= now:
+                self.misses += 1
+                return None
+            needs_check = self._validator is not None and now - entry[4] >= self.revalidate_interval
+        if needs_check:
+            current = self._is_current(sub_id, entry[3])
+            with self._lock:
+                self.revalidations += 1
+                if not current:
+                    if self._entries.get(sub_id) is entry:
+                        self._remove(sub_id)
+                    self.misses += 1
+                    return None
+                entry[4] = now
+        with self._lock:
+            if sub_id in self._entries:
+                self._entries.move_to_end(sub_id)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def get_stale(self, sub_id):
+        """
+        Возвращает последний удачный ответ (value, purchase_id), даже если запись просрочена
+        или инвалидирована (запасной ответ, пока идёт обновление), или None.
+        """
+        with self._lock:
+            return self._last_good.get(sub_id)
+
+    def put(self, sub_id, value, purchase_id, fingerprint=None):
+        """fingerprint — отпечаток покупки в момент чтения (тот же, что возвращает validator)."""
+        now = time.monotonic()
+        with self._lock:
+            self._remove(sub_id)
+            self._entries[sub_id] = [value, purchase_id, now + self.ttl, fingerprint, now]
+            self._sub_ids_by_purchase.setdefault(purchase_id, set()).add(sub_id)
+            while len(self._entries) > self.max_entries:
+                oldest_sub_id = next(iter(self._entries))
+                self._remove(oldest_sub_id)
+            self._last_good[sub_id] = (value, purchase_id)
+            self._last_good.move_to_end(sub_id)
+            while len(self._last_good) > self.max_entries:
+                self._last_good.popitem(last=False)
+
+    def _remove(self, sub_id):
+        entry = self._entries.pop(sub_id, None)
+        if entry is None:
+            return
+        sub_ids = self._sub_ids_by_purchase.get(entry[1])
+        if sub_ids is not None:
+            sub_ids.discard(sub_id)
+            if not sub_ids:
+                del self._sub_ids_by_purchase[entry[1]]
+
+    def invalidate_purchase(self, purchase_id):
+        """Удаляет из кэша все подписки покупки."""
+        with self._lock:
+            for sub_id in list(self._sub_ids_by_purchase.get(purchase_id, ())):
+                self._remove(sub_id)
+
+    def forget(self, sub_id):
+        """Удаляет подписку вместе с последним удачным ответом (sub_id больше не должен обслуживаться)."""
+        with self._lock:
+            self._remove(sub_id)
+            self._last_good.pop(sub_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sub_ids_by_purchase.clear()
+            self._last_good.clear()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations}
@@ -0,0 +1,49 @@
+# gunicorn.conf.py
+# Производственный режим webhook-сервера:
+#   .venv/bin/gunicorn --config gunicorn.conf.py webhook_server:app
+# Плавная перезагрузка воркеров: systemctl reload <service> (сигнал HUP).
+
+import multiprocessing
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).parent.resolve() / '.env')
+
+bind = os.getenv("WEBHOOK_BIND", "127.0.0.1:8080")
+
+# Каждый воркер — отдельный процесс со своими пулами соединений и кэшами
+workers = int(os.getenv("WEBHOOK_WORKERS", str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+worker_class = "gthread"
+threads = int(os.getenv("WEBHOOK_THREADS", "4"))
+
+# Приложение импортируется в каждом воркере отдельно (shared-nothing):
+# пулы БД, HTTP-сессии к панелям и фоновые потоки создаются уже после fork
+preload_app = False
+
+# nginx держит keep-alive соединения к upstream
+keepalive = int(os.getenv("WEBHOOK_KEEPALIVE", "5"))
+timeout = int(os.getenv("WEBHOOK_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WEBHOOK_GRACEFUL_TIMEOUT", "30"))
+
+# Периодический перезапуск воркеров защищает от утечек памяти
+max_requests = int(os.getenv("WEBHOOK_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("WEBHOOK_MAX_REQUESTS_JITTER", "500"))
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("WEBHOOK_LOG_LEVEL", "info")
+proc_name = "alamor_webhook"
+
+
+def on_starting(server):
+    # Проверка .env и обязательных переменных один раз в мастер-процессе (импорт модулей её не выполняет)
+    from config import validate_settings
+    validate_settings()
+
+
+def worker_exit(server, worker):
+    # Корректно закрываем соединения с базой данных завершающегося воркера
+    from database.db_manager import DatabaseManager
+    DatabaseManager.close_all_pools()
@@ -9,7 +9,8 @@ import os
 import zipfile
 import time
 import uuid
-from config import ADMIN_IDS, SUPPORT_CHANNEL_LINK
+import threading
+import config
 from database.db_manager import DatabaseManager
 from api_client.xui_api_client import XuiAPIClient
 from utils import messages, helpers
@@ -17,8 +18,8 @@ from keyboards import inline_keyboards
 from utils.config_generator import ConfigGenerator
 from utils.bot_helpers import send_subscription_info # это новый импорт
 from handlers.user_handlers import _user_states
-from config import REQUIRED_CHANNEL_ID, REQUIRED_CHANNEL_LINK # This should already be there
-from api_client.factory import get_api_client
+from api_client.factory import get_api_client, invalidate_api_client, get_async_api_client, check_servers_online
+from api_client.async_xui_api_client import run_sync
 from utils.helpers import normalize_panel_inbounds
 from utils.bot_helpers import finalize_profile_purchase
 from handlers.domain_handlers import register_domain_handlers # <-- новый импорт
@@ -29,15 +30,22 @@ from utils.helpers import update_env_file
 from utils.system_helpers import run_shell_command
 from .domain_handlers import register_domain_handlers, start_webhook_setup_flow # <-- добавьте новую функцию
 from utils.helpers import normalize_panel_inbounds, parse_config_link
+from utils.config_refresh import JOB_REFRESH_PURCHASE, JOB_REFRESH_ALL
+from utils.job_queue import wait_for_job
+from utils.broadcaster import JOB_BROADCAST
+from utils.state_store import create_state_store
 
 logger = logging.getLogger(__name__)
 
+# Сколько пользователей показывается на одной странице списка (лимит сообщения Telegram — 4096 символов)
+USERS_PAGE_SIZE = 15
+
 # Глобальные модули
 _bot: telebot.TeleBot = None
 _db_manager: DatabaseManager = None
 _xui_api: XuiAPIClient = None
 _config_generator: ConfigGenerator = None
-_admin_states = {}
+_admin_states = None # {admin_id: {'state': '...', 'data': {...}}}, создаётся в register_admin_handlers
 
 def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance):
     global _bot, _db_manager, _xui_api, _config_generator , _admin_states
@@ -45,6 +53,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
     _db_manager = db_manager_instance
     _xui_api = xui_api_instance
     _config_generator = ConfigGenerator(db_manager_instance)
+    _admin_states = create_state_store('admin', config.STATE_STORE_BACKEND, ttl=config.CONVERSATION_STATE_TTL)
+    _admin_states.bind(db_manager_instance)
 
     # =============================================================================
     # SECTION: Helper and Menu Functions
@@ -151,39 +161,44 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         _bot.edit_message_text(text, admin_id, message.message_id, parse_mode='Markdown', reply_markup=inline_keyboards.get_back_button("admin_payment_management"))
 
 
-    def list_all_users(admin_id, message):
-        users = _db_manager.get_all_users()
+    def list_all_users(admin_id, message, page=1, after_id=None, before_id=None):
+        total_users = _db_manager.count_users()
+        users, has_more = _db_manager.get_users_page(USERS_PAGE_SIZE, after_id=after_id, before_id=before_id)
         if not users:
-            text = messages.NO_USERS_FOUND
-        else:
-            total_users = len(users)
-            text = f"👥 **Список пользователей бота (всего: {total_users} человек):**\n\n"
-
-            # Словарь для красивого отображения ролей
-            role_map = {
-                'admin': '👑 Администратор',
-                'reseller': '🤝 Реселлер',
-                'user': '👤 Пользователь'
-            }
+            _show_menu(admin_id, messages.NO_USERS_FOUND, inline_keyboards.get_back_button("admin_user_management"), message)
+            return
 
-            for user in users:
-                first_name = helpers.escape_markdown_v1(user.get('first_name', ''))
-                username = helpers.escape_markdown_v1(user.get('username', 'N/A'))
+        total_pages = max(1, -(-total_users // USERS_PAGE_SIZE))
+        # При листании назад следующая страница всегда есть — мы пришли с неё
+        has_next = has_more if before_id is None else True
+        text = f"👥 **Список пользователей бота (всего: {total_users} человек):**\n\n"
 
-                # Чтение роли из нового столбца 'role'
-                user_role_key = user.get('role', 'user')
-                role = role_map.get(user_role_key, '👤 Пользователь')
+        # Словарь для красивого отображения ролей
+        role_map = {
+            'admin': '👑 Администратор',
+            'reseller': '🤝 Реселлер',
+            'user': '👤 Пользователь'
+        }
 
-                balance = f"{user.get('balance', 0):,.0f} туманов"
+        for user in users:
+            first_name = helpers.escape_markdown_v1(user.get('first_name', ''))
+            username = helpers.escape_markdown_v1(user.get('username', 'N/A'))
 
-                text += (
-                    f"**Имя:** {first_name} (@{username})\n"
-                    f"`ID: {user['telegram_id']}`\n"
-                    f"**Роль:** {role} | **Баланс:** {balance}\n"
-                    "-----------------------------------\n"
-                )
+            # Чтение роли из нового столбца 'role'
+            user_role_key = user.get('role', 'user')
+            role = role_map.get(user_role_key, '👤 Пользователь')
 
-        _show_menu(admin_id, text, inline_keyboards.get_back_button("admin_user_management"), message)
+            balance = f"{user.get('balance', 0):,.0f} туманов"
+
+            text += (
+                f"**Имя:** {first_name} (@{username})\n"
+                f"`ID: {user['telegram_id']}`\n"
+                f"**Роль:** {role} | **Баланс:** {balance}\n"
+                "-----------------------------------\n"
+            )
+
+        markup = inline_keyboards.get_users_list_menu(users, page, total_pages, has_next)
+        _show_menu(admin_id, text, markup, message)
 
     def test_all_servers(admin_id, message):
         _bot.edit_message_text(messages.TESTING_ALL_SERVERS, admin_id, message.message_id, reply_markup=None)
@@ -194,16 +209,10 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             return
             
         results = []
+        # Все серверы проверяются параллельно, а не по очереди
+        online_status = check_servers_online(servers)
         for s in servers:
-            # --- основное исправление здесь ---
-            # Использование factory для выбора подходящего клиента
-            api_client = get_api_client(s)
-            is_online = False
-            if api_client:
-                # функция check_login также выполняет вход
-                is_online = api_client.check_login()
-            # --- конец исправленной части ---
-
+            is_online = online_status.get(s['id'], False)
             _db_manager.update_server_status(s['id'], is_online, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
             status_emoji = "✅" if is_online else "❌"
             results.append(f"{status_emoji} {helpers.escape_markdown_v1(s['name'])} (Type: {s['panel_type']})")
@@ -514,7 +523,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             # Переводим состояние на следующий этап, чтобы сохранить информацию о сообщении
             state_info['state'] = 'waiting_for_broadcast_confirmation'
 
-            total_users = len(_db_manager.get_all_users())
+            total_users = _db_manager.count_broadcast_recipients()
             
             # Пересылаем сообщение администратора ему же, чтобы он увидел предпросмотр
             _bot.send_message(admin_id, "👇 **Это сообщение, которое будет отправлено.** 👇")
@@ -754,38 +763,21 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             broadcast_chat_id = state_info['data']['broadcast_chat_id']
             _clear_admin_state(admin_id)
 
-            all_users = _db_manager.get_all_users()
-            total_users = len(all_users)
-
-            _bot.edit_message_text(f"⏳ Начинается отправка сообщения **{total_users}** пользователям. Этот процесс может занять некоторое время...", admin_id, message.message_id, parse_mode='Markdown')
-
-            successful_sends = 0
-            failed_sends = 0
+            total_users = _db_manager.count_broadcast_recipients()
+
+            # Рассылку выполняет фоновая задача очереди: обработчик не блокируется, лимиты Telegram соблюдаются
+            job_id = _db_manager.create_job(JOB_BROADCAST, payload={
+                'admin_id': admin_id,
+                'from_chat_id': broadcast_chat_id,
+                'message_id': broadcast_message_id,
+                'progress_message_id': message.message_id,
+            }, total=total_users)
+            if not job_id:
+                _bot.edit_message_text("❌ Не удалось запустить массовую рассылку.", admin_id, message.message_id)
+                _show_admin_main_menu(admin_id)
+                return
 
-            for user in all_users:
-                try:
-                    _bot.forward_message(
-                        chat_id=user['telegram_id'],
-                        from_chat_id=broadcast_chat_id,
-                        message_id=broadcast_message_id
-                    )
-                    successful_sends += 1
-                except Exception as e:
-                    failed_sends += 1
-                    logger.error(f"Failed to send broadcast to user {user['telegram_id']}: {e}")
-
-                # Для предотвращения ограничений Telegram можно добавить небольшую задержку
-                # import time
-                # time.sleep(0.1)
-
-            report_text = (
-                f"📣 **Итоговый отчет о массовой рассылке**\n\n"
-                f"✅ Количество успешных отправок: **{successful_sends}**\n"
-                f"❌ Количество неудачных отправок: **{failed_sends}**\n"
-                f"👥 Общее количество пользователей: **{total_users}**"
-            )
-            _bot.send_message(admin_id, report_text, parse_mode='Markdown')
-            _show_admin_main_menu(admin_id) # Показать главное меню снова
+            _bot.edit_message_text(f"⏳ Начинается отправка сообщения **{total_users}** пользователям. Прогресс будет отображаться в этом сообщении...", admin_id, message.message_id, parse_mode='Markdown')
             return
         # --- Управление шаблонами серверов ---
         if data == "admin_manage_templates":
@@ -840,6 +832,14 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         elif data == "admin_change_brand_name":
             start_change_brand_name_flow(admin_id, message)
             return
+        # --- Постраничный список пользователей ---
+        if data.startswith("admin_users_next_") or data.startswith("admin_users_prev_"):
+            _, _, direction, page, boundary_id = data.split('_')
+            if direction == "next":
+                list_all_users(admin_id, message, page=int(page), after_id=int(boundary_id))
+            else:
+                list_all_users(admin_id, message, page=int(page), before_id=int(boundary_id))
+            return
         # --- Управление сообщениями с пагинацией ---
         if data == "admin_msg_page_":
             show_message_management_menu(admin_id, message, page=1)
@@ -1079,6 +1079,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         if temp_xui_client.login():
             server_id = _db_manager.add_server(data['name'], data['url'], data['username'], data['password'], data['sub_base_url'], data['sub_path_prefix'])
             if server_id:
+                # SQLite может выдать ID удалённого сервера повторно — его запись убирается из реестра
+                _db_manager.invalidate_server(server_id)
                 _db_manager.update_server_status(server_id, True, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
                 _bot.edit_message_text(messages.ADD_SERVER_SUCCESS.format(server_name=data['name']), admin_id, msg.message_id)
             else:
@@ -1092,7 +1094,12 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         _clear_admin_state(admin_id)
         
         server = _db_manager.get_server_by_id(server_id)
+        # Покупки сервера удаляются каскадно: их подписки тоже убираются из кэша
+        purchase_ids = _db_manager.get_purchase_ids_by_server(server_id) if server else []
         if server and _db_manager.delete_server(server_id):
+            invalidate_api_client(server_id)
+            _db_manager.invalidate_server(server_id)
+            _db_manager.invalidate_subscription(*purchase_ids)
             _bot.edit_message_text(messages.SERVER_DELETED_SUCCESS.format(server_name=server['name']), admin_id, message.message_id, reply_markup=inline_keyboards.get_back_button("admin_server_management"))
         else:
             _bot.edit_message_text(messages.SERVER_DELETED_ERROR, admin_id, message.message_id, reply_markup=inline_keyboards.get_back_button("admin_server_management"))
@@ -1318,7 +1325,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         new_caption = message.caption + "\n\n" + messages.ADMIN_PAYMENT_REJECTED_DISPLAY.format(admin_username=f"@{admin_user.username}" if admin_user.username else admin_user.first_name)
         _bot.edit_message_caption(new_caption, message.chat.id, message.message_id, parse_mode='Markdown')
         order_details = json.loads(payment['order_details_json'])
-        _bot.send_message(order_details['user_telegram_id'], messages.PAYMENT_REJECTED_USER.format(support_link=SUPPORT_CHANNEL_LINK))
+        _bot.send_message(order_details['user_telegram_id'], messages.PAYMENT_REJECTED_USER.format(support_link=config.SUPPORT_CHANNEL_LINK))
         
         
     def save_inbound_changes(admin_id, message, server_id, selected_ids):
@@ -1632,6 +1639,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         if not _db_manager.delete_purchase(purchase_id):
             _bot.answer_callback_query(message.id, "Ошибка при удалении подписки из базы данных.", show_alert=True)
             return
+        _db_manager.invalidate_subscription(purchase_id)
 
         # Step 2: Delete the client from the X-UI panel
         try:
@@ -1963,6 +1971,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         )
 
         if new_server_id:
+            _db_manager.invalidate_server(new_server_id)
             _bot.send_message(admin_id, f"✅ Сервер '{server_data['name']}' успешно добавлен.")
         else:
             _bot.send_message(admin_id, f"❌ Произошла ошибка при добавлении сервера. Возможно, имя сервера уже используется.")
@@ -2159,18 +2168,20 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 continue
 
             # 2. Теперь для каждого входящего получаем полные данные отдельно
-            full_inbounds_details = []
-            for inbound_summary in panel_inbounds_summary:
-                inbound_id = inbound_summary.get('id')
-                if not inbound_id:
-                    continue
-                
-                # Вызов get_inbound для получения полных данных
-                detailed_inbound = api_client.get_inbound(inbound_id)
-                if detailed_inbound:
-                    full_inbounds_details.append(detailed_inbound)
-                else:
-                    logger.warning(f"Could not fetch details for inbound {inbound_id} on server {server_name}")
+            inbound_ids = [inbound_summary.get('id') for inbound_summary in panel_inbounds_summary if inbound_summary.get('id')]
+            async_client = get_async_api_client(server)
+            if async_client:
+                # Для x-ui запрашиваем все входящие параллельно
+                full_inbounds_details = run_sync(async_client.get_inbounds(inbound_ids), timeout=60)
+            else:
+                full_inbounds_details = []
+                for inbound_id in inbound_ids:
+                    # Вызов get_inbound для получения полных данных
+                    detailed_inbound = api_client.get_inbound(inbound_id)
+                    if detailed_inbound:
+                        full_inbounds_details.append(detailed_inbound)
+                    else:
+                        logger.warning(f"Could not fetch details for inbound {inbound_id} on server {server_name}")
 
             # 3. Сохраняем полные и нормализованные данные в базе данных
             normalized_configs = normalize_panel_inbounds(panel_type, full_inbounds_details)
@@ -2290,9 +2301,9 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         if not servers:
             report_parts.append("⚠️ В боте не определено ни одного сервера.")
         else:
+            online_status = check_servers_online(servers)
             for server in servers:
-                api_client = get_api_client(server)
-                if api_client and api_client.check_login():
+                if online_status.get(server['id']):
                     report_parts.append(f"✅ Подключение к серверу '{helpers.escape_markdown_v1(server['name'])}': **Успешно**")
                 else:
                     errors_found = True
@@ -2310,6 +2321,17 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             errors_found = True
             report_parts.append("⚠️ **Предупреждение:** Нет активных платежных шлюзов. Пользователи не смогут платить.")
         
+        # 5. Очередь обработки обновлений бота
+        dispatcher = getattr(_bot, 'dispatcher', None)
+        if dispatcher:
+            stats = dispatcher.stats()
+            report_parts.append("\n--- **۵. Очередь обработки обновлений** ---")
+            report_parts.append(
+                f"• В очереди: **{stats['queued']}** (пользователей в обработке: {stats['active_users']}, потоков: {stats['workers']})\n"
+                f"• Ожидание в очереди: среднее **{stats['wait_avg_ms']} мс**, максимум **{stats['wait_max_ms']} мс**\n"
+                f"• Обработано: {stats['processed']}, с ошибкой: {stats['failed']}"
+            )
+
         if not errors_found:
             report_parts.append("\n✅ **Результат:** Все ключевые части системы работают правильно.")
         else:
@@ -2531,12 +2553,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         _bot.edit_message_text("🔍 Проверка ссылок подписки...", admin_id, message.message_id)
         
         try:
-            # Получение всех активных покупок
-            active_purchases = _db_manager.get_all_active_purchases()
-            if not active_purchases:
-                _bot.edit_message_text("❌ Активных подписок не найдено.", admin_id, message.message_id)
-                return
-            
+            # Активные покупки читаются потоком, без загрузки всей таблицы в память
+            total_count = 0
             fixed_count = 0
             error_count = 0
             healthy_count = 0
@@ -2545,7 +2563,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             active_domain_record = _db_manager.get_active_subscription_domain()
             domain_status = "✅ Настроен" if active_domain_record else "❌ Не настроен"
             
-            for purchase in active_purchases:
+            for purchase in _db_manager.iter_active_purchases():
+                total_count += 1
                 try:
                     # Проверка наличия single_configs_json
                     if not purchase.get('single_configs_json'):
@@ -2566,10 +2585,14 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                     error_count += 1
                     logger.error(f"Error fixing subscription {purchase['id']}: {e}")
             
+            if not total_count:
+                _bot.edit_message_text("❌ Активных подписок не найдено.", admin_id, message.message_id)
+                return
+            
             # Отображение результата
             result_text = f"🔧 **Проверка и исправление ссылок подписки**\n\n"
             result_text += f"📊 **Общая статистика:**\n"
-            result_text += f"• Всего подписок: **{len(active_purchases)}**\n"
+            result_text += f"• Всего подписок: **{total_count}**\n"
             result_text += f"• Рабочих: **{healthy_count}**\n"
             result_text += f"• Исправлено: **{fixed_count}**\n"
             result_text += f"• С ошибками: **{error_count}**\n\n"
@@ -2600,7 +2623,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         """Управление callback'ом проверки ссылок подписки"""
         try:
             admin_id = call.from_user.id
-            if admin_id not in ADMIN_IDS:
+            if admin_id not in config.ADMIN_IDS:
                 _bot.answer_callback_query(call.id, "❌ Несанкционированный доступ", show_alert=True)
                 return
             
@@ -2615,7 +2638,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         """Управление callback'ом обновления всех ссылок подписки"""
         try:
             admin_id = call.from_user.id
-            if admin_id not in ADMIN_IDS:
+            if admin_id not in config.ADMIN_IDS:
                 _bot.answer_callback_query(call.id, "❌ Несанкционированный доступ", show_alert=True)
                 return
             
@@ -2647,38 +2670,51 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 _bot.edit_message_text("❌ Информация о сервере не найдена.", admin_id, message.message_id)
                 return
             
-            # Запрос на обновление к webhook server
-            import requests
-            webhook_url = f"https://{os.getenv('WEBHOOK_DOMAIN', 'localhost')}/admin/update_configs/{purchase_id}"
-            headers = {
-                'Authorization': f'Bearer {os.getenv("ADMIN_API_KEY", "your-secret-key")}'
-            }
-            
-            response = requests.post(webhook_url, headers=headers, timeout=30)
+            # Обновление выполняется рабочими потоками очереди задач; результат ждём в отдельном потоке,
+            # чтобы не занимать поток обработки обновлений этого администратора
+            job_id = _db_manager.create_job(JOB_REFRESH_PURCHASE, payload={'purchase_id': purchase_id}, total=1)
+            if not job_id:
+                _bot.edit_message_text("❌ Не удалось поставить обновление в очередь.", admin_id, message.message_id)
+                return
+            threading.Thread(
+                target=_track_refresh_purchase_job, args=(admin_id, message, job_id, purchase, server),
+                name=f"refresh-purchase-{job_id[:8]}", daemon=True
+            ).start()
+                
+        except Exception as e:
+            logger.error(f"Error updating configs from panel: {e}")
+            _bot.edit_message_text(
+                f"❌ Ошибка при обновлении конфигураций:\n{str(e)}",
+                admin_id, message.message_id
+            )
+
+    def _track_refresh_purchase_job(admin_id, message, job_id, purchase, server):
+        """Показывает итог задачи обновления конфигураций одной покупки."""
+        try:
+            job = wait_for_job(_db_manager, job_id, timeout=30)
             
-            if response.status_code == 200:
+            if job and job['status'] == 'done':
                 _bot.edit_message_text(
-                    f"✅ Конфигурации для покупки #{purchase_id} успешно обновлены с основной панели.\n\n"
+                    f"✅ Конфигурации для покупки #{purchase['id']} успешно обновлены с основной панели.\n\n"
                     f"📊 **Детали:**\n"
                     f"• Сервер: {server['name']}\n"
                     f"• Пользователь: {purchase.get('user_first_name', 'N/A')}\n"
                     f"• Дата обновления: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
                     admin_id, message.message_id, parse_mode='Markdown'
                 )
-            else:
+            elif job and job['status'] == 'failed':
                 _bot.edit_message_text(
                     f"❌ Ошибка при обновлении конфигураций.\n"
-                    f"Код ошибки: {response.status_code}\n"
-                    f"Сообщение: {response.text}",
+                    f"Сообщение: {job.get('error')}",
+                    admin_id, message.message_id
+                )
+            else:
+                _bot.edit_message_text(
+                    "⏳ Обновление поставлено в очередь и ещё выполняется. Проверьте покупку позже.",
                     admin_id, message.message_id
                 )
-                
         except Exception as e:
-            logger.error(f"Error updating configs from panel: {e}")
-            _bot.edit_message_text(
-                f"❌ Ошибка при обновлении конфигураций:\n{str(e)}",
-                admin_id, message.message_id
-            )
+            logger.error(f"Error tracking config refresh job {job_id}: {e}")
 
     def refresh_all_subscription_links(admin_id, message):
         """
@@ -2690,87 +2726,70 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         _bot.edit_message_text("⏳ Обновление всех ссылок подписки...", admin_id, message.message_id)
         
         try:
-            # Получение всех активных покупок
-            active_purchases = _db_manager.get_all_active_purchases()
+            # Подсчёт активных покупок по типам (потоковое чтение)
+            profile_count = normal_count = 0
+            for purchase in _db_manager.iter_active_purchases():
+                if purchase.get('profile_id'):
+                    profile_count += 1
+                else:
+                    normal_count += 1
             
-            if not active_purchases:
+            if not profile_count + normal_count:
                 _bot.edit_message_text("❌ Активных покупок не найдено.", admin_id, message.message_id)
                 return
             
-            # Проверка настроек
-            webhook_domain = os.getenv('WEBHOOK_DOMAIN')
-            admin_api_key = os.getenv('ADMIN_API_KEY')
+            # Обновление выполняется рабочими потоками очереди задач; здесь только отслеживаем прогресс
+            job_id = _db_manager.create_job(JOB_REFRESH_ALL, total=profile_count + normal_count)
+            if not job_id:
+                _bot.edit_message_text("❌ Не удалось поставить обновление в очередь.", admin_id, message.message_id)
+                return
+            threading.Thread(
+                target=_track_refresh_all_job, args=(admin_id, message, job_id, profile_count, normal_count),
+                name=f"refresh-all-{job_id[:8]}", daemon=True
+            ).start()
+            
+        except Exception as e:
+            logger.error(f"Error refreshing all subscription links: {e}")
+            error_text = f"❌ Ошибка при обновлении ссылок подписки:\n{str(e)}"
+            
+            # Добавление кнопки "Назад"
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton("🔙 Назад в меню администратора", callback_data="admin_main_menu"))
             
-            if not webhook_domain:
+            _bot.edit_message_text(error_text, admin_id, message.message_id, reply_markup=markup)
+
+    def _track_refresh_all_job(admin_id, message, job_id, profile_count, normal_count):
+        """Показывает прогресс задачи обновления всех ссылок и её итог."""
+        def show_progress(job):
+            if job['total']:
                 _bot.edit_message_text(
-                    "❌ Переменная WEBHOOK_DOMAIN не установлена в файле .env.\n"
-                    "Пожалуйста, сначала настройте домен webhook.",
+                    f"⏳ Обновление всех ссылок подписки... {job['processed']}/{job['total']}",
                     admin_id, message.message_id
                 )
-                return
+        
+        try:
+            job = wait_for_job(_db_manager, job_id, timeout=1800, on_progress=show_progress, poll_interval=3)
+            result = (job or {}).get('result') or {}
+            success_count = result.get('succeeded', 0)
+            error_count = result.get('failed', 0)
+            total_count = result.get('total', profile_count + normal_count)
             
-            if not admin_api_key:
-                _bot.edit_message_text(
-                    "❌ Переменная ADMIN_API_KEY не установлена в файле .env.\n"
-                    "Пожалуйста, сначала настройте API-ключ администратора.",
-                    admin_id, message.message_id
+            if not job or job['status'] != 'done':
+                markup = types.InlineKeyboardMarkup()
+                markup.add(types.InlineKeyboardButton("🔙 Назад в меню администратора", callback_data="admin_main_menu"))
+                status_text = (
+                    f"❌ Ошибка при обновлении ссылок подписки:\n{job.get('error')}" if job and job['status'] == 'failed'
+                    else "⏳ Обновление ещё выполняется в фоне. Пожалуйста, проверьте логи позже."
                 )
+                _bot.edit_message_text(status_text, admin_id, message.message_id, reply_markup=markup)
                 return
             
-            success_count = 0
-            error_count = 0
-            profile_count = 0
-            normal_count = 0
-            
-            # Прямое обновление через webhook server
-            import requests
-            webhook_base_url = f"https://{webhook_domain}/admin/update_configs"
-            headers = {
-                'Authorization': f'Bearer {admin_api_key}'
-            }
-            
-            for purchase in active_purchases:
-                try:
-                    # Определение типа покупки
-                    if purchase.get('profile_id'):
-                        profile_count += 1
-                        purchase_type = "Профиль"
-                    else:
-                        normal_count += 1
-                        purchase_type = "Обычная"
-                    
-                    webhook_url = f"{webhook_base_url}/{purchase['id']}"
-                    response = requests.post(webhook_url, headers=headers, timeout=30)
-                    
-                    if response.status_code == 200:
-                        success_count += 1
-                        logger.info(f"Successfully updated purchase {purchase['id']} ({purchase_type})")
-                    elif response.status_code == 401:
-                        error_count += 1
-                        logger.error(f"Unauthorized for purchase {purchase['id']}: Invalid API key")
-                    elif response.status_code == 404:
-                        error_count += 1
-                        logger.error(f"Purchase {purchase['id']} not found in webhook server")
-                    else:
-                        error_count += 1
-                        logger.error(f"HTTP {response.status_code} for purchase {purchase['id']}: {response.text}")
-                        
-                except requests.exceptions.ConnectionError:
-                    error_count += 1
-                    logger.error(f"Connection error for purchase {purchase['id']}: Webhook server not reachable")
-                except requests.exceptions.Timeout:
-                    error_count += 1
-                    logger.error(f"Timeout for purchase {purchase['id']}")
-                except Exception as e:
-                    error_count += 1
-                    logger.error(f"Error updating purchase {purchase['id']}: {e}")
-            
             # Отображение результата с большей детализацией
             result_text = f"🔄 **Обновление ссылок подписки**\n\n"
             result_text += f"📊 **Общие результаты:**\n"
             result_text += f"• ✅ Успешно: **{success_count}** ссылок\n"
             result_text += f"• ❌ Неудачно: **{error_count}** ссылок\n"
-            result_text += f"• 📈 Всего: **{len(active_purchases)}** ссылок\n\n"
+            result_text += f"• 📈 Всего: **{total_count}** ссылок\n\n"
             
             result_text += f"📋 **Детали покупок:**\n"
             result_text += f"• 🎯 Покупки профилей: **{profile_count}**\n"
@@ -3499,7 +3518,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         
         try:
             # Получение статистики покупок
-            active_purchases = _db_manager.get_all_active_purchases()
+            active_purchases_count = _db_manager.count_active_purchases()
             profile_purchases = _db_manager.get_all_purchases_by_type('profile')
             normal_purchases = _db_manager.get_all_purchases_by_type('normal')
             
@@ -3517,7 +3536,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             text += f"• Admin API Key: `{'настроен' if admin_api_key else 'не настроено'}`\n\n"
             
             text += f"📈 **Статистика покупок:**\n"
-            text += f"• Всего активных покупок: **{len(active_purchases)}**\n"
+            text += f"• Всего активных покупок: **{active_purchases_count}**\n"
             text += f"• Покупки профилей: **{len(profile_purchases)}**\n"
             text += f"• Обычные покупки: **{len(normal_purchases)}**\n\n"
             
@@ -3704,25 +3723,11 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 _bot.edit_message_text("❌ Сервер не найден!", admin_id, message.message_id)
                 return
             
-            # Создание API client
-            api_client = None
-            if server_info['panel_type'] == 'alireza':
-                from api_client.alireza_api_client import AlirezaAPIClient
-                api_client = AlirezaAPIClient(
-                    panel_url=server_info['panel_url'],
-                    username=server_info['username'],
-                    password=server_info['password']
-                )
-            else:
-                from api_client.xui_api_client import XuiAPIClient
-                api_client = XuiAPIClient(
-                    panel_url=server_info['panel_url'],
-                    username=server_info['username'],
-                    password=server_info['password']
-                )
+            # Получение API client из общего реестра
+            api_client = get_api_client(server_info)
             
             # Попытка входа
-            if not api_client.check_login():
+            if not api_client or not api_client.check_login():
                 text = f"❌ **Ошибка подключения к панели**\n\n"
                 text += f"Сервер: **{server_info['name']}**\n"
                 text += f"Тип панели: **{server_info['panel_type']}**\n"
@@ -3780,25 +3785,11 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 _bot.edit_message_text("❌ Сервер не найден!", admin_id, message.message_id)
                 return
             
-            # Создание API client
-            api_client = None
-            if server_info['panel_type'] == 'alireza':
-                from api_client.alireza_api_client import AlirezaAPIClient
-                api_client = AlirezaAPIClient(
-                    panel_url=server_info['panel_url'],
-                    username=server_info['username'],
-                    password=server_info['password']
-                )
-            else:
-                from api_client.xui_api_client import XuiAPIClient
-                api_client = XuiAPIClient(
-                    panel_url=server_info['panel_url'],
-                    username=server_info['username'],
-                    password=server_info['password']
-                )
+            # Получение API client из общего реестра
+            api_client = get_api_client(server_info)
             
             # Попытка входа
-            if not api_client.check_login():
+            if not api_client or not api_client.check_login():
                 _bot.edit_message_text("❌ Ошибка подключения к панели", admin_id, message.message_id)
                 return
             
@@ -80,7 +80,7 @@ def start_webhook_setup_flow(admin_id, message):
     _admin_states[admin_id] = {'state': 'waiting_for_webhook_domain', 'prompt_message_id': prompt.message_id}
 
 def _create_and_start_webhook_service():
-    """Создает и активирует systemd сервис для веб-хука."""
+    """Создает и активирует systemd сервис для веб-хука (gunicorn с несколькими воркерами, см. gunicorn.conf.py)."""
     service_content = """
 [Unit]
 Description=AlamorBot Webhook Server
@@ -88,7 +88,10 @@ After=network.target
 [Service]
 User=root
 WorkingDirectory=/var/www/alamorvpn_bot
-ExecStart=/var/www/alamorvpn_bot/.venv/bin/python3 /var/www/alamorvpn_bot/webhook_server.py
+ExecStart=/var/www/alamorvpn_bot/.venv/bin/gunicorn --config /var/www/alamorvpn_bot/gunicorn.conf.py webhook_server:app
+ExecReload=/bin/kill -s HUP $MAINPID
+KillMode=mixed
+TimeoutStopSec=35
 Restart=always
 RestartSec=10s
 [Install]
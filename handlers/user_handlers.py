@@ -5,18 +5,22 @@ import json
 import qrcode
 import datetime
 import os
+import threading
 from io import BytesIO
 import uuid
 import requests
-from config import SUPPORT_CHANNEL_LINK, ADMIN_IDS
+import config
 from database.db_manager import DatabaseManager
 from api_client.xui_api_client import XuiAPIClient
 from utils import messages, helpers
 from keyboards import inline_keyboards
 from utils.config_generator import ConfigGenerator
 from utils.helpers import is_float_or_int , escape_markdown_v1
-from config import ZARINPAL_MERCHANT_ID, WEBHOOK_DOMAIN , ZARINPAL_SANDBOX
 from utils.bot_helpers import send_subscription_info , finalize_profile_purchase
+from utils.config_refresh import JOB_REFRESH_PURCHASE
+from utils.job_queue import wait_for_job
+from utils.state_store import create_state_store
+from utils.traffic_collector import ServerTrafficRefresher
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +29,10 @@ _bot: telebot.TeleBot = None
 _db_manager: DatabaseManager = None
 _xui_api: XuiAPIClient = None
 _config_generator: ConfigGenerator = None
+_traffic_refresher: ServerTrafficRefresher = None
 # Переменные состояния
 _user_menu_message_ids = {} # {user_id: message_id}
-_user_states = {} # {user_id: {'state': '...', 'data': {...}}}
+_user_states = None # {user_id: {'state': '...', 'data': {...}}}, создаётся в register_user_handlers
 def _show_menu(user_id, text, markup, message=None, parse_mode='Markdown'):
     """
     Эта функция интеллектуально обрабатывает ошибки разбора Markdown.
@@ -61,18 +66,23 @@ ZARINPAL_API_URL = "https://api.zarinpal.com/pg/v4/payment/request.json"
 ZARINPAL_STARTPAY_URL = "https://www.zarinpal.com/pg/StartPay/"
 
 def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
-    global _bot, _db_manager, _xui_api, _config_generator
+    global _bot, _db_manager, _xui_api, _config_generator, _traffic_refresher, _user_states
     _bot = bot_instance
     _db_manager = db_manager_instance
     _xui_api = xui_api_instance
     _config_generator = ConfigGenerator(db_manager_instance)
+    _traffic_refresher = ServerTrafficRefresher(db_manager_instance, min_interval=config.TRAFFIC_REFRESH_MIN_INTERVAL)
+    _user_states = create_state_store('user', config.STATE_STORE_BACKEND, ttl=config.CONVERSATION_STATE_TTL)
+    _user_states.bind(db_manager_instance)
 
     # --- Основные обработчики ---
     @_bot.callback_query_handler(func=lambda call: not call.from_user.is_bot and call.data.startswith('user_'))
     def handle_main_callbacks(call):
         """Обработка кнопок главного меню пользователя"""
         user_id = call.from_user.id
-        _bot.answer_callback_query(call.id)
+        # На обновление трафика отвечает refresh_traffic_info (результат показывается во всплывающем уведомлении)
+        if not call.data.startswith("user_refresh_traffic_"):
+            _bot.answer_callback_query(call.id)
         # Очищать состояние пользователя только если выбран пункт из главного меню
         if call.data in ["user_main_menu", "user_buy_service", "user_my_services", "user_free_test", "user_support"]:
             _clear_user_state(user_id)
@@ -95,7 +105,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
         elif data == "user_buy_profile": # <-- Добавьте этот блок
             start_profile_purchase(user_id, call.message)
         elif data == "user_support":
-            _bot.edit_message_text(f"📞 Для поддержки свяжитесь с нами: {SUPPORT_CHANNEL_LINK}", user_id, call.message.message_id)
+            _bot.edit_message_text(f"📞 Для поддержки свяжитесь с нами: {config.SUPPORT_CHANNEL_LINK}", user_id, call.message.message_id)
         elif data.startswith("user_service_details_"):
             purchase_id = int(data.replace("user_service_details_", ""))
             show_service_details_with_traffic(user_id, purchase_id, call.message)
@@ -378,7 +388,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 _bot.edit_message_text("❌ Произошла ошибка при создании счета.", user_id, message.message_id)
                 return
 
-            callback_url = f"https://{WEBHOOK_DOMAIN}/zarinpal/verify"
+            callback_url = f"https://{config.WEBHOOK_DOMAIN}/zarinpal/verify"
             
             payload = {
                 "merchant_id": gateway['merchant_id'],
@@ -520,7 +530,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
         )
         markup = inline_keyboards.get_admin_payment_action_menu(payment_id)
         
-        for admin_id in ADMIN_IDS:
+        for admin_id in config.ADMIN_IDS:
             try:
                 sent_msg = _bot.send_photo(
                     admin_id,
@@ -530,7 +540,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                     reply_markup=markup
                 )
                 # Сохраняем в базе данных только первое сообщение администратору
-                if admin_id == ADMIN_IDS[0]:
+                if admin_id == config.ADMIN_IDS[0]:
                     _db_manager.update_payment_admin_notification_id(payment_id, sent_msg.message_id)
             except Exception as e:
                 logger.error(f"Failed to send payment notification to admin {admin_id}: {e}")
@@ -994,6 +1004,18 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
             _bot.edit_message_text("❌ Произошла ошибка при списании средств с кошелька. Пожалуйста, свяжитесь с поддержкой.", user_id, message.message_id)
             _clear_user_state(user_id)
 
+    def _get_purchase_traffic(purchase):
+        """
+        Возвращает (traffic_info, synced_at). Сначала используется снимок фонового сборщика трафика;
+        к панели обращаемся напрямую, только если снимка ещё нет (например, для новой покупки).
+        """
+        if not purchase.get('client_uuid'):
+            return None, None
+        snapshot = _db_manager.get_traffic_snapshot(purchase['id'])
+        if snapshot:
+            return snapshot, snapshot.get('synced_at') or snapshot.get('updated_at')
+        return _db_manager.get_client_traffic_info(purchase['client_uuid']), None
+
     def show_service_details_with_traffic(user_id, purchase_id, message):
         """
         Отображение деталей услуги вместе с информацией о трафике и оставшемся времени
@@ -1007,9 +1029,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
         days_remaining = helpers.calculate_days_remaining(purchase.get('expire_date'))
         
         # Получение информации о трафике
-        traffic_info = None
-        if purchase.get('client_uuid'):
-            traffic_info = _db_manager.get_client_traffic_info(purchase['client_uuid'])
+        traffic_info, synced_at = _get_purchase_traffic(purchase)
         
         # Создание текста для отображения
         text = f"📊 **Детали услуги {purchase_id}**\n\n"
@@ -1053,6 +1073,8 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 text += f"💾 Оставшийся объем: {remaining_formatted}\n"
                 if remaining_bytes <= 0:
                     text += f"⚠️ **Предупреждение:** объем исчерпан!\n"
+            if synced_at:
+                text += f"🕒 Данные обновлены: {synced_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
         else:
             text += f"\n⚠️ **Информация о трафике:** недоступна\n"
         
@@ -1085,7 +1107,13 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
         )
         markup.add(types.InlineKeyboardButton("🔙 Назад к услугам", callback_data="user_my_services"))
         
-        _bot.edit_message_text(text, user_id, message.message_id, parse_mode='Markdown', reply_markup=markup)
+        try:
+            _bot.edit_message_text(text, user_id, message.message_id, parse_mode='Markdown', reply_markup=markup)
+        except telebot.apihelper.ApiTelegramException as e:
+            # Повторный показ без изменений (например, трафик не изменился с прошлого обновления)
+            if 'message is not modified' not in str(e):
+                raise
+            return
         
         # Отправка QR-кода
         if sub_link:
@@ -1121,16 +1149,30 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 _bot.edit_message_text("❌ Информация о сервере не найдена.", user_id, message.message_id)
                 return
             
-            # Запрос на обновление к серверу веб-хуков
-            import requests
-            webhook_url = f"https://{os.getenv('WEBHOOK_DOMAIN', 'localhost')}/admin/update_configs/{purchase_id}"
-            headers = {
-                'Authorization': f'Bearer {os.getenv("ADMIN_API_KEY", "your-secret-key")}'
-            }
-            
-            response = requests.post(webhook_url, headers=headers, timeout=30)
+            # Обновление выполняется рабочими потоками очереди задач; результат ждём в отдельном потоке,
+            # чтобы не задерживать следующие обновления этого пользователя
+            job_id = _db_manager.create_job(JOB_REFRESH_PURCHASE, payload={'purchase_id': purchase_id}, total=1)
+            if not job_id:
+                _bot.edit_message_text("❌ Не удалось поставить обновление в очередь. Попробуйте позже.", user_id, message.message_id)
+                return
+            threading.Thread(
+                target=_track_refresh_link_job, args=(user_id, purchase_id, message, job_id, server),
+                name=f"refresh-link-{job_id[:8]}", daemon=True
+            ).start()
+                
+        except Exception as e:
+            logger.error(f"Error refreshing subscription link: {e}")
+            _bot.edit_message_text(
+                f"❌ Ошибка при обновлении ссылки на подписку:\n{str(e)}",
+                user_id, message.message_id
+            )
+
+    def _track_refresh_link_job(user_id, purchase_id, message, job_id, server):
+        """Показывает итог задачи обновления ссылки на подписку."""
+        try:
+            job = wait_for_job(_db_manager, job_id, timeout=30)
             
-            if response.status_code == 200:
+            if job and job['status'] == 'done':
                 _bot.edit_message_text(
                     f"✅ Ссылка на подписку успешно обновлена!\n\n"
                     f"📊 **Детали:**\n"
@@ -1142,20 +1184,19 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 
                 # Повторное отображение деталей услуги
                 show_service_details_with_traffic(user_id, purchase_id, message)
-            else:
+            elif job and job['status'] == 'failed':
                 _bot.edit_message_text(
                     f"❌ Ошибка при обновлении ссылки на подписку.\n"
-                    f"Код ошибки: {response.status_code}\n"
-                    f"Сообщение: {response.text}",
+                    f"Сообщение: {job.get('error')}",
+                    user_id, message.message_id
+                )
+            else:
+                _bot.edit_message_text(
+                    "⏳ Обновление ссылки ещё выполняется. Пожалуйста, проверьте услугу через минуту.",
                     user_id, message.message_id
                 )
-                
         except Exception as e:
-            logger.error(f"Error refreshing subscription link: {e}")
-            _bot.edit_message_text(
-                f"❌ Ошибка при обновлении ссылки на подписку:\n{str(e)}",
-                user_id, message.message_id
-            )
+            logger.error(f"Error tracking subscription link refresh job {job_id}: {e}")
 
     def refresh_traffic_info(user_id, purchase_id, message, call_id=None):
         """
@@ -1172,14 +1213,22 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 _bot.answer_callback_query(call_id, "❌ Информация о клиенте недоступна", show_alert=True)
             return
         
-        # Получение новой информации о трафике
-        traffic_info = _db_manager.get_client_traffic_info(purchase['client_uuid'])
+        # Внеочередной опрос сервера покупки (не чаще TRAFFIC_REFRESH_MIN_INTERVAL секунд на сервер);
+        # иначе показываем, насколько свежи данные фонового сборщика
+        refreshed = _traffic_refresher.refresh(purchase['server_id']) if purchase.get('server_id') else False
+        traffic_info, synced_at = _get_purchase_traffic(purchase)
         
-        if traffic_info:
+        if traffic_info and refreshed:
             if call_id:
                 _bot.answer_callback_query(call_id, "✅ Информация о трафике обновлена")
             # Повторное отображение с новой информацией
             show_service_details_with_traffic(user_id, purchase_id, message)
+        elif traffic_info:
+            if call_id:
+                as_of = f" на {synced_at.strftime('%H:%M:%S')}" if synced_at else ""
+                _bot.answer_callback_query(
+                    call_id, f"🕒 Данные актуальны{as_of}. Обновлять можно не чаще раза в {config.TRAFFIC_REFRESH_MIN_INTERVAL} сек."
+                )
         else:
             if call_id:
                 _bot.answer_callback_query(call_id, "❌ Ошибка при получении информации о трафике", show_alert=True)
@@ -123,9 +123,22 @@ EOL
     if [ $? -ne 0 ]; then print_error "Failed to issue SSL certificate. Please ensure the domain is correctly pointed to this server's IP."; exit 1; fi
 
     print_info "Step 3: Configuring Nginx as a Reverse Proxy..."
+    # Same defaults as TELEGRAM_WEBHOOK_PATH / TELEGRAM_WEBHOOK_LISTEN in config.py
+    telegram_webhook_path=$(grep '^TELEGRAM_WEBHOOK_PATH=' .env 2>/dev/null | cut -d '=' -f2 | tr -d '"')
+    telegram_webhook_path=${telegram_webhook_path:-/telegram/webhook}
+    telegram_webhook_listen=$(grep '^TELEGRAM_WEBHOOK_LISTEN=' .env 2>/dev/null | cut -d '=' -f2 | tr -d '"')
+    telegram_webhook_listen=${telegram_webhook_listen:-127.0.0.1:8081}
     sudo tee "$NGINX_CONFIG_PATH" > /dev/null <<- EOL
 server {
     server_name $payment_domain;
+    # Telegram updates for the bot when BOT_UPDATE_MODE=webhook
+    location = $telegram_webhook_path {
+        proxy_pass http://$telegram_webhook_listen;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+    }
     location / {
         proxy_pass http://127.0.0.1:8080;
         proxy_set_header Host \$host;
@@ -177,7 +190,10 @@ After=network.target
 [Service]
 User=root
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$INSTALL_DIR/.venv/bin/python3 $INSTALL_DIR/webhook_server.py
+ExecStart=$INSTALL_DIR/.venv/bin/gunicorn --config $INSTALL_DIR/gunicorn.conf.py webhook_server:app
+ExecReload=/bin/kill -s HUP \$MAINPID
+KillMode=mixed
+TimeoutStopSec=35
 Restart=always
 RestartSec=10s
 [Install]
@@ -562,6 +562,22 @@ def get_message_management_menu(messages_on_page, current_page, total_pages):
     return markup
 
 
+def get_users_list_menu(users_on_page, current_page, total_pages, has_next):
+    """Навигация по постраничному списку пользователей (keyset-пагинация по id пользователя)."""
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    nav_buttons = []
+    if current_page > 1 and users_on_page:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"admin_users_prev_{current_page - 1}_{users_on_page[0]['id']}"))
+    nav_buttons.append(types.InlineKeyboardButton(f"{current_page}/{total_pages}", callback_data="no_action"))
+    if has_next and users_on_page:
+        nav_buttons.append(types.InlineKeyboardButton("Вперед ➡️", callback_data=f"admin_users_next_{current_page + 1}_{users_on_page[-1]['id']}"))
+    if len(nav_buttons) > 1:
+        markup.row(*nav_buttons)
+
+    markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="admin_user_management"))
+    return markup
+
+
 def get_manage_user_menu(user_telegram_id):
     """Создает панель управления для конкретного пользователя."""
     markup = types.InlineKeyboardMarkup(row_width=2)
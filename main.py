@@ -1,41 +1,45 @@
 # main.py
 
-import telebot
 import logging
 import os
 
-from config import BOT_TOKEN, ADMIN_IDS, REQUIRED_CHANNEL_ID, REQUIRED_CHANNEL_LINK
-from database.db_manager import DatabaseManager
+import config
+from config import validate_settings
+from database.db_manager import get_db_manager
 from api_client.xui_api_client import XuiAPIClient
 from handlers import admin_handlers, user_handlers
 from utils import messages, helpers
+from utils.traffic_collector import TrafficCollector
+from utils.job_queue import JobQueue
+from utils.config_refresh import register_config_refresh_jobs
+from utils.broadcaster import register_broadcast_jobs
+from utils.update_dispatcher import get_bot
 from keyboards import inline_keyboards
 
-# --- Logging Setup ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# --- Instantiation ---
-if not BOT_TOKEN:
-    logger.critical("BOT_TOKEN is not set. Exiting.")
-    exit()
+# Импорт модуля не создаёт бота, соединения с базой и файлов журнала:
+# бот (get_bot) и DatabaseManager (get_db_manager) создаются при первом обращении.
 
-bot = telebot.TeleBot(BOT_TOKEN)
-db_manager = DatabaseManager()
+# --- Logging Setup ---
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("bot.log", encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
 
 # --- /start command handler ---
-@bot.message_handler(commands=['start'])
 def send_welcome(message):
+    bot = get_bot()
+    db_manager = get_db_manager()
     user_id = message.from_user.id
     first_name = message.from_user.first_name
     logger.info(f"Received /start from user ID: {user_id} ({first_name})")
+    # Настройки читаются из кэша DatabaseManager, без обращения к базе на каждый /start
     brand_name = db_manager.get_setting('brand_name') or "FreeNet VPN"
     # --- Channel Lock Logic ---
     required_channel_id_str = db_manager.get_setting('required_channel_id')
@@ -60,56 +64,106 @@ def send_welcome(message):
     support_link = db_manager.get_setting('support_link')
     
     if helpers.is_admin(user_id):
-        brand_name = db_manager.get_setting('brand_name') or "FreeNet VPN"
         admin_welcome = messages.ADMIN_WELCOME.format(brand_name=brand_name)
         bot.send_message(user_id, admin_welcome, reply_markup=inline_keyboards.get_admin_main_inline_menu())
     else:
-        # Читаем название бренда из базы данных и задаём для него значение по умолчанию
-        brand_name = db_manager.get_setting('brand_name') or "FreeNet VPN"
-        
         # Добавляем название бренда в функцию отправки сообщения
         welcome_text = messages.START_WELCOME.format(brand_name=brand_name, first_name=first_name)
         user_menu_markup = inline_keyboards.get_user_main_inline_menu(support_link)
         bot.send_message(user_id, welcome_text, parse_mode='Markdown', reply_markup=user_menu_markup)
 
-@bot.message_handler(commands=['myid'])
 def send_user_id(message):
+    bot = get_bot()
     user_id = message.from_user.id
     bot.reply_to(message, f"Your numeric ID is:\n`{user_id}`", parse_mode='Markdown')
 
-def main():
-    bot.remove_webhook()
-    logger.info("Bot is starting...")
-    
+def load_dynamic_admins():
     # --- Load dynamic admins from database ---
     try:
-        db_admins = db_manager.get_all_admins()
+        db_admins = get_db_manager().get_all_admins()
         if db_admins:
             for admin in db_admins:
-                if admin['telegram_id'] not in ADMIN_IDS:
-                    ADMIN_IDS.append(admin['telegram_id'])
-        logger.info(f"Final admin list loaded: {ADMIN_IDS}")
+                if admin['telegram_id'] not in config.ADMIN_IDS:
+                    config.ADMIN_IDS.append(admin['telegram_id'])
+        logger.info(f"Final admin list loaded: {config.ADMIN_IDS}")
     except Exception as e:
         logger.error(f"Could not load dynamic admins from database: {e}")
 
-    # --- Run database migrations on startup ---
+def register_handlers():
+    """Handlers and in-memory state needed by every process that processes updates (polling or webhook workers)."""
+    bot = get_bot()
+    db_manager = get_db_manager()
+    load_dynamic_admins()
+
+    # --- Preload message templates into memory ---
     try:
-        db_manager.run_migrations()
-        logger.info("Database schema checked/updated successfully.")
+        helpers.get_message_store().load()
     except Exception as e:
-        logger.critical(f"FATAL: Could not migrate database tables. Error: {e}")
-        return
+        logger.error(f"Could not preload message templates: {e}")
 
-    # Register handlers
+    # Register handlers (/start и /myid — первыми, как и раньше)
+    bot.register_message_handler(send_welcome, commands=['start'])
+    bot.register_message_handler(send_user_id, commands=['myid'])
     admin_handlers.register_admin_handlers(bot, db_manager, XuiAPIClient)
     logger.info("Admin handlers registered.")
 
     user_handlers.register_user_handlers(bot, db_manager, XuiAPIClient)
     logger.info("User handlers registered.")
 
+def start_background_services():
+    """Background workers run only in the main bot process, never in webhook ingestion workers."""
+    bot = get_bot()
+    db_manager = get_db_manager()
+    # --- Start background traffic collector ---
+    if config.TRAFFIC_COLLECT_INTERVAL > 0:
+        TrafficCollector(db_manager, interval=config.TRAFFIC_COLLECT_INTERVAL).start()
+
+    # --- Drop conversation states of abandoned dialogs (expired rows are already ignored on read) ---
+    purged = db_manager.purge_expired_conversation_states()
+    if purged:
+        logger.info(f"Purged {purged} expired conversation states.")
+
+    # --- Start background job workers (config refreshes and broadcasts queued by the bot and the webhook server) ---
+    job_queue = JobQueue(db_manager, workers=config.JOB_QUEUE_WORKERS, poll_interval=config.JOB_QUEUE_POLL_INTERVAL)
+    register_config_refresh_jobs(job_queue, db_manager)
+    register_broadcast_jobs(job_queue, bot, db_manager, workers=config.BROADCAST_WORKERS, rate=config.BROADCAST_RATE)
+    job_queue.start()
+
+def run_polling():
+    bot = get_bot()
+    bot.remove_webhook()
     logger.info("Bot is now polling for updates...")
     bot.infinity_polling(logger_level=logging.WARNING)
     logger.info("Bot polling stopped.")
 
+def main():
+    setup_logging()
+    validate_settings()
+    bot = get_bot()
+    db_manager = get_db_manager()
+    logger.info(f"Bot is starting (update mode: {config.BOT_UPDATE_MODE})...")
+
+    # --- Run database migrations on startup ---
+    try:
+        db_manager.run_migrations()
+        db_manager.apply_schema_upgrades()
+        logger.info("Database schema checked/updated successfully.")
+    except Exception as e:
+        logger.critical(f"FATAL: Could not migrate database tables. Error: {e}")
+        return
+
+    register_handlers()
+    start_background_services()
+
+    if config.BOT_UPDATE_MODE == "webhook":
+        # Flask нужен только в режиме webhook: при polling он не импортируется
+        import bot_webhook
+        # Обновления приходят по HTTPS через nginx; при ошибке настройки webhook работаем в режиме polling
+        if bot_webhook.set_telegram_webhook(bot):
+            bot_webhook.serve(bot_webhook.create_app(bot))
+            return
+        logger.error("Could not enable webhook mode, falling back to polling.")
+    run_polling()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -38,6 +38,10 @@ def run_migrations():
                 """
                 ALTER TABLE profile_inbounds 
                 ADD COLUMN IF NOT EXISTS config_params JSONB;
+                """,
+                """
+                ALTER TABLE purchases 
+                ADD COLUMN IF NOT EXISTS configs_hash TEXT;
                 """
             ]
         else:
@@ -52,6 +56,10 @@ def run_migrations():
                 """
                 ALTER TABLE profile_inbounds 
                 ADD COLUMN config_params TEXT;
+                """,
+                """
+                ALTER TABLE purchases 
+                ADD COLUMN configs_hash TEXT;
                 """
             ]
         
@@ -78,6 +86,9 @@ def run_migrations():
         else:
             conn.commit()
         logging.info("All migrations completed successfully!")
+
+        # Индексы горячих запросов (purchases.sub_id, client_uuid, активные покупки, payments.authority)
+        db_manager.ensure_indexes()
         
     except Exception as e:
         logging.error(f"A critical error occurred during the migration process: {e}")
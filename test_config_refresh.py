@@ -0,0 +1,131 @@
+"""
+Проверка задач обновления конфигураций (refresh_all_configs / refresh_purchase_configs) на реальной схеме базы данных.
+
+Создаёт таблицы (create_tables + apply_schema_upgrades) в базе из .env, добавляет тестовые
+пользователя, сервер, inbound и покупку, выполняет задачи через JobQueue и проверяет,
+что конфигурации покупки пересобраны. Тестовые строки удаляются в конце.
+Запуск: python test_config_refresh.py (только на тестовой базе данных)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import uuid
+
+from database.db_manager import DatabaseManager
+from utils.config_refresh import register_config_refresh_jobs, JOB_REFRESH_ALL, JOB_REFRESH_PURCHASE
+from utils.job_queue import JobQueue, wait_for_job
+
+TEST_TELEGRAM_ID = 990000000 + uuid.uuid4().int % 1000000
+TEST_INBOUND_ID = 7
+
+
+def create_fixtures(db):
+    """Тестовые строки; возвращает (user_id, server_id, purchase_id, client_uuid)."""
+    client_uuid = str(uuid.uuid4())
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO users (telegram_id, first_name) VALUES (%s, %s) RETURNING id",
+                (TEST_TELEGRAM_ID, "config-refresh-test")
+            )
+            user_id = cursor.fetchone()[0]
+            cursor.execute("""
+                INSERT INTO servers (name, panel_url, username, password, subscription_base_url, subscription_path_prefix)
+                VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+            """, (
+                f"config-refresh-test-{TEST_TELEGRAM_ID}", db._encrypt("https://panel.example.com"), db._encrypt("admin"),
+                db._encrypt("secret"), db._encrypt("https://sub.example.com:2096"), db._encrypt("sub")
+            ))
+            server_id = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO server_inbounds (server_id, inbound_id, remark, is_active) VALUES (%s, %s, %s, TRUE)",
+                (server_id, TEST_INBOUND_ID, "test-inbound")
+            )
+            cursor.execute("""
+                INSERT INTO synced_configs (server_id, inbound_id, remark, port, protocol, settings, stream_settings)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (
+                server_id, TEST_INBOUND_ID, "test-inbound", 443, "vless",
+                json.dumps({"clients": [{"flow": ""}]}), json.dumps({"network": "tcp", "security": "none"})
+            ))
+            cursor.execute("""
+                INSERT INTO purchases (user_id, server_id, initial_volume_gb, client_uuid, sub_id, is_active)
+                VALUES (%s, %s, %s, %s, %s, TRUE) RETURNING id
+            """, (user_id, server_id, 10, client_uuid, uuid.uuid4().hex[:16]))
+            purchase_id = cursor.fetchone()[0]
+            conn.commit()
+    return user_id, server_id, purchase_id, client_uuid
+
+
+def delete_fixtures(db, user_id, server_id):
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Покупки, inbound и синхронизированные конфигурации удаляются каскадно
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            cursor.execute("DELETE FROM servers WHERE id = %s", (server_id,))
+            conn.commit()
+
+
+def get_configs(db, purchase_id):
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT single_configs_json FROM purchases WHERE id = %s", (purchase_id,))
+            row = cursor.fetchone()
+            return json.loads(row[0]) if row and row[0] else []
+
+
+def set_configs(db, purchase_id, configs):
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE purchases SET single_configs_json = %s WHERE id = %s", (json.dumps(configs), purchase_id))
+            conn.commit()
+
+
+def run_job(db, kind, payload=None):
+    job_id = db.create_job(kind, payload)
+    job = wait_for_job(db, job_id, timeout=60, poll_interval=0.2)
+    print(f"  Задача {kind}: status={job['status']}, result={job.get('result')}, error={job.get('error')}")
+    return job
+
+
+def test_refresh_jobs():
+    print("=== Задачи обновления конфигураций на реальной схеме ===")
+    db = DatabaseManager()
+    db.create_tables()
+    db.apply_schema_upgrades()
+
+    job_queue = JobQueue(db, workers=1, poll_interval=0.2)
+    register_config_refresh_jobs(job_queue, db)
+    job_queue.start()
+
+    user_id, server_id, purchase_id, client_uuid = create_fixtures(db)
+    ok = True
+    try:
+        job = run_job(db, JOB_REFRESH_ALL)
+        configs = get_configs(db, purchase_id)
+        expected_prefix = f"vless://{client_uuid}@sub.example.com:443?"
+        if job['status'] == 'done' and job['result']['succeeded'] >= 1 and configs and configs[0].startswith(expected_prefix):
+            print(f"✅ refresh_all_configs пересобрал конфигурацию: {configs[0]}")
+        else:
+            ok = False
+            print(f"❌ refresh_all_configs: конфигурации покупки {purchase_id}: {configs}")
+
+        set_configs(db, purchase_id, [])
+        job = run_job(db, JOB_REFRESH_PURCHASE, {'purchase_id': purchase_id})
+        configs = get_configs(db, purchase_id)
+        if job['status'] == 'done' and configs and configs[0].startswith(expected_prefix):
+            print("✅ refresh_purchase_configs пересобрал конфигурацию")
+        else:
+            ok = False
+            print(f"❌ refresh_purchase_configs: конфигурации покупки {purchase_id}: {configs}")
+    finally:
+        job_queue.stop()
+        delete_fixtures(db, user_id, server_id)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if test_refresh_jobs() else 1)
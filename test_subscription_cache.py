@@ -0,0 +1,104 @@
+"""
+Проверка endpoint /sub/<sub_id> (кэш подписок, ETag) на реальной схеме базы данных.
+
+Создаёт тестовые строки (как test_config_refresh.py), сохраняет конфигурации покупки
+и запрашивает подписку через тестовый клиент Flask webhook-сервера: первый запрос
+читает покупку из базы, повторные обслуживаются из кэша. Тестовые строки удаляются в конце.
+Запуск: python test_subscription_cache.py (только на тестовой базе данных)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+
+from database.db_manager import get_db_manager
+from test_config_refresh import create_fixtures, delete_fixtures
+import webhook_server
+
+TEST_CONFIGS = ["vless://test-1@sub.example.com:443?type=tcp#one", "vless://test-2@sub.example.com:443?type=tcp#two"]
+
+
+def get_sub_id(db, purchase_id):
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT sub_id FROM purchases WHERE id = %s", (purchase_id,))
+            return cursor.fetchone()[0]
+
+
+def deactivate_purchase(db, purchase_id):
+    with db._get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE purchases SET is_active = FALSE WHERE id = %s", (purchase_id,))
+            conn.commit()
+
+
+def count_lookups(db):
+    """Считает обращения get_purchase_by_sub_id (промахи кэша) для этого процесса."""
+    calls = {'count': 0}
+    original = db.get_purchase_by_sub_id
+
+    def counted(sub_id):
+        calls['count'] += 1
+        return original(sub_id)
+
+    db.get_purchase_by_sub_id = counted
+    return calls
+
+
+def check(ok, message):
+    print(f"{'✅' if ok else '❌'} {message}")
+    return bool(ok)
+
+
+def test_subscription_endpoint():
+    print("=== Endpoint /sub/<sub_id> на реальной схеме ===")
+    db = get_db_manager()
+    db.create_tables()
+    db.apply_schema_upgrades()
+    db.get_subscription_cache().clear()
+    client = webhook_server.app.test_client()
+
+    user_id, server_id, purchase_id, _ = create_fixtures(db)
+    ok = True
+    try:
+        db.update_purchase_configs(purchase_id, json.dumps(TEST_CONFIGS))
+        sub_id = get_sub_id(db, purchase_id)
+        lookups = count_lookups(db)
+
+        response = client.get(f"/sub/{sub_id}")
+        etag = response.headers.get('ETag')
+        ok &= check(
+            response.status_code == 200 and response.get_data(as_text=True) == '\n'.join(TEST_CONFIGS) and etag,
+            f"первый запрос: {response.status_code}, ETag {etag}"
+        )
+        ok &= check(lookups['count'] == 1, f"первый запрос читает покупку из базы ({lookups['count']})")
+
+        response = client.get(f"/sub/{sub_id}")
+        ok &= check(response.status_code == 200 and lookups['count'] == 1, "повторный запрос обслужен из кэша")
+
+        response = client.get(f"/sub/{sub_id}", headers={'If-None-Match': etag})
+        ok &= check(response.status_code == 304 and lookups['count'] == 1, f"If-None-Match: {response.status_code} из кэша")
+
+        # Промах кэша при действующем ETag: ответ 304 заполняет кэш, следующий опрос не идёт в базу
+        db.get_subscription_cache().clear()
+        response = client.get(f"/sub/{sub_id}", headers={'If-None-Match': etag})
+        ok &= check(response.status_code == 304 and lookups['count'] == 2, f"If-None-Match после очистки кэша: {response.status_code}")
+        response = client.get(f"/sub/{sub_id}", headers={'If-None-Match': etag})
+        ok &= check(response.status_code == 304 and lookups['count'] == 2, "ответ 304 из базы сохранён в кэше")
+
+        response = client.get("/sub/no-such-subscription")
+        ok &= check(response.status_code == 404, f"неизвестный sub_id: {response.status_code}")
+
+        deactivate_purchase(db, purchase_id)
+        db.invalidate_subscription(purchase_id)
+        response = client.get(f"/sub/{sub_id}")
+        ok &= check(response.status_code == 404, f"отключённая покупка: {response.status_code}")
+    finally:
+        delete_fixtures(db, user_id, server_id)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if test_subscription_endpoint() else 1)
@@ -9,6 +9,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import requests
 import json
 
+import config
+
 def test_webhook_endpoint():
     """Тестирование endpoint обновления конфигураций"""
     print("=== Тестирование endpoint обновления конфигураций ===")
@@ -17,7 +19,7 @@ def test_webhook_endpoint():
     test_purchase_id = "1"
     webhook_url = f"http://localhost:8080/admin/update_configs/{test_purchase_id}"
     headers = {
-        'Authorization': 'Bearer your-secret-key'
+        'Authorization': f"Bearer {config.ADMIN_API_KEY}"
     }
     
     try:
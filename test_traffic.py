@@ -8,6 +8,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils import helpers
 from database.db_manager import DatabaseManager
+from utils.traffic_collector import TrafficCollector
 
 def test_traffic_formatting():
     """Тестирование функции преобразования объёма"""
@@ -67,6 +68,11 @@ def test_database_functions():
                 print(f"    Трафик: {traffic_info}")
             else:
                 print(f"    Трафик: Недоступен")
+
+        # Массовое получение трафика сборщиком: один запрос к панели на сервер, результат — в traffic_snapshots
+        if db.ensure_traffic_snapshots_table():
+            written = TrafficCollector(db).collect_once()
+            print(f"Сбор трафика: изменено строк снимков: {written}")
                 
     except Exception as e:
         print(f"Ошибка в тесте базы данных: {e}")
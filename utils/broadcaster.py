@@ -0,0 +1,129 @@
+# utils/broadcaster.py
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from .rate_limiter import TelegramRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Тип задачи очереди background_jobs
+JOB_BROADCAST = 'broadcast'
+
+# Получатели обрабатываются порциями; после каждой порции прогресс (курсор и счётчики) сохраняется в задаче
+BROADCAST_CHUNK_SIZE = 200
+# Не чаще одного обновления сообщения с прогрессом у администратора (в секундах)
+BROADCAST_PROGRESS_INTERVAL = 5
+# Сколько раз повторяется отправка после ответа 429 (retry_after)
+BROADCAST_MAX_RETRIES = 3
+# Рассылки выполняются в собственном потоке очереди задач (по одной), не занимая общие потоки
+BROADCAST_JOB_WORKERS = 1
+
+SENT, BLOCKED, FAILED = 'sent', 'blocked', 'failed'
+
+
+class Broadcaster:
+    """
+    Массовая рассылка как задача очереди: сообщение пересылается всем пользователям пулом потоков
+    с ограничением частоты, ответы 429 выдерживают паузу retry_after, пользователи, заблокировавшие бота,
+    помечаются в базе. Прогресс хранится в задаче, поэтому прерванная рассылка продолжается с места остановки.
+    """
+
+    def __init__(self, bot, db_manager, workers=8, rate=25):
+        self._bot = bot
+        self._db_manager = db_manager
+        self.workers = workers
+        self._limiter = TelegramRateLimiter(global_rate=rate)
+
+    def run(self, job):
+        payload = job['payload']
+        admin_id = payload['admin_id']
+        progress_message_id = payload.get('progress_message_id')
+        # При возобновлении продолжаем с сохранённого курсора
+        state = job.get('result') or {'cursor': 0, 'sent': 0, 'blocked': 0, 'failed': 0}
+        total = job.get('total') or self._db_manager.count_broadcast_recipients()
+        last_progress_at = 0.0
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="broadcast") as executor:
+            while True:
+                chat_ids = self._db_manager.get_broadcast_recipients(state['cursor'], BROADCAST_CHUNK_SIZE)
+                if not chat_ids:
+                    break
+                outcomes = list(executor.map(
+                    lambda chat_id: self._send(chat_id, payload['from_chat_id'], payload['message_id']), chat_ids
+                ))
+
+                blocked_ids = [chat_id for chat_id, outcome in zip(chat_ids, outcomes) if outcome == BLOCKED]
+                self._db_manager.mark_users_blocked(blocked_ids)
+                state['cursor'] = chat_ids[-1]
+                state['sent'] += outcomes.count(SENT)
+                state['blocked'] += len(blocked_ids)
+                state['failed'] += outcomes.count(FAILED)
+                processed = state['sent'] + state['blocked'] + state['failed']
+                self._db_manager.update_job(
+                    job['id'], processed=processed, succeeded=state['sent'],
+                    failed=state['blocked'] + state['failed'], result=state
+                )
+
+                if progress_message_id and time.monotonic() - last_progress_at >= BROADCAST_PROGRESS_INTERVAL:
+                    last_progress_at = time.monotonic()
+                    self._edit_admin_message(
+                        admin_id, progress_message_id,
+                        f"⏳ Идёт массовая рассылка: **{processed}** из **{total}**\n"
+                        f"✅ {state['sent']}   ⛔ {state['blocked']}   ❌ {state['failed']}"
+                    )
+
+        report_text = (
+            f"📣 **Итоговый отчет о массовой рассылке**\n\n"
+            f"✅ Количество успешных отправок: **{state['sent']}**\n"
+            f"⛔ Заблокировали бота: **{state['blocked']}**\n"
+            f"❌ Количество неудачных отправок: **{state['failed']}**\n"
+            f"👥 Общее количество пользователей: **{total}**"
+        )
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("🔙 Назад в меню администратора", callback_data="admin_main_menu"))
+        try:
+            self._bot.send_message(admin_id, report_text, parse_mode='Markdown', reply_markup=markup)
+        except Exception as e:
+            logger.error(f"Could not send broadcast report to admin {admin_id}: {e}")
+        logger.info(f"Broadcast {job['id']} finished: {state}")
+        return state
+
+    def _send(self, chat_id, from_chat_id, message_id):
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            self._limiter.acquire(chat_id)
+            try:
+                self._bot.forward_message(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                return SENT
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 5)
+                    logger.warning(f"Broadcast hit flood limit, pausing for {retry_after}s")
+                    self._limiter.pause(retry_after)
+                    continue
+                if e.error_code == 403 or (e.error_code == 400 and 'chat not found' in str(e.description).lower()):
+                    return BLOCKED
+                logger.error(f"Failed to send broadcast to user {chat_id}: {e}")
+                return FAILED
+            except Exception as e:
+                logger.error(f"Failed to send broadcast to user {chat_id}: {e}")
+                return FAILED
+        logger.error(f"Failed to send broadcast to user {chat_id}: flood limit retries exhausted")
+        return FAILED
+
+    def _edit_admin_message(self, admin_id, message_id, text):
+        try:
+            self._bot.edit_message_text(text, admin_id, message_id, parse_mode='Markdown')
+        except Exception as e:
+            logger.debug(f"Could not update broadcast progress message: {e}")
+
+
+def register_broadcast_jobs(job_queue, bot, db_manager, workers=8, rate=25):
+    """Регистрирует обработчик задач массовой рассылки в очереди задач."""
+    job_queue.register(
+        JOB_BROADCAST, Broadcaster(bot, db_manager, workers=workers, rate=rate).run, workers=BROADCAST_JOB_WORKERS
+    )
@@ -10,30 +10,10 @@ import json
 import base64
 import logging
 from urllib.parse import quote
-from api_client.xui_api_client import XuiAPIClient
-from api_client.alireza_api_client import AlirezaAPIClient
+from api_client.factory import get_api_client
 
 logger = logging.getLogger(__name__)
 
-def get_api_client(server_info):
-    """
-    Построение API client на основе типа панели
-    """
-    panel_type = server_info.get('panel_type', 'xui')
-    
-    if panel_type == 'alireza':
-        return AlirezaAPIClient(
-            panel_url=server_info['panel_url'],
-            username=server_info['username'],
-            password=server_info['password']
-        )
-    else:  # xui
-        return XuiAPIClient(
-            panel_url=server_info['panel_url'],
-            username=server_info['username'],
-            password=server_info['password']
-        )
-
 def detect_protocol(inbound_info):
     """
     Определение протокола из информации inbound
@@ -556,7 +536,7 @@ def build_config_from_panel(server_info, inbound_id, client_id, brand_name="Alam
         
         # Построение API client
         api_client = get_api_client(server_info)
-        if not api_client.check_login():
+        if not api_client or not api_client.check_login():
             logger.error(f"Failed to login to panel {server_info.get('name', 'Unknown')}")
             return None
         
@@ -1,12 +1,15 @@
 # utils/config_generator.py (Финальная версия с архитектурой получения из панели подписки)
 
-import json
+import math
 import logging
 import uuid
 import datetime
+import time
+import threading
 import requests
 import base64
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 
 from .helpers import generate_random_string
 from api_client.factory import get_api_client
@@ -14,6 +17,13 @@ from database.db_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
+# Сколько серверов настраивается одновременно при создании подписки
+PROVISION_MAX_WORKERS = 8
+# Предельное время создания клиентов и получения конфигураций на одном сервере (в секундах)
+PROVISION_SERVER_TIMEOUT = 45
+# Сколько секунд сверх PROVISION_SERVER_TIMEOUT покупка ждёт сервер, чей запрос к панели ещё не вернулся
+PROVISION_WAIT_GRACE = 5
+
 class ConfigGenerator:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
@@ -53,78 +63,178 @@ class ConfigGenerator:
             
         total_traffic_bytes = int(total_gb * (1024**3)) if total_gb and total_gb > 0 else 0
 
-        for server_id, inbounds_on_server in inbounds_by_server.items():
-            server_data = inbounds_on_server[0]['server']
-            api_client = get_api_client(server_data)
-            if not api_client or not api_client.check_login():
-                logger.error(f"Could not connect to server {server_data['name']}. Skipping.")
-                continue
-
-            uuids_on_this_server = []
-            for s_inbound in inbounds_on_server:
-                inbound_id = s_inbound['inbound_id']
-                client_uuid = str(uuid.uuid4())
-                
-                # Использование брендинга в имени клиента
-                brand_name = self.db_manager.get_setting('brand_name') or "Alamor"
-                client_name = f"{brand_name}-{user_telegram_id}"
-                
-                client_settings = {
-                    "id": client_uuid, 
-                    "email": f"in{inbound_id}.{base_client_email}",
-                    "flow": "",
-                    "totalGB": total_traffic_bytes, 
-                    "expiryTime": expiry_time_ms,
-                    "enable": True, 
-                    "tgId": str(user_telegram_id), 
-                    "subId": shared_sub_id,
-                    "name": client_name  # Добавление имени клиента с брендингом
-                }
-                
-                add_client_payload = {"id": inbound_id, "settings": json.dumps({"clients": [client_settings]})}
-                if api_client.add_client(add_client_payload):
-                    all_generated_uuids.append(client_uuid)
-                    uuids_on_this_server.append(client_uuid)
-                else:
-                    logger.error(f"Failed to add client to inbound {inbound_id} on server {server_id}.")
-
-            if not uuids_on_this_server:
-                logger.error(f"No clients were created on server {server_data['name']}. Skipping subscription fetch.")
-                continue
-
-            try:
-                panel_sub_url = f"{server_data['subscription_base_url'].rstrip('/')}/{server_data['subscription_path_prefix'].strip('/')}/{shared_sub_id}"
-                response = requests.get(panel_sub_url, timeout=20, verify=False)
-                response.raise_for_status()
-                
-                # --- Основное и финальное исправление здесь ---
-                decoded_content = ""
+        client_name = f"{brand_name}-{user_telegram_id}"
+        client_template = {
+            "flow": "",
+            "totalGB": total_traffic_bytes,
+            "expiryTime": expiry_time_ms,
+            "enable": True,
+            "tgId": str(user_telegram_id),
+            "subId": shared_sub_id,
+            "name": client_name  # Добавление имени клиента с брендингом
+        }
+
+        # Серверы обрабатываются параллельно: время покупки определяется самым медленным сервером, а не суммой.
+        # Дедлайн сервера проверяется только между запросами к панели, поэтому ожидание тоже ограничено:
+        # сервер, не уложившийся в срок, считается неудавшимся, и его клиенты удаляются, когда запросы вернутся
+        results = {}
+        abandoned = threading.Event()
+        max_workers = min(PROVISION_MAX_WORKERS, len(inbounds_by_server)) or 1
+        wait_timeout = PROVISION_SERVER_TIMEOUT * math.ceil(len(inbounds_by_server) / max_workers) + PROVISION_WAIT_GRACE
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provision")
+        futures = {
+            executor.submit(self._provision_server, inbounds_on_server, client_template, base_client_email, shared_sub_id, abandoned): server_id
+            for server_id, inbounds_on_server in inbounds_by_server.items()
+        }
+        try:
+            for future in as_completed(futures, timeout=wait_timeout):
+                server_id = futures[future]
                 try:
-                    # Попытка декодирования как Base64 (для панели Sanaei)
-                    decoded_content = base64.b64decode(response.content).decode('utf-8')
-                    logger.info(f"Successfully decoded Base64 subscription from server {server_data['name']}.")
-                except Exception:
-                    # Если декодирование Base64 не удалось, предполагаем, что это обычный текст (для панели Alireza)
-                    logger.info(f"Could not decode as Base64. Assuming plain text response from server {server_data['name']}.")
-                    decoded_content = response.text
-
-                all_configs_from_panel = decoded_content.strip().split('\n')
-                
-                user_configs_from_this_server = [
-                    config for config in all_configs_from_panel 
-                    if any(uuid in config for uuid in uuids_on_this_server)
-                ]
-                all_final_configs.extend(user_configs_from_this_server)
-            except Exception as e:
-                logger.error(f"Error fetching/parsing panel subscription for server {server_id}: {e}")
+                    results[server_id] = future.result()
+                except Exception as e:
+                    logger.error(f"Provisioning on server {server_id} failed: {e}", exc_info=True)
+                    results[server_id] = None
+        except FutureTimeoutError:
+            abandoned.set()
+            for future, server_id in futures.items():
+                if server_id in results:
+                    continue
+                logger.error(f"Provisioning on server {server_id} did not finish within {wait_timeout}s; its clients will be rolled back.")
+                results[server_id] = None
+                server_data = inbounds_by_server[server_id][0]['server']
+                future.add_done_callback(lambda f, server_data=server_data: self._rollback_abandoned(server_data, f))
+        finally:
+            executor.shutdown(wait=False)
+
+        failed_servers = [server_id for server_id, result in results.items() if result is None]
+        if failed_servers:
+            logger.warning(f"Provisioning failed on servers {failed_servers}; their clients were rolled back.")
+
+        for server_id in inbounds_by_server:
+            result = results.get(server_id)
+            if result:
+                configs, created = result
+                all_final_configs.extend(configs)
+                all_generated_uuids.extend(client_uuid for _, client_uuid in created)
+
+        if not all_final_configs:
+            # Покупка не будет оформлена — удаляем клиентов и на успешных серверах
+            for server_id, result in results.items():
+                if result:
+                    self._rollback_clients(inbounds_by_server[server_id][0]['server'], result[1])
 
         final_remarked_configs = []
         # Код исправлен и более точный
-        brand_name = self.db_manager.get_setting('brand_name') or "Alamor"
         final_remark_str = custom_remark if custom_remark else f"{brand_name}-{user_telegram_id}"
         for config in all_final_configs:
             base_config = config.split('#', 1)[0]
             final_remarked_configs.append(f"{base_config}#{quote(final_remark_str)}")
 
         client_details_for_db = {'uuids': all_generated_uuids, 'email': base_client_email}
-        return (final_remarked_configs, client_details_for_db) if final_remarked_configs else (None, None)
\ No newline at end of file
+        return (final_remarked_configs, client_details_for_db) if final_remarked_configs else (None, None)
+
+    def _provision_server(self, inbounds_on_server: list, client_template: dict, base_client_email: str, shared_sub_id: str, abandoned=None):
+        """
+        Создаёт клиентов на всех inbound одного сервера и получает их конфигурации из подписки панели.
+        Сервер обрабатывается как единое целое: при любой ошибке, превышении PROVISION_SERVER_TIMEOUT
+        или если покупка перестала ждать (abandoned) уже созданные на нём клиенты удаляются, и возвращается None.
+        Иначе возвращает (configs, [(inbound_id, client_uuid), ...]).
+        """
+        deadline = time.monotonic() + PROVISION_SERVER_TIMEOUT
+        server_data = inbounds_on_server[0]['server']
+        server_id = server_data['id']
+
+        api_client = get_api_client(server_data)
+        if not api_client or not api_client.check_login():
+            logger.error(f"Could not connect to server {server_data['name']}. Skipping.")
+            return None
+
+        # Группируем клиентов по inbound: каждый inbound получает один пакетный запрос addClient
+        clients_by_inbound = {}
+        for s_inbound in inbounds_on_server:
+            inbound_id = s_inbound['inbound_id']
+            inbound_clients = clients_by_inbound.setdefault(inbound_id, [])
+            email_suffix = f".{len(inbound_clients)}" if inbound_clients else ""
+            inbound_clients.append(dict(
+                client_template, id=str(uuid.uuid4()), email=f"in{inbound_id}.{base_client_email}{email_suffix}"
+            ))
+
+        created = []
+        for inbound_id, inbound_clients in clients_by_inbound.items():
+            if time.monotonic() >= deadline or (abandoned is not None and abandoned.is_set()):
+                logger.error(f"Provisioning on server {server_data['name']} timed out.")
+                self._rollback_clients(server_data, created)
+                return None
+
+            added = api_client.add_clients(inbound_id, inbound_clients)
+            created.extend((inbound_id, client['id']) for client in added)
+            if len(added) != len(inbound_clients):
+                logger.error(f"Failed to add client to inbound {inbound_id} on server {server_id}.")
+                self._rollback_clients(server_data, created)
+                return None
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error(f"Provisioning on server {server_data['name']} timed out before subscription fetch.")
+            self._rollback_clients(server_data, created)
+            return None
+
+        try:
+            panel_sub_url = f"{server_data['subscription_base_url'].rstrip('/')}/{server_data['subscription_path_prefix'].strip('/')}/{shared_sub_id}"
+            response = requests.get(panel_sub_url, timeout=min(20, remaining), verify=False)
+            response.raise_for_status()
+            
+            # --- Основное и финальное исправление здесь ---
+            decoded_content = ""
+            try:
+                # Попытка декодирования как Base64 (для панели Sanaei)
+                decoded_content = base64.b64decode(response.content).decode('utf-8')
+                logger.info(f"Successfully decoded Base64 subscription from server {server_data['name']}.")
+            except Exception:
+                # Если декодирование Base64 не удалось, предполагаем, что это обычный текст (для панели Alireza)
+                logger.info(f"Could not decode as Base64. Assuming plain text response from server {server_data['name']}.")
+                decoded_content = response.text
+
+            all_configs_from_panel = decoded_content.strip().split('\n')
+            uuids_on_this_server = [client_uuid for _, client_uuid in created]
+            user_configs_from_this_server = [
+                config for config in all_configs_from_panel 
+                if any(uuid in config for uuid in uuids_on_this_server)
+            ]
+        except Exception as e:
+            logger.error(f"Error fetching/parsing panel subscription for server {server_id}: {e}")
+            self._rollback_clients(server_data, created)
+            return None
+
+        if not user_configs_from_this_server:
+            logger.error(f"No configs for the new clients were found in the subscription of server {server_data['name']}.")
+            self._rollback_clients(server_data, created)
+            return None
+
+        return user_configs_from_this_server, created
+
+    def _rollback_abandoned(self, server_data: dict, future):
+        """Удаляет клиентов сервера, чья настройка завершилась после того, как покупка перестала её ждать."""
+        try:
+            result = future.result()
+        except Exception:
+            return
+        if result:
+            self._rollback_clients(server_data, result[1])
+
+    def _rollback_clients(self, server_data: dict, created: list):
+        """Удаляет с панели клиентов, созданных в рамках неудавшейся покупки."""
+        if not created:
+            return
+        api_client = get_api_client(server_data)
+        delete_client = getattr(api_client, 'delete_client', None)
+        if not delete_client:
+            logger.error(f"Cannot roll back {len(created)} clients on server {server_data['name']}: panel client has no delete_client.")
+            return
+        for inbound_id, client_uuid in created:
+            try:
+                if not delete_client(inbound_id, client_uuid):
+                    logger.error(f"Rollback: failed to delete client {client_uuid} from inbound {inbound_id} on server {server_data['name']}.")
+            except Exception as e:
+                logger.error(f"Rollback: error deleting client {client_uuid} on server {server_data['name']}: {e}")
+        logger.info(f"Rolled back {len(created)} clients on server {server_data['name']}.")
\ No newline at end of file
@@ -0,0 +1,221 @@
+# utils/config_refresh.py
+
+import json
+import logging
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+logger = logging.getLogger(__name__)
+
+# Массовое обновление конфигураций: сколько групп опрашивается одновременно и размер пакета записи в БД
+BULK_REFRESH_MAX_WORKERS = 8
+BULK_REFRESH_WRITE_BATCH = 500
+
+# Типы задач очереди background_jobs
+JOB_REFRESH_PURCHASE = 'refresh_purchase_configs'
+JOB_REFRESH_ALL = 'refresh_all_configs'
+
+
+# --- Вспомогательная функция для построения конфигурации ---
+def build_config_link(synced_config, client_uuid, client_remark):
+    """
+    С использованием сырых синхронизированных данных и основного адреса сервера строит финальную ссылку конфигурации.
+    """
+    try:
+        # --- Основное исправление здесь ---
+        # Читаем адрес из данных самой конфигурации, а не из антифильтр-домена
+        server_address = synced_config['subscription_base_url'].split('//')[-1].split(':')[0].split('/')[0]
+        
+        port = synced_config['port']
+        remark = f"{client_remark} - {synced_config['remark']}"
+        
+        if synced_config['protocol'] == 'vless':
+            stream_settings = json.loads(synced_config['stream_settings'])
+            protocol_settings = json.loads(synced_config['settings'])
+            
+            params = {
+                'type': stream_settings.get('network', 'tcp'),
+                'security': stream_settings.get('security', 'none')
+            }
+
+            flow = protocol_settings.get('clients', [{}])[0].get('flow', '')
+            if flow:
+                params['flow'] = flow
+
+            if params['security'] == 'tls':
+                tls_settings = stream_settings.get('tlsSettings', {})
+                nested_tls_settings = tls_settings.get('settings', {})
+                params['fp'] = nested_tls_settings.get('fingerprint', '')
+                params['sni'] = tls_settings.get('serverName', server_address)
+
+            if params['security'] == 'reality':
+                reality_settings = stream_settings.get('realitySettings', {})
+                nested_reality_settings = reality_settings.get('settings', {})
+                params['pbk'] = nested_reality_settings.get('publicKey', '')
+                params['fp'] = nested_reality_settings.get('fingerprint', '')
+                params['sni'] = reality_settings.get('serverName', server_address)
+                params['sid'] = reality_settings.get('shortId', '')
+
+            if params['type'] == 'ws':
+                ws_settings = stream_settings.get('wsSettings', {})
+                params['path'] = ws_settings.get('path', '/')
+                params['host'] = ws_settings.get('headers', {}).get('Host', server_address)
+
+            if params['type'] == 'grpc':
+                grpc_settings = stream_settings.get('grpcSettings', {})
+                params['serviceName'] = grpc_settings.get('serviceName', '')
+
+            # Построение строки параметров
+            param_str = '&'.join([f"{k}={quote(v)}" for k, v in params.items() if v])
+
+            return f"vless://{client_uuid}@{server_address}:{port}?{param_str}#{quote(remark)}"
+
+        elif synced_config['protocol'] == 'vmess':
+            # Логика для VMess
+            pass
+
+        elif synced_config['protocol'] == 'trojan':
+            # Логика для Trojan
+            pass
+
+        return None
+
+    except Exception as e:
+        logger.error(f"Error building config link: {e}")
+        return None
+
+
+class ConfigRefresher:
+    """
+    Пересобирает сохранённые конфигурации покупок по актуальным данным панелей.
+    Используется webhook-сервером и рабочими потоками очереди задач.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    def refresh_purchase(self, purchase_id):
+        """
+        Обновление кэшированных конфигураций из синхронизированных данных панели.
+        """
+        try:
+            purchase = self.db_manager.get_purchase_for_refresh(purchase_id)
+            if not purchase:
+                logger.error(f"Purchase {purchase_id} not found")
+                return False
+
+            if purchase['profile_id']:
+                updates = self._refresh_profile_group(purchase['profile_id'], [purchase])
+            else:
+                updates = self._refresh_server_group(purchase['server_id'], [purchase])
+            if not updates:
+                return False
+            _, configs_json = updates[0]
+            return self.db_manager.update_purchase_configs(purchase_id, configs_json)
+
+        except Exception as e:
+            logger.error(f"Error updating configs from panel: {e}")
+            return False
+
+    def _client_remark(self, purchase):
+        # То же имя, что ConfigGenerator даёт клиенту при покупке
+        brand_name = self.db_manager.get_setting('brand_name') or "Alamor"
+        return f"{brand_name}-{purchase['telegram_id']}"
+
+    def _build_updates(self, synced_configs, purchases):
+        updates = []
+        for purchase in purchases:
+            client_remark = self._client_remark(purchase)
+            configs = [
+                link for link in (
+                    build_config_link(synced_config, purchase['client_uuid'], client_remark)
+                    for synced_config in synced_configs
+                ) if link
+            ]
+            if configs:
+                updates.append((purchase['id'], json.dumps(configs)))
+        return updates
+
+    def _refresh_profile_group(self, profile_id, purchases):
+        """Строит конфигурации покупок одного профиля; синхронизированные inbound читаются один раз на профиль."""
+        return self._build_updates(self.db_manager.get_synced_configs_for_refresh(profile_id=profile_id), purchases)
+
+    def _refresh_server_group(self, server_id, purchases):
+        """Строит конфигурации обычных покупок одного сервера по его активным синхронизированным inbound (один запрос на сервер)."""
+        return self._build_updates(self.db_manager.get_synced_configs_for_refresh(server_id=server_id), purchases)
+
+    def refresh_purchases(self, purchases, job_id=None):
+        """
+        Обновляет конфигурации всех переданных покупок.
+        Покупки группируются по профилю и серверу: данные каждой группы запрашиваются один раз,
+        группы обрабатываются параллельно, результаты записываются в БД пакетами.
+        purchases может быть любым итерируемым со строками db_manager.iter_active_purchases_for_refresh()
+        (id, server_id, profile_id, client_uuid, telegram_id): от каждой сохраняются только поля для построения ссылок.
+        Если передан job_id, прогресс записывается в задачу. Возвращает {'total', 'succeeded', 'failed'}.
+        """
+        groups = {}
+        total = 0
+        for purchase in purchases:
+            total += 1
+            if purchase['profile_id']:
+                key = ('profile', purchase['profile_id'])
+            elif purchase['server_id']:
+                key = ('server', purchase['server_id'])
+            else:
+                continue
+            groups.setdefault(key, []).append({
+                'id': purchase['id'],
+                'client_uuid': purchase['client_uuid'],
+                'telegram_id': purchase['telegram_id'],
+            })
+
+        processed = succeeded = 0
+        pending_updates = []
+        if job_id:
+            self.db_manager.update_job(job_id, total=total)
+        with ThreadPoolExecutor(max_workers=BULK_REFRESH_MAX_WORKERS, thread_name_prefix="bulk-refresh") as executor:
+            futures = {
+                executor.submit(
+                    self._refresh_profile_group if kind == 'profile' else self._refresh_server_group, group_id, group
+                ): (kind, group_id, len(group))
+                for (kind, group_id), group in groups.items()
+            }
+            for future in as_completed(futures):
+                kind, group_id, group_size = futures[future]
+                try:
+                    pending_updates.extend(future.result())
+                except Exception as e:
+                    logger.error(f"Bulk refresh of {kind} {group_id} failed: {e}")
+                processed += group_size
+
+                if len(pending_updates) >= BULK_REFRESH_WRITE_BATCH:
+                    succeeded += self.db_manager.update_purchase_configs_bulk(pending_updates)
+                    pending_updates = []
+                if job_id:
+                    self.db_manager.update_job(
+                        job_id, processed=processed, succeeded=succeeded, failed=processed - succeeded - len(pending_updates)
+                    )
+
+        succeeded += self.db_manager.update_purchase_configs_bulk(pending_updates)
+        if job_id:
+            self.db_manager.update_job(job_id, processed=total, succeeded=succeeded, failed=total - succeeded)
+        logger.info(f"Bulk config refresh: updated {succeeded}/{total} purchases")
+        return {'total': total, 'succeeded': succeeded, 'failed': total - succeeded}
+
+
+def register_config_refresh_jobs(job_queue, db_manager):
+    """Регистрирует обработчики задач обновления конфигураций в очереди задач."""
+    refresher = ConfigRefresher(db_manager)
+
+    def refresh_purchase_job(job):
+        purchase_id = int(job['payload']['purchase_id'])
+        if not refresher.refresh_purchase(purchase_id):
+            raise RuntimeError(f"Could not refresh configs of purchase {purchase_id}")
+        return {'purchase_id': purchase_id}
+
+    def refresh_all_job(job):
+        return refresher.refresh_purchases(db_manager.iter_active_purchases_for_refresh(), job_id=job['id'])
+
+    job_queue.register(JOB_REFRESH_PURCHASE, refresh_purchase_job)
+    job_queue.register(JOB_REFRESH_ALL, refresh_all_job)
@@ -5,42 +5,43 @@ import logging
 import random
 import string
 import re
+import functools
 # --- Новые импорты добавлены здесь ---
 from urllib.parse import urlparse, parse_qs
-from database.db_manager import DatabaseManager
+from database.db_manager import get_db_manager
+from utils.message_templates import MessageTemplateStore
 import utils.messages as messages_module
 
-from config import ADMIN_IDS
-from collections import UserDict
+import config
 
 logger = logging.getLogger(__name__)
-_db_for_messages = DatabaseManager()
 
-class _SafeFormatDict(UserDict):
-    def __missing__(self, key):
-        # Leave unknown placeholders intact like {unknown}
-        return '{' + key + '}'
+@functools.lru_cache(maxsize=None)
+def get_message_store() -> MessageTemplateStore:
+    """Шаблоны из bot_messages хранятся в памяти и перечитываются только после update_bot_message."""
+    return MessageTemplateStore(get_db_manager())
 
 def get_message(key: str, **kwargs):
     """Fetches a message template by key (DB overrides > defaults) and safely formats it.
 
     Unknown placeholders remain unchanged instead of breaking formatting.
     If the DB template is invalid, falls back to the default messages.py template.
+    Templates come from the in-memory message store, so rendering does not touch the DB.
     """
-    db_template = _db_for_messages.get_message_by_key(key)
-    default_template = getattr(messages_module, key, f"MSG_NOT_FOUND: {key}")
-
-    template = db_template if db_template is not None else default_template
+    message_store = get_message_store()
+    default_source = getattr(messages_module, key, f"MSG_NOT_FOUND: {key}")
+    default_template = message_store.get_default(key, default_source)
+    template = message_store.get(key) or default_template
 
     try:
-        return template.format_map(_SafeFormatDict(kwargs))
+        return template.render(kwargs)
     except Exception:
         # Fallback to default template if DB template is malformed
         try:
-            return default_template.format_map(_SafeFormatDict(kwargs))
+            return default_template.render(kwargs)
         except Exception:
             # As a last resort, return unformatted template to avoid crashes
-            return default_template
+            return default_source
 
 # --- Новая функция добавлена здесь ---
 def parse_config_link(link: str) -> dict or None:
@@ -75,7 +76,7 @@ def parse_config_link(link: str) -> dict or None:
 
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором."""
-    return user_id in ADMIN_IDS
+    return user_id in config.ADMIN_IDS
 
 def is_user_member_of_channel(bot: telebot.TeleBot, channel_id: int, user_id: int) -> bool:
     """
@@ -0,0 +1,110 @@
+# utils/job_queue.py
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Задачи в статусе running, не обновлявшиеся столько секунд (процесс упал посреди выполнения),
+# возвращаются в очередь при запуске; длительные задачи обновляют прогресс гораздо чаще
+STALE_JOB_SECONDS = 600
+
+
+class JobQueue:
+    """
+    Рабочие потоки очереди задач, хранящейся в таблице background_jobs.
+    Задачу может поставить любой процесс (бот или webhook-сервер) через db_manager.create_job;
+    потоки забирают задачи известных им типов и записывают результат или ошибку в ту же строку.
+    Типы, зарегистрированные с workers=N, выполняются отдельными N потоками и не занимают общие:
+    так многочасовые задачи (рассылки) не задерживают короткие (обновление конфигураций).
+    """
+
+    def __init__(self, db_manager, workers=2, poll_interval=1.0):
+        self._db_manager = db_manager
+        self.workers = workers
+        self.poll_interval = poll_interval
+        # {kind: handler(job) -> result}
+        self._handlers = {}
+        # {kind: число отдельных потоков} для типов, не использующих общие потоки
+        self._dedicated_workers = {}
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def register(self, kind, handler, workers=None):
+        """workers — число отдельных потоков для задач этого типа (None — общие потоки очереди)."""
+        self._handlers[kind] = handler
+        if workers:
+            self._dedicated_workers[kind] = workers
+        else:
+            self._dedicated_workers.pop(kind, None)
+
+    def start(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        if not self._handlers:
+            logger.warning("Job queue not started: no job handlers registered.")
+            return
+        requeued = self._db_manager.requeue_stale_jobs(STALE_JOB_SECONDS)
+        if requeued:
+            logger.warning(f"Requeued {requeued} stale background jobs.")
+        self._stop_event.clear()
+        shared_kinds = [kind for kind in self._handlers if kind not in self._dedicated_workers]
+        self._threads = []
+        if shared_kinds:
+            self._threads += [
+                threading.Thread(target=self._run, args=(shared_kinds,), name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+        for kind, workers in self._dedicated_workers.items():
+            self._threads += [
+                threading.Thread(target=self._run, args=([kind],), name=f"job-worker-{kind}-{i}", daemon=True)
+                for i in range(workers)
+            ]
+        for thread in self._threads:
+            thread.start()
+        dedicated = ''.join(f", {kind}: {workers} own" for kind, workers in self._dedicated_workers.items())
+        logger.info(f"Job queue started ({self.workers} shared workers for {', '.join(shared_kinds) or '-'}{dedicated}).")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, kinds):
+        while not self._stop_event.is_set():
+            job = self._db_manager.claim_next_job(kinds)
+            if job is None:
+                self._stop_event.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        handler = self._handlers[job['kind']]
+        logger.info(f"Running job {job['id']} ({job['kind']})")
+        try:
+            result = handler(job)
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}", exc_info=True)
+            self._db_manager.update_job(job['id'], status='failed', error=str(e))
+            return
+        self._db_manager.update_job(job['id'], status='done', result=result)
+
+
+def wait_for_job(db_manager, job_id, timeout, on_progress=None, poll_interval=1.0):
+    """
+    Ждёт завершения задачи не дольше timeout секунд и возвращает её последнее состояние
+    (status 'done'/'failed', либо 'queued'/'running' при истечении времени).
+    on_progress(job) вызывается при каждом изменении счётчика processed.
+    """
+    deadline = time.monotonic() + timeout
+    last_processed = None
+    job = db_manager.get_job(job_id)
+    while job and job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+        if on_progress and job['processed'] != last_processed:
+            last_processed = job['processed']
+            try:
+                on_progress(job)
+            except Exception as e:
+                logger.warning(f"Progress callback for job {job_id} failed: {e}")
+        time.sleep(poll_interval)
+        job = db_manager.get_job(job_id) or job
+    return job
@@ -0,0 +1,148 @@
+# utils/message_templates.py
+
+import time
+import logging
+import threading
+from string import Formatter
+from collections import UserDict
+
+from database.settings_cache import MESSAGES_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+_formatter = Formatter()
+
+# Повтор неудавшейся загрузки шаблонов: задержка удваивается от минимальной до максимальной (в секундах)
+LOAD_RETRY_MIN_DELAY = 1.0
+LOAD_RETRY_MAX_DELAY = 60.0
+
+
+class _SafeFormatDict(UserDict):
+    def __missing__(self, key):
+        # Leave unknown placeholders intact like {unknown}
+        return '{' + key + '}'
+
+
+class CompiledTemplate:
+    """
+    Шаблон сообщения, разобранный один раз при загрузке.
+    render() даёт тот же результат, что и template.format_map(_SafeFormatDict(kwargs)),
+    но без повторного разбора строки при каждом вызове.
+    """
+    __slots__ = ('source', '_segments', '_error', '_simple')
+
+    def __init__(self, source: str):
+        self.source = source
+        self._error = None
+        self._segments = None
+        self._simple = True
+        try:
+            self._segments = list(_formatter.parse(source))
+        except ValueError as e:
+            self._error = e
+            return
+        for _, field, spec, _ in self._segments:
+            # Позиционные поля, атрибуты, индексы и вложенные спецификации обрабатываем стандартным путём
+            if field is not None and (not field.isidentifier() or '{' in (spec or '')):
+                self._simple = False
+                break
+
+    def render(self, values: dict) -> str:
+        if self._error is not None:
+            raise self._error
+        if not self._simple:
+            return self.source.format_map(_SafeFormatDict(values))
+
+        parts = []
+        for literal, field, spec, conversion in self._segments:
+            if literal:
+                parts.append(literal)
+            if field is None:
+                continue
+            value = values[field] if field in values else '{' + field + '}'
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            parts.append(format(value, spec))
+        return ''.join(parts)
+
+
+class MessageTemplateStore:
+    """
+    Хранилище шаблонов из таблицы bot_messages в памяти процесса.
+    Таблица загружается целиком; перезагрузка происходит, когда меняется версия
+    сообщений (её повышает DatabaseManager.update_bot_message).
+    Если загрузка не удалась, используются прежние шаблоны (или значения по умолчанию из messages.py),
+    а загрузка повторяется с нарастающей задержкой.
+    """
+
+    def __init__(self, db_manager):
+        self._db_manager = db_manager
+        self._templates = None
+        self._version = None
+        self._defaults = {}
+        self._lock = threading.Lock()
+        # Время (time.monotonic) следующей попытки после неудачной загрузки; None — загрузка удалась
+        self._retry_at = None
+        self._retry_delay = LOAD_RETRY_MIN_DELAY
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.load_failures = 0
+
+    def load(self):
+        """Загружает все шаблоны из базы данных и компилирует их."""
+        version = self._db_manager.get_setting(MESSAGES_VERSION_KEY)
+        rows = self._db_manager.iter_bot_messages()
+        templates = {row['message_key']: CompiledTemplate(row['message_text']) for row in rows if row['message_text'] is not None}
+        with self._lock:
+            self._templates = templates
+            self._version = version
+            self._retry_at = None
+            self._retry_delay = LOAD_RETRY_MIN_DELAY
+            self.reloads += 1
+        logger.info(f"Loaded {len(templates)} message templates into memory (version {version}).")
+
+    def _ensure_fresh(self):
+        if self._retry_at is not None:
+            if time.monotonic() < self._retry_at:
+                return
+        elif self._templates is not None and self._db_manager.get_setting(MESSAGES_VERSION_KEY) == self._version:
+            return
+        try:
+            self.load()
+        except Exception as e:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = {}
+                delay = self._retry_delay
+                self._retry_at = time.monotonic() + delay
+                self._retry_delay = min(delay * 2, LOAD_RETRY_MAX_DELAY)
+                self.load_failures += 1
+            logger.error(f"Could not load message templates from database: {e}. Retrying in {delay:g}s.")
+
+    def get(self, key: str):
+        """Возвращает скомпилированный шаблон из базы данных или None."""
+        self._ensure_fresh()
+        template = self._templates.get(key)
+        if template is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return template
+
+    def get_default(self, key: str, source: str):
+        """Компилирует шаблон по умолчанию из messages.py один раз и кэширует его."""
+        template = self._defaults.get(key)
+        if template is None or template.source != source:
+            template = CompiledTemplate(source)
+            self._defaults[key] = template
+        return template
+
+    def stats(self) -> dict:
+        return {
+            'templates': len(self._templates or {}),
+            'version': self._version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'load_failures': self.load_failures,
+        }
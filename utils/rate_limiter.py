@@ -0,0 +1,79 @@
+# utils/rate_limiter.py
+
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: в среднем rate операций в секунду, всплески до capacity.
+    pause(seconds) останавливает выдачу токенов (ответ 429 с retry_after от Telegram).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """Блокирует поток до получения токена."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._updated_at = self._paused_until
+
+
+class TelegramRateLimiter:
+    """
+    Ограничение частоты отправки сообщений ботом: общий лимит (около 30 сообщений в секунду на бота)
+    и не чаще одного сообщения в per_chat_interval секунд в один чат.
+    """
+
+    def __init__(self, global_rate=25, per_chat_interval=1.0):
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        # {chat_id: время последней отправки}
+        self._last_sent = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._last_sent.get(chat_id, 0.0) + self.per_chat_interval - now
+                if wait <= 0:
+                    self._last_sent[chat_id] = now
+                    if len(self._last_sent) > 10000:
+                        self._forget_idle_chats(now)
+                    break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+    def _forget_idle_chats(self, now):
+        cutoff = now - self.per_chat_interval
+        self._last_sent = {chat_id: sent_at for chat_id, sent_at in self._last_sent.items() if sent_at > cutoff}
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
@@ -0,0 +1,42 @@
+# utils/single_flight.py
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в одно выполнение.
+    Функция выполняется в фоновом пуле потоков, а вызывающие ждут результат не дольше timeout;
+    при превышении ожидания выполнение продолжается в фоне, и его результат
+    пригодится следующим запросам.
+    """
+
+    def __init__(self, max_workers=4, thread_name_prefix="single-flight"):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _run(self, key, fn):
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    def do(self, key, fn, timeout=None):
+        """
+        Выполняет fn() (или присоединяется к уже идущему выполнению с тем же ключом).
+        Бросает concurrent.futures.TimeoutError, если результат не получен за timeout секунд.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor.submit(self._run, key, fn)
+                self._futures[key] = future
+            else:
+                logger.debug(f"Joining in-flight call for key {key}")
+        return future.result(timeout)
@@ -0,0 +1,306 @@
+# utils/state_store.py
+
+import json
+import time
+import base64
+import decimal
+import logging
+import datetime
+import threading
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+# --- Сериализация состояний (JSON с сохранением типов Decimal/datetime и нестроковых ключей) ---
+def _encode(value):
+    # Строки БД (psycopg2 DictRow) сохраняются как обычные dict
+    if isinstance(value, Mapping) or (hasattr(value, 'keys') and hasattr(value, 'items')):
+        if all(isinstance(k, str) for k in value):
+            return {k: _encode(v) for k, v in value.items()}
+        return {'__items__': [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_encode(v) for v in value]
+    if isinstance(value, decimal.Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            tag, payload = next(iter(value.items()))
+            if tag == '__items__':
+                return {_decode(k): _decode(v) for k, v in payload}
+            if tag == '__decimal__':
+                return decimal.Decimal(payload)
+            if tag == '__datetime__':
+                return datetime.datetime.fromisoformat(payload)
+            if tag == '__date__':
+                return datetime.date.fromisoformat(payload)
+            if tag == '__bytes__':
+                return base64.b64decode(payload)
+        return {k: _decode(v) for k, v in value.items()}
+    return value
+
+
+def dumps_state(value) -> str:
+    return json.dumps(_encode(value), ensure_ascii=False, sort_keys=True)
+
+
+def loads_state(data: str):
+    return _decode(json.loads(data))
+
+
+class StateStore(MutableMapping):
+    """
+    Хранилище состояний диалогов ({telegram_id: {'state': ..., 'data': {...}}}) с интерфейсом dict.
+    Кроме обычных операций dict предоставляет атомарные get_with_version/compare_and_set;
+    записи, не обновлявшиеся ttl секунд (брошенные диалоги), считаются отсутствующими.
+    """
+
+    def __init__(self, namespace, ttl=None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def bind(self, db_manager):
+        """Подключает хранилище к базе данных (для бэкендов, которым она нужна)."""
+
+    def flush(self):
+        """Сохраняет изменения, сделанные в значениях на месте (state_info['data'][...] = ...)."""
+
+    def get_with_version(self, key):
+        """Возвращает (value, version) или (None, None), если записи нет."""
+        raise NotImplementedError
+
+    def compare_and_set(self, key, value, expected_version):
+        """
+        Записывает value, только если текущая версия записи равна expected_version
+        (None — записи ещё нет). Возвращает True при успехе.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class MemoryStateStore(StateStore):
+    """Состояния в памяти процесса (поведение прежних словарей модулей), с TTL."""
+
+    def __init__(self, namespace, ttl=None):
+        super().__init__(namespace, ttl)
+        # {key: (value, version, expires_at)}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def _expires_at(self):
+        return time.monotonic() + self.ttl if self.ttl else None
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                raise KeyError(key)
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            entry = self._live_entry(key)
+            version = entry[1] + 1 if entry else 1
+            self._entries[key] = (value, version, self._expires_at())
+            if len(self._entries) % 1000 == 0:
+                self.purge_expired()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if self._live_entry(key) is None:
+                raise KeyError(key)
+            del self._entries[key]
+
+    def __iter__(self):
+        with self._lock:
+            self.purge_expired()
+            return iter(list(self._entries))
+
+    def __len__(self):
+        with self._lock:
+            self.purge_expired()
+            return len(self._entries)
+
+    def get_with_version(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return (entry[0], entry[1]) if entry else (None, None)
+
+    def compare_and_set(self, key, value, expected_version):
+        with self._lock:
+            entry = self._live_entry(key)
+            current_version = entry[1] if entry else None
+            if current_version != expected_version:
+                return False
+            self._entries[key] = (value, (current_version or 0) + 1, self._expires_at())
+            return True
+
+    def purge_expired(self):
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k, (_, _, expires_at) in self._entries.items() if expires_at is not None and expires_at <= now]:
+                del self._entries[key]
+
+
+class DatabaseStateStore(StateStore):
+    """
+    Состояния в таблице conversation_states: общие для всех процессов бота и переживают перезапуск.
+    Внутри обработки обновления (update_scope) прочитанные значения кэшируются в потоке,
+    и изменения на месте сохраняются при выходе из обработки через compare_and_set.
+    Вне update_scope каждое обращение идёт напрямую в базу.
+    """
+
+    def __init__(self, namespace, ttl=None):
+        super().__init__(namespace, ttl)
+        self._db_manager = None
+        self._local = threading.local()
+
+    def bind(self, db_manager):
+        self._db_manager = db_manager
+
+    def _db(self):
+        if self._db_manager is None:
+            raise RuntimeError(f"State store '{self.namespace}' is not bound to a database")
+        return self._db_manager
+
+    def _scope(self):
+        # {key: [value, version, serialized_at_load]} или None вне update_scope
+        return getattr(self._local, 'cache', None)
+
+    def _begin(self):
+        self._local.cache = {}
+
+    def _load(self, key):
+        row = self._db().get_conversation_state(self.namespace, str(key))
+        if row is None:
+            return None, None, None
+        data, version = row
+        return loads_state(data), version, data
+
+    def __getitem__(self, key):
+        cache = self._scope()
+        if cache is not None and key in cache:
+            value = cache[key][0]
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        value, version, data = self._load(key)
+        if cache is not None:
+            cache[key] = [value if version is not None else _MISSING, version, data]
+        if version is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        cache = self._scope()
+        if cache is not None:
+            if key not in cache:
+                _, version, data = self._load(key)
+                cache[key] = [_MISSING, version, data]
+            cache[key][0] = value
+            return
+        self._db().set_conversation_state(self.namespace, str(key), dumps_state(value), self.ttl)
+
+    def __delitem__(self, key):
+        cache = self._scope()
+        if cache is not None and key in cache:
+            if cache[key][0] is _MISSING:
+                raise KeyError(key)
+            cache[key] = [_MISSING, None, None]
+        if not self._db().delete_conversation_state(self.namespace, str(key)) and cache is None:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        # Ключи хранятся строками; ID пользователей возвращаются как int, как в прежних словарях
+        keys = self._db().get_conversation_state_keys(self.namespace)
+        return iter(int(key) if key.lstrip('-').isdigit() else key for key in keys)
+
+    def __len__(self):
+        return len(self._db().get_conversation_state_keys(self.namespace))
+
+    def get_with_version(self, key):
+        row = self._db().get_conversation_state(self.namespace, str(key))
+        if row is None:
+            return None, None
+        return loads_state(row[0]), row[1]
+
+    def compare_and_set(self, key, value, expected_version):
+        return self._db().compare_and_set_conversation_state(
+            self.namespace, str(key), dumps_state(value), expected_version, self.ttl
+        )
+
+    def flush(self):
+        cache = self._scope()
+        self._local.cache = None
+        if not cache:
+            return
+        for key, (value, version, loaded_data) in cache.items():
+            if value is _MISSING:
+                continue
+            data = dumps_state(value)
+            if data == loaded_data:
+                continue
+            if not self._db().compare_and_set_conversation_state(self.namespace, str(key), data, version, self.ttl):
+                logger.warning(f"State '{self.namespace}:{key}' was changed concurrently; keeping the newer version.")
+
+
+_stores = []
+
+
+def create_state_store(namespace, backend, ttl=None):
+    """Создаёт хранилище состояний: backend 'memory' (в процессе) или 'database' (общее для процессов)."""
+    if backend == 'database':
+        store = DatabaseStateStore(namespace, ttl)
+    elif backend == 'memory':
+        store = MemoryStateStore(namespace, ttl)
+    else:
+        raise ValueError(f"Unknown state store backend: {backend}")
+    _stores.append(store)
+    return store
+
+
+@contextmanager
+def update_scope():
+    """Обработка одного обновления: изменения состояний сохраняются по её завершении."""
+    db_stores = [store for store in _stores if isinstance(store, DatabaseStateStore)]
+    for store in db_stores:
+        store._begin()
+    try:
+        yield
+    finally:
+        for store in db_stores:
+            try:
+                store.flush()
+            except Exception as e:
+                logger.error(f"Could not save conversation states '{store.namespace}': {e}")
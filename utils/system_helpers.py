@@ -3,6 +3,8 @@ import subprocess
 import logging
 import os
 
+import config
+
 logger = logging.getLogger(__name__)
 
 def run_shell_command(command):
@@ -59,6 +61,7 @@ server {{
         # Шаг 3: Создание финальной конфигурации Nginx для Proxy Pass
         # Certbot сам обновляет конфигурацию, нам нужно только убедиться, что Proxy Pass добавлен
         # Для простоты мы переписываем конфигурацию, чтобы убедиться, что она правильная
+        # Путь и адрес webhook бота берутся из настроек, как и в bot_webhook.py
         final_nginx_config = f"""
 server {{
     listen 80;
@@ -74,6 +77,15 @@ server {{
     include /etc/letsencrypt/options-ssl-nginx.conf;
     ssl_dhparam /etc/letsencrypt/ssl-dhparams.pem;
 
+    # Обновления Telegram для бота в режиме BOT_UPDATE_MODE=webhook
+    location = {config.TELEGRAM_WEBHOOK_PATH} {{
+        proxy_pass http://{config.TELEGRAM_WEBHOOK_LISTEN};
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }}
+
     location / {{
         proxy_pass http://127.0.0.1:8080;
         proxy_set_header Host $host;
@@ -0,0 +1,162 @@
+# utils/traffic_collector.py
+
+import time
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from api_client.factory import get_api_client
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Сколько серверов опрашивается одновременно
+COLLECTOR_MAX_WORKERS = 4
+# Сколько секунд обработчик ждёт внеочередного сбора трафика сервера
+SERVER_REFRESH_TIMEOUT = 15
+
+
+def _group_by_server(purchases):
+    """{server_id: [{'id', 'client_uuid', 'client_email'}]} для покупок с клиентом на сервере."""
+    purchases_by_server = {}
+    for purchase in purchases:
+        if purchase.get('client_uuid') and purchase.get('server_id'):
+            purchases_by_server.setdefault(purchase['server_id'], []).append({
+                'id': purchase['id'], 'client_uuid': purchase['client_uuid'], 'client_email': purchase.get('client_email'),
+            })
+    return purchases_by_server
+
+
+class TrafficCollector:
+    """
+    Фоновый сборщик трафика и сроков действия всех активных покупок.
+    Раз в interval секунд выполняет по одному запросу list_inbounds на сервер
+    и записывает в таблицу traffic_snapshots только изменившиеся строки.
+    """
+
+    def __init__(self, db_manager, interval=300):
+        self._db_manager = db_manager
+        self.interval = interval
+        # Последние записанные значения: {server_id: {purchase_id: row}}; позволяет не отправлять в базу
+        # неизменённые строки. Карта сервера пересобирается при каждом опросе из его текущих покупок
+        self._last_rows = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        if not self._db_manager.ensure_traffic_snapshots_table():
+            logger.error("Traffic collector not started: snapshot tables are unavailable.")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="traffic-collector", daemon=True)
+        self._thread.start()
+        logger.info(f"Traffic collector started (interval {self.interval}s).")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.collect_once()
+            except Exception as e:
+                logger.error(f"Traffic collection cycle failed: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+
+    def collect_once(self):
+        """Один цикл сбора: группирует активные покупки по серверам и опрашивает серверы параллельно."""
+        purchases_by_server = _group_by_server(self._db_manager.iter_active_purchases())
+        # Серверы без активных покупок (или удалённые) больше не хранят последние значения
+        for server_id in set(self._last_rows) - set(purchases_by_server):
+            self._last_rows.pop(server_id, None)
+        if not purchases_by_server:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=COLLECTOR_MAX_WORKERS) as executor:
+            written = sum(executor.map(lambda item: self._collect_server(*item) or 0, purchases_by_server.items()))
+        logger.info(f"Traffic collection finished: {len(purchases_by_server)} servers, {written} rows changed.")
+        return written
+
+    def collect_server(self, server_id):
+        """
+        Внеочередной сбор трафика одного сервера. Возвращает True, если данные сервера получены
+        (снимки и synced_at обновлены), иначе False.
+        """
+        purchases = _group_by_server(self._db_manager.get_active_purchases_by_server(server_id)).get(server_id)
+        if not purchases:
+            return False
+        return self._collect_server(server_id, purchases) is not None
+
+    def _collect_server(self, server_id, purchases):
+        """Опрашивает сервер; возвращает число записанных строк или None, если данные не получены."""
+        try:
+            server = self._db_manager.get_server_by_id(server_id)
+            api_client = get_api_client(server) if server else None
+            if not api_client:
+                logger.warning(f"Traffic collector: no API client for server {server_id}")
+                return None
+            traffic_map = api_client.get_all_client_traffics()
+            if not traffic_map:
+                logger.warning(f"Traffic collector: no traffic data from server {server_id}")
+                return None
+
+            last_rows = self._last_rows.get(server_id, {})
+            rows = {}
+            for purchase in purchases:
+                stats = traffic_map.get(purchase['client_uuid']) or traffic_map.get(purchase.get('client_email'))
+                if not stats:
+                    continue
+                rows[purchase['id']] = (
+                    purchase['id'], server_id, purchase['client_uuid'],
+                    stats['up'], stats['down'], stats['total'], stats['expiryTime'], bool(stats['enable']),
+                )
+            changed = [row for purchase_id, row in rows.items() if last_rows.get(purchase_id) != row]
+
+            written = self._db_manager.upsert_traffic_snapshots(changed)
+            if written is None:
+                # Запись не прошла: эти строки будут отправлены повторно в следующем цикле
+                return None
+            # Только текущие покупки сервера: удалённые и истёкшие не остаются в памяти
+            self._last_rows[server_id] = rows
+            self._db_manager.mark_traffic_synced(server_id)
+            return written
+        except Exception as e:
+            logger.error(f"Traffic collector: error collecting server {server_id}: {e}")
+            return None
+
+
+class ServerTrafficRefresher:
+    """
+    Внеочередной сбор трафика сервера по запросу пользователя (кнопка «Обновить трафик»).
+    Сервер опрашивается не чаще min_interval секунд: учитывается как время последнего успешного
+    сбора в базе (общее для процессов), так и последняя попытка в этом процессе (если панель недоступна).
+    Одновременные запросы к одному серверу объединяются в один опрос.
+    """
+
+    def __init__(self, db_manager, min_interval=60):
+        self._collector = TrafficCollector(db_manager)
+        self._db_manager = db_manager
+        self.min_interval = min_interval
+        self._last_attempts = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight(max_workers=2, thread_name_prefix="traffic-refresh")
+
+    def refresh(self, server_id, timeout=SERVER_REFRESH_TIMEOUT):
+        """Возвращает True, если данные сервера только что получены из панели, False — если опрос пропущен или не удался."""
+        synced_at = self._db_manager.get_traffic_synced_at(server_id)
+        if synced_at is not None and (datetime.datetime.now(datetime.timezone.utc) - synced_at).total_seconds() < self.min_interval:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last_attempt = self._last_attempts.get(server_id)
+            if last_attempt is not None and now - last_attempt < self.min_interval:
+                return False
+            self._last_attempts[server_id] = now
+        try:
+            return self._flight.do(server_id, lambda: self._collector.collect_server(server_id), timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Traffic refresh for server {server_id} is still running after {timeout}s.")
+            return False
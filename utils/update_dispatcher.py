@@ -0,0 +1,144 @@
+# utils/update_dispatcher.py
+
+import time
+import logging
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import config
+from utils.state_store import update_scope
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних измерений времени ожидания учитывается в метриках
+WAIT_SAMPLES = 1000
+
+# Типы обновлений, у которых есть отправитель (from_user)
+_USER_UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+
+def update_user_id(update):
+    """ID пользователя, от которого пришло обновление, или None (например, для постов каналов)."""
+    for field in _USER_UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        user = getattr(obj, 'from_user', None) if obj is not None else None
+        if user is not None:
+            return user.id
+    poll_answer = getattr(update, 'poll_answer', None)
+    if poll_answer is not None and getattr(poll_answer, 'user', None) is not None:
+        return poll_answer.user.id
+    return None
+
+
+class OrderedUpdateDispatcher:
+    """
+    Выполняет обработку обновлений в пуле потоков: обновления одного пользователя обрабатываются
+    строго по очереди (переходы _user_states/_admin_states не перемешиваются), разные пользователи — параллельно.
+    Медленный обработчик задерживает только своего пользователя, а не всех.
+    Порядок гарантируется только внутри одного процесса: если обновления принимают несколько процессов
+    (bot_webhook за nginx), обновления одного пользователя могут обрабатываться в разных процессах
+    одновременно. Тогда из двух изменений его состояния сохраняется первое (compare_and_set
+    в DatabaseStateStore), второе отбрасывается с предупреждением в журнале.
+    """
+
+    def __init__(self, process, workers=8):
+        self._process = process
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="update-worker")
+        # {ключ пользователя: deque[(update, enqueued_at)]}; ключ присутствует, пока его очередь обрабатывается
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.processed = 0
+        self.failed = 0
+
+    def submit(self, key, update):
+        # Обновления без пользователя ни с чем не упорядочиваются
+        if key is None:
+            key = ('update', id(update))
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((update, time.monotonic()))
+                return
+            self._queues[key] = deque([(update, time.monotonic())])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                update, enqueued_at = queue.popleft()
+                self._waits.append(time.monotonic() - enqueued_at)
+            try:
+                self._process(update)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Unhandled error while processing update for {key}: {e}", exc_info=True)
+            else:
+                with self._lock:
+                    self.processed += 1
+
+    def stats(self) -> dict:
+        """Метрики очереди: ожидающие обновления, пользователи в обработке и время ожидания в очереди."""
+        with self._lock:
+            depths = [len(queue) for queue in self._queues.values()]
+            waits = list(self._waits)
+            processed, failed = self.processed, self.failed
+        return {
+            'queued': sum(depths),
+            'active_users': len(depths),
+            'max_user_queue': max(depths, default=0),
+            'workers': self.workers,
+            'processed': processed,
+            'failed': failed,
+            'wait_avg_ms': round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            'wait_max_ms': round(max(waits) * 1000, 1) if waits else 0.0,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class OrderedTeleBot(telebot.TeleBot):
+    """
+    TeleBot, передающий обновления OrderedUpdateDispatcher вместо общего пула потоков telebot.
+    Работает одинаково при polling и при приёме через webhook (process_new_updates).
+    """
+
+    def __init__(self, token, workers=8, **kwargs):
+        # Обработчики выполняются синхронно внутри потоков диспетчера
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = OrderedUpdateDispatcher(self._process_update, workers=workers)
+
+    def _process_update(self, update):
+        # Состояния диалогов, прочитанные и изменённые обработчиками, сохраняются по завершении обновления
+        with update_scope():
+            super().process_new_updates([update])
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Смещение для getUpdates сдвигается сразу, не дожидаясь обработки
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update_user_id(update), update)
+
+
+@functools.lru_cache(maxsize=None)
+def get_bot() -> OrderedTeleBot:
+    """
+    Общий бот процесса, создаётся при первом обращении. Обработчики выполняются в пуле
+    из BOT_WORKER_THREADS потоков (и при polling, и при webhook).
+    """
+    return OrderedTeleBot(config.BOT_TOKEN, workers=config.BOT_WORKER_THREADS)
@@ -8,8 +8,10 @@ import os
 import sys
 import datetime
 import base64
+import functools
+import hmac
 import telebot
-from urllib.parse import quote
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from utils import messages
 
 # Добавление пути проекта к sys.path
@@ -17,92 +19,42 @@ project_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_path)
 
 # Импорт модулей проекта
-from config import BOT_TOKEN, BOT_USERNAME
-from database.db_manager import DatabaseManager
+import config
+from database.db_manager import get_db_manager
 from utils.bot_helpers import send_subscription_info, finalize_profile_purchase
 from utils.config_generator import ConfigGenerator
 from api_client.xui_api_client import XuiAPIClient # Для обычной покупки
+from utils.single_flight import SingleFlight
+from utils.config_refresh import ConfigRefresher, JOB_REFRESH_ALL
 
 # Начальные настройки
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-db_manager = DatabaseManager()
-bot = telebot.TeleBot(BOT_TOKEN)
-# Экземпляр генератора конфигураций для обычной покупки
-config_gen_normal = ConfigGenerator(db_manager)
+# Обновление конфигураций из панели: не более одного одновременного запроса на покупку
+_config_refresh_flight = SingleFlight(thread_name_prefix="config-refresh")
 
-ZARINPAL_VERIFY_URL = "https://api.zarinpal.com/pg/v4/payment/verify.json"
-BOT_USERNAME = BOT_USERNAME
-
-# --- Вспомогательная функция для построения конфигурации ---
-def build_config_link(synced_config, client_uuid, client_remark):
-    """
-    С использованием сырых синхронизированных данных и основного адреса сервера строит финальную ссылку конфигурации.
-    """
-    try:
-        # --- Основное исправление здесь ---
-        # Читаем адрес из данных самой конфигурации, а не из антифильтр-домена
-        server_address = synced_config['subscription_base_url'].split('//')[-1].split(':')[0].split('/')[0]
-        
-        port = synced_config['port']
-        remark = f"{client_remark} - {synced_config['remark']}"
-        
-        if synced_config['protocol'] == 'vless':
-            stream_settings = json.loads(synced_config['stream_settings'])
-            protocol_settings = json.loads(synced_config['settings'])
-            
-            params = {
-                'type': stream_settings.get('network', 'tcp'),
-                'security': stream_settings.get('security', 'none')
-            }
-
-            flow = protocol_settings.get('clients', [{}])[0].get('flow', '')
-            if flow:
-                params['flow'] = flow
 
-            if params['security'] == 'tls':
-                tls_settings = stream_settings.get('tlsSettings', {})
-                nested_tls_settings = tls_settings.get('settings', {})
-                params['fp'] = nested_tls_settings.get('fingerprint', '')
-                params['sni'] = tls_settings.get('serverName', server_address)
+# Бот и генераторы создаются при первом запросе, а не при импорте модуля (воркеры gunicorn стартуют быстрее)
+@functools.lru_cache(maxsize=None)
+def _get_bot():
+    # Только отправка сообщений; обновления принимает бот (main.py / bot_webhook.py)
+    return telebot.TeleBot(config.BOT_TOKEN)
 
-            if params['security'] == 'reality':
-                reality_settings = stream_settings.get('realitySettings', {})
-                nested_reality_settings = reality_settings.get('settings', {})
-                params['pbk'] = nested_reality_settings.get('publicKey', '')
-                params['fp'] = nested_reality_settings.get('fingerprint', '')
-                params['sni'] = reality_settings.get('serverName', server_address)
-                params['sid'] = reality_settings.get('shortId', '')
 
-            if params['type'] == 'ws':
-                ws_settings = stream_settings.get('wsSettings', {})
-                params['path'] = ws_settings.get('path', '/')
-                params['host'] = ws_settings.get('headers', {}).get('Host', server_address)
+@functools.lru_cache(maxsize=None)
+def _get_config_generator():
+    # Экземпляр генератора конфигураций для обычной покупки
+    return ConfigGenerator(get_db_manager())
 
-            if params['type'] == 'grpc':
-                grpc_settings = stream_settings.get('grpcSettings', {})
-                params['serviceName'] = grpc_settings.get('serviceName', '')
 
-            # Построение строки параметров
-            param_str = '&'.join([f"{k}={quote(v)}" for k, v in params.items() if v])
+@functools.lru_cache(maxsize=None)
+def _get_config_refresher():
+    return ConfigRefresher(get_db_manager())
 
-            return f"vless://{client_uuid}@{server_address}:{port}?{param_str}#{quote(remark)}"
 
-        elif synced_config['protocol'] == 'vmess':
-            # Логика для VMess
-            pass
-
-        elif synced_config['protocol'] == 'trojan':
-            # Логика для Trojan
-            pass
-
-        return None
-
-    except Exception as e:
-        logger.error(f"Error building config link: {e}")
-        return None
+ZARINPAL_VERIFY_URL = "https://api.zarinpal.com/pg/v4/payment/verify.json"
 
 # --- Endpoint для проверки платежа ---
 @app.route('/payment/verify', methods=['GET'])
@@ -118,12 +70,12 @@ def payment_verify():
         return render_template('payment_status.html', status='failed', message='پرداخت لغو شد یا ناموفق بود.')
 
     try:
-        purchase = db_manager.get_purchase_by_authority(authority)
+        purchase = get_db_manager().get_purchase_by_authority(authority)
         if not purchase:
             logger.error(f"No purchase found for authority {authority}")
             return render_template('payment_status.html', status='failed', message='خرید مرتبط یافت نشد.')
 
-        payment = db_manager.get_payment_by_authority(authority)
+        payment = get_db_manager().get_payment_by_authority(authority)
         if not payment:
             logger.error(f"No payment found for authority {authority}")
             return render_template('payment_status.html', status='failed', message='پرداخت مرتبط یافت نشد.')
@@ -142,22 +94,23 @@ def payment_verify():
             ref_id = verify_result['data']['ref_id']
             
             # Обновление статуса платежа
-            db_manager.confirm_payment(payment['id'], ref_id)
+            get_db_manager().confirm_payment(payment['id'], ref_id)
 
             # Финализация покупки
             if purchase['profile_id']:
-                finalize_profile_purchase(purchase, bot)
+                finalize_profile_purchase(purchase, _get_bot())
             else:
                 # Для обычной покупки
-                configs, client_details = config_gen_normal.create_subscription_for_server(
+                configs, client_details = _get_config_generator().create_subscription_for_server(
                     purchase['user_id'],
                     purchase['server_id'],
                     purchase['initial_volume_gb'],
                     purchase['duration_days']
                 )
                 if configs:
-                    db_manager.update_purchase_client_details(purchase['id'], client_details)
-                    send_subscription_info(bot, purchase['user_id'], configs)
+                    get_db_manager().update_purchase_client_details(purchase['id'], client_details)
+                    get_db_manager().invalidate_subscription(purchase['id'])
+                    send_subscription_info(_get_bot(), purchase['user_id'], configs)
 
             logger.info(f"Payment verified successfully for authority {authority}, ref_id={ref_id}")
             return render_template('payment_status.html', status='success', ref_id=ref_id)
@@ -178,7 +131,7 @@ def user_update_configs(purchase_id):
     """
     try:
         logger.info(f"User requested config update for purchase {purchase_id}")
-        success = update_cached_configs_from_panel(purchase_id)
+        success = _get_config_refresher().refresh_purchase(purchase_id)
         
         if success:
             logger.info(f"User successfully updated configs for purchase {purchase_id}")
@@ -191,79 +144,110 @@ def user_update_configs(purchase_id):
         logger.error(f"Error in user_update_configs: {e}")
         return Response("Internal server error", status=500)
 
-# --- Функция для обновления кэшированных конфигураций из панели ---
-def update_cached_configs_from_panel(purchase_id):
+# --- Endpoint для подписки ---
+def _subscription_userinfo(purchase):
     """
-    Обновление кэшированных конфигураций из панели.
+    Значение заголовка Subscription-Userinfo (upload/download/total/expire) по снимку трафика покупки.
+    Если снимка ещё нет, объём и срок берутся из самой покупки.
     """
-    try:
-        purchase = db_manager.get_purchase_by_id(purchase_id)
-        if not purchase:
-            logger.error(f"Purchase {purchase_id} not found")
-            return False
-
-        if purchase['profile_id']:
-            # Для профиля
-            profile_inbounds = db_manager.get_inbounds_for_profile(purchase['profile_id'])
-            configs = []
-            for inbound in profile_inbounds:
-                synced_config = db_manager.get_synced_config(inbound['server_id'], inbound['inbound_id'])
-                if synced_config:
-                    config_link = build_config_link(synced_config, purchase['client_uuid'], purchase['client_remark'])
-                    if config_link:
-                        configs.append(config_link)
-            if configs:
-                db_manager.update_purchase_configs(purchase_id, json.dumps(configs))
-                return True
-        else:
-            # Для обычной покупки
-            server = db_manager.get_server_by_id(purchase['server_id'])
-            if server:
-                api_client = get_api_client(server)
-                if api_client:
-                    inbound = api_client.get_inbound(purchase['inbound_id'])
-                    if inbound:
-                        config_link = build_config_link(inbound, purchase['client_uuid'], purchase['client_remark'])
-                        if config_link:
-                            db_manager.update_purchase_configs(purchase_id, json.dumps([config_link]))
-                            return True
-
-        return False
-
-    except Exception as e:
-        logger.error(f"Error updating configs from panel: {e}")
-        return False
+    snapshot = get_db_manager().get_traffic_snapshot(purchase['id'])
+    upload = snapshot['up'] if snapshot else 0
+    download = snapshot['down'] if snapshot else 0
+    total = snapshot['total'] if snapshot and snapshot['total'] else int((purchase.get('initial_volume_gb') or 0) * (1024**3))
+    expire = 0
+    if snapshot and snapshot['expiry_time'] and snapshot['expiry_time'] > 0:
+        expire = snapshot['expiry_time'] // 1000
+    elif isinstance(purchase.get('expire_date'), datetime.datetime):
+        expire = int(purchase['expire_date'].timestamp())
+    return f"upload={upload}; download={download}; total={total}; expire={expire}"
+
+def _is_not_modified(etag, last_modified):
+    """Проверяет условные заголовки запроса (If-None-Match имеет приоритет над If-Modified-Since)."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def _subscription_response(entry, not_modified=False):
+    response = Response(status=304) if not_modified else Response(entry['body'], status=200, mimetype='text/plain')
+    response.set_etag(entry['etag'])
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    response.headers['Subscription-Userinfo'] = entry['userinfo']
+    response.headers['Profile-Update-Interval'] = str(config.SUBSCRIPTION_UPDATE_INTERVAL_HOURS)
+    return response
 
-# --- Endpoint для подписки ---
 @app.route('/sub/<sub_id>', methods=['GET'])
 def get_subscription(sub_id):
     """
     Endpoint для получения конфигураций подписки.
+    Поддерживает ETag/Last-Modified: неизменённая подписка отдаётся ответом 304 без тела.
     """
     try:
         logger.info(f"Subscription request for sub_id {sub_id}")
-        purchase = db_manager.get_purchase_by_sub_id(sub_id)
+        subscription_cache = get_db_manager().get_subscription_cache()
+        cached = subscription_cache.get(sub_id)
+        if cached:
+            entry = cached[0]
+            return _subscription_response(entry, _is_not_modified(entry['etag'], entry['last_modified']))
+
+        purchase = get_db_manager().get_purchase_by_sub_id(sub_id)
         if not purchase:
             logger.error(f"No purchase found for sub_id {sub_id}")
+            subscription_cache.forget(sub_id)
             return Response("Subscription not found", status=404)
 
         configs_json = purchase.get('single_configs_json')
-        if configs_json:
-            configs = json.loads(configs_json)
-            subscription_content = '\n'.join(configs)
-            return Response(subscription_content, status=200, mimetype='text/plain')
-        else:
+        if not configs_json:
             logger.warning(f"No configs found for purchase {purchase['id']}. Fetching from panel.")
-            success = update_cached_configs_from_panel(purchase['id'])
-            if success:
-                return get_subscription(sub_id)  # Рекурсивный вызов для получения обновлённых конфигураций
-            else:
-                return Response("Failed to fetch configs", status=500)
+            # Одновременные запросы одной подписки объединяются в одно обращение к панели
+            try:
+                refreshed = _config_refresh_flight.do(
+                    purchase['id'], lambda: _get_config_refresher().refresh_purchase(purchase['id']), timeout=config.SUBSCRIPTION_REFRESH_WAIT
+                )
+            except FutureTimeoutError:
+                logger.warning(f"Config refresh for purchase {purchase['id']} is still running after {config.SUBSCRIPTION_REFRESH_WAIT}s.")
+                refreshed = False
+
+            if refreshed:
+                # Перечитываем покупку один раз (без рекурсии)
+                purchase = get_db_manager().get_purchase_by_sub_id(sub_id) or purchase
+                configs_json = purchase.get('single_configs_json')
+
+            if not configs_json:
+                # Последний удачный ответ этой же (активной) покупки, пока конфигурации пересобираются
+                stale = subscription_cache.get_stale(sub_id)
+                if stale and stale[1] == purchase['id'] and purchase.get('is_active', True):
+                    logger.info(f"Serving stale subscription for sub_id {sub_id} while configs are refreshed.")
+                    return _subscription_response(stale[0])
+                response = Response("Subscription is being prepared, please retry later", status=503)
+                response.headers['Retry-After'] = '30'
+                return response
+
+        entry = {
+            'body': '\n'.join(json.loads(configs_json)),
+            'etag': purchase.get('configs_hash') or get_db_manager().compute_configs_hash(configs_json),
+            'last_modified': purchase.get('updated_at') or purchase.get('purchase_date'),
+            'userinfo': _subscription_userinfo(purchase),
+        }
+        # Запись кэшируется и при ответе 304: иначе клиенты с действующим ETag после истечения TTL
+        # обращались бы к базе при каждом опросе
+        subscription_cache.put(sub_id, entry, purchase['id'], get_db_manager().subscription_fingerprint(purchase))
+        return _subscription_response(entry, _is_not_modified(entry['etag'], entry['last_modified']))
 
     except Exception as e:
         logger.error(f"Error in get_subscription: {e}")
         return Response("Internal server error", status=500)
 
+def _is_admin_request():
+    """Проверяет заголовок Authorization: Bearer ADMIN_API_KEY; без настроенного ключа доступ закрыт."""
+    if not config.ADMIN_API_KEY:
+        logger.error("ADMIN_API_KEY is not set; admin endpoints are disabled.")
+        return False
+    auth_header = request.headers.get('Authorization') or ''
+    return hmac.compare_digest(auth_header.encode('utf-8'), f"Bearer {config.ADMIN_API_KEY}".encode('utf-8'))
+
 # --- Административный endpoint для обновления всех конфигураций ---
 @app.route('/admin/update_all_configs', methods=['POST'])
 def admin_update_all_configs():
@@ -271,26 +255,34 @@ def admin_update_all_configs():
     Endpoint для обновления всех конфигураций администратором.
     """
     try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or auth_header != 'Bearer your-secret-key':  # Замените на реальный ключ
+        if not _is_admin_request():
             logger.error("Unauthorized access to admin_update_all_configs")
             return Response("Unauthorized", status=401)
 
         logger.info("Admin requested update for all configs")
-        purchases = db_manager.get_all_active_purchases()
-        updated_count = 0
-        for purchase in purchases:
-            success = update_cached_configs_from_panel(purchase['id'])
-            if success:
-                updated_count += 1
+        # Задачу выполняют рабочие потоки очереди в процессе бота
+        job_id = get_db_manager().create_job(JOB_REFRESH_ALL)
+        if not job_id:
+            return Response("Could not create job", status=500)
 
-        logger.info(f"Admin updated {updated_count}/{len(purchases)} configs")
-        return Response(f"Updated {updated_count} configs", status=200)
+        return Response(json.dumps({'job_id': job_id}), status=202, mimetype='application/json')
 
     except Exception as e:
         logger.error(f"Error in admin_update_all_configs: {e}")
         return Response("Internal server error", status=500)
 
+# --- Статус фоновой задачи ---
+@app.route('/admin/jobs/<job_id>', methods=['GET'])
+def admin_job_status(job_id):
+    if not _is_admin_request():
+        logger.error(f"Unauthorized access to admin_job_status for job {job_id}")
+        return Response("Unauthorized", status=401)
+
+    job = get_db_manager().get_job(job_id)
+    if not job:
+        return Response("Job not found", status=404)
+    return Response(json.dumps(job, default=str), status=200, mimetype='application/json')
+
 # --- Административный endpoint для обновления конфигурации конкретной покупки ---
 @app.route('/admin/update_configs/<purchase_id>', methods=['POST'])
 def admin_update_configs(purchase_id):
@@ -298,13 +290,12 @@ def admin_update_configs(purchase_id):
     Endpoint для обновления конфигурации конкретной покупки администратором.
     """
     try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or auth_header != 'Bearer your-secret-key':  # Замените на реальный ключ
+        if not _is_admin_request():
             logger.error(f"Unauthorized access to admin_update_configs for purchase {purchase_id}")
             return Response("Unauthorized", status=401)
 
         logger.info(f"Starting config update for purchase {purchase_id} (type: {'profile' if purchase.get('profile_id') else 'normal'})")
-        success = update_cached_configs_from_panel(int(purchase_id))
+        success = _get_config_refresher().refresh_purchase(int(purchase_id))
         
         if success:
             logger.info(f"Successfully updated configs for purchase {purchase_id}")
@@ -328,7 +319,7 @@ def admin_test_purchase(purchase_id):
     """
     try:
         logger.info(f"🔍 Testing purchase {purchase_id}")
-        purchase = db_manager.get_purchase_by_id(int(purchase_id))
+        purchase = get_db_manager().get_purchase_by_id(int(purchase_id))
         if not purchase:
             logger.error(f"❌ Purchase {purchase_id} not found")
             return Response("Purchase not found", status=404)
@@ -371,4 +362,6 @@ def simple_test():
         return Response("Internal server error", status=500)
 
 if __name__ == '__main__':
+    # Отладочный запуск. В рабочем режиме сервер запускается через gunicorn:
+    #   gunicorn --config gunicorn.conf.py webhook_server:app
     app.run(host='0.0.0.0', port=8080)
\ No newline at end of file